@@ -31,7 +31,7 @@ class ViewerRoboticArm(Viewer):
         self.multiple_color_shader = Shader(COLOR_VERT, COLOR_FRAG_MULTIPLE)
 
     def do_for_each_drawable(self, drawable, view, projection, model, **param):
-        drawable.draw(projection, view, model, self.multiple_color_shader, win=self.win, **param)
+        drawable.draw(projection, view, model, self.multiple_color_shader, **param)
 
 # -------------- main program and scene setup --------------------------------
 def main():
@@ -47,7 +47,8 @@ def main():
     arm_node = RotationControlNode(glfw.KEY_LEFT, glfw.KEY_RIGHT, vec(0, 1, 0))
     arm_node.add(limb_shape)
 
-    base_shape = Node(transform=scale(1.2,base_node_y,1.2), children=[cylinder])
+    # the base never moves: merged into a few meshes on first draw
+    base_shape = Node(transform=scale(1.2,base_node_y,1.2), children=[cylinder], static=True)
     base_node = Node(transform=rotate(axis=(0, 1, 0), angle=90)@scale(0.5,0.5,0.5), children=[base_shape])
 
     base_node.add(arm_node)
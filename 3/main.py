@@ -26,14 +26,12 @@ class Cylinder(Node):
 
 class Suzanne(Node):
     """ Suzanne node """
-    def __init__(self, light_vector):
+    def __init__(self):
         super().__init__()
         # Get the only ione suzanne color mesh
         objects = load("suzanne.obj")
         assert len(objects)
         self.color_mesh = objects[0]
-        # Add the light
-        self.color_mesh.addUniform3fv({"light" :light_vector})
         print(self.color_mesh)
         self.add(self.color_mesh)
 
@@ -41,7 +39,7 @@ class ViewerLambert(Viewer):
     """ Viewer for the robotic arm project """
     
     def do_for_each_drawable(self, drawable, view, projection, model, **param):
-        drawable.draw(projection, view, model, self.shaders, color=(1, 0, 1), win=self.win, **param)
+        drawable.draw(projection, view, model, self.shaders, color=(1, 0, 1), **param)
 
 # -------------- main program and scene setup --------------------------------
 def main():
@@ -51,7 +49,7 @@ def main():
     frag_name = "lambert_frag.glsl"
     viewer = ViewerLambert(shaders_repertory+vert_name, shaders_repertory+frag_name)
     rotator_node = RotationControlNode(glfw.KEY_LEFT, glfw.KEY_RIGHT, vec(0, 1, 0))
-    rotator_node.add(Suzanne(light_vector=(1, 1, 1)))
+    rotator_node.add(Suzanne())
     viewer.add(rotator_node)
     viewer.run()
 
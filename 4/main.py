@@ -12,12 +12,13 @@ import OpenGL.GL as GL              # standard Python OpenGL wrapper
 from PIL import Image               # load images for textures
 from itertools import cycle
 from opengl_tools.viewer import Viewer
-from opengl_tools.shader import Shader
+from opengl_tools.shader_registry import get_shader
 from opengl_tools.loader import load
 from opengl_tools.transform import identity, translate, rotate, scale, vec
 from opengl_tools.color_mesh import ColorMesh
 from opengl_tools.node import Node, RotationControlNode
 from opengl_tools.vertex_array import VertexArray
+from opengl_tools.inputs import bind_key
 import pyassimp
 
 class Cylinder(Node):
@@ -28,14 +29,12 @@ class Cylinder(Node):
 
 class Suzanne(Node):
     """ Suzanne node """
-    def __init__(self, light_vector):
+    def __init__(self):
         super().__init__()
         # Get the only ione suzanne color mesh
         objects = load("suzanne.obj")
         assert len(objects)
         self.color_mesh = objects[0]
-        # Add the light
-        self.color_mesh.addUniform3fv({"light" :light_vector})
         print(self.color_mesh)
         self.add(self.color_mesh)
 
@@ -43,7 +42,7 @@ class ViewerTexture(Viewer):
     """ Viewer for the robotic arm project """
 
     def do_for_each_drawable(self, drawable, view, projection, model, **param):
-        drawable.draw(projection, view, model, win=self.win, **param)
+        drawable.draw(projection, view, model, **param)
 
 
 # -------------- OpenGL Texture Wrapper ---------------------------------------
@@ -78,11 +77,12 @@ class Texture:
 
 # -------------- Example texture plane class ----------------------------------
 TEXTURE_VERT_PLANE = """#version 330 core
-uniform mat4 modelviewprojection;
+#include <frame.glsl>
+uniform mat4 model;
 layout(location = 0) in vec3 position;
 out vec2 fragTexCoord;
 void main() {
-    gl_Position = modelviewprojection * vec4(position, 1);
+    gl_Position = view_projection * model * vec4(position, 1);
     fragTexCoord = position.xy;
 }"""
 
@@ -95,12 +95,13 @@ void main() {
 }"""
 
 TEXTURE_VERT = """#version 330 core
-uniform mat4 modelviewprojection;
+#include <frame.glsl>
+uniform mat4 model;
 layout(location = 0) in vec3 position;
 layout (location = 1) in vec2 aTexCoord;
 out vec2 fragTexCoord;
 void main() {
-    gl_Position = modelviewprojection * vec4(position, 1);
+    gl_Position = view_projection * model * vec4(position, 1);
     fragTexCoord = aTexCoord;
 }"""
 
@@ -116,8 +117,8 @@ class TexturedPlane:
     """ Simple first textured object """
 
     def __init__(self, file):
-        # feel free to move this up in the viewer as per other practicals
-        self.shader = Shader(TEXTURE_VERT_PLANE, TEXTURE_FRAG_PLANE)
+        # program shared by every plane, from the shader registry
+        self.shader = get_shader(TEXTURE_VERT_PLANE, TEXTURE_FRAG_PLANE)
 
         # triangle and face buffers
         vertices = 100 * np.array(((-1, -1, 0), (1, -1, 0), (1, 1, 0), (-1, 1, 0)), np.float32)
@@ -135,23 +136,25 @@ class TexturedPlane:
 
         # setup texture and upload it to GPU
         self.texture = Texture(file, self.wrap_mode, *self.filter_mode)
+        bind_key(glfw.KEY_F6, self.next_wrap)
+        bind_key(glfw.KEY_F7, self.next_filter)
 
-    def draw(self, projection, view, model, win=None, **_kwargs):
-
-        # some interactive elements
-        if glfw.get_key(win, glfw.KEY_F6) == glfw.PRESS:
-            self.wrap_mode = next(self.wrap)
-            self.texture = Texture(self.file, self.wrap_mode, *self.filter_mode)
+    def next_wrap(self):
+        """ F6: next texture wrap mode """
+        self.wrap_mode = next(self.wrap)
+        self.texture = Texture(self.file, self.wrap_mode, *self.filter_mode)
 
-        if glfw.get_key(win, glfw.KEY_F7) == glfw.PRESS:
-            self.filter_mode = next(self.filter)
-            self.texture = Texture(self.file, self.wrap_mode, *self.filter_mode)
+    def next_filter(self):
+        """ F7: next texture filtering mode """
+        self.filter_mode = next(self.filter)
+        self.texture = Texture(self.file, self.wrap_mode, *self.filter_mode)
 
+    def draw(self, projection, view, model, **_kwargs):
         GL.glUseProgram(self.shader.glid)
 
-        # projection geometry
-        loc = GL.glGetUniformLocation(self.shader.glid, 'modelviewprojection')
-        GL.glUniformMatrix4fv(loc, 1, True, projection @ view @ model)
+        # projection geometry, view and projection are in the 'Frame' block
+        loc = GL.glGetUniformLocation(self.shader.glid, 'model')
+        GL.glUniformMatrix4fv(loc, 1, True, model)
 
         # texture access setups
         loc = GL.glGetUniformLocation(self.shader.glid, 'diffuseMap')
@@ -168,8 +171,8 @@ class TexturedMesh:
     """ Simple first textured object """
 
     def __init__(self, texture_file, attributes, indices):
-        # feel free to move this up in the viewer as per other practicals
-        self.shader = Shader(TEXTURE_VERT, TEXTURE_FRAG)
+        # program shared by every textured mesh, from the shader registry
+        self.shader = get_shader(TEXTURE_VERT, TEXTURE_FRAG)
 
         self.vertex_array = VertexArray(attributes, index=indices)
 
@@ -184,23 +187,25 @@ class TexturedMesh:
         self.file = texture_file
         # setup texture and upload it to GPU
         self.texture = Texture(self.file, self.wrap_mode, *self.filter_mode)
+        bind_key(glfw.KEY_F6, self.next_wrap)
+        bind_key(glfw.KEY_F7, self.next_filter)
 
-    def draw(self, projection, view, model, win=None, **_kwargs):
-
-        # some interactive elements
-        if glfw.get_key(win, glfw.KEY_F6) == glfw.PRESS:
-            self.wrap_mode = next(self.wrap)
-            self.texture = Texture(self.file, self.wrap_mode, *self.filter_mode)
+    def next_wrap(self):
+        """ F6: next texture wrap mode """
+        self.wrap_mode = next(self.wrap)
+        self.texture = Texture(self.file, self.wrap_mode, *self.filter_mode)
 
-        if glfw.get_key(win, glfw.KEY_F7) == glfw.PRESS:
-            self.filter_mode = next(self.filter)
-            self.texture = Texture(self.file, self.wrap_mode, *self.filter_mode)
+    def next_filter(self):
+        """ F7: next texture filtering mode """
+        self.filter_mode = next(self.filter)
+        self.texture = Texture(self.file, self.wrap_mode, *self.filter_mode)
 
+    def draw(self, projection, view, model, **_kwargs):
         GL.glUseProgram(self.shader.glid)
 
-        # projection geometry
-        loc = GL.glGetUniformLocation(self.shader.glid, 'modelviewprojection')
-        GL.glUniformMatrix4fv(loc, 1, True, projection @ view @ model)
+        # projection geometry, view and projection are in the 'Frame' block
+        loc = GL.glGetUniformLocation(self.shader.glid, 'model')
+        GL.glUniformMatrix4fv(loc, 1, True, model)
 
         # texture access setups
         loc = GL.glGetUniformLocation(self.shader.glid, 'diffuseMap')
@@ -261,7 +266,7 @@ def main():
     """ create a window, add scene objects, then run rendering loop """
     viewer = ViewerTexture(TEXTURE_VERT, TEXTURE_FRAG)
     # rotator_node = RotationControlNode(glfw.KEY_LEFT, glfw.KEY_RIGHT, vec(0, 1, 0))
-    # rotator_node.add(Suzanne(light_vector=(1, 1, 1)))
+    # rotator_node.add(Suzanne())
     viewer.add(load_textured("cube.obj")[0])
     viewer.run()
 
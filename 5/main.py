@@ -32,14 +32,12 @@ class Cylinder(Node):
 
 class Suzanne(Node):
     """ Suzanne node """
-    def __init__(self, light_vector):
+    def __init__(self):
         super().__init__()
         # Get the only ione suzanne color mesh
         objects = load("suzanne.obj")
         assert len(objects)
         self.color_mesh = objects[0]
-        # Add the light
-        self.color_mesh.addUniform3fv({"light" :light_vector})
         print(self.color_mesh)
         self.add(self.color_mesh)
 
@@ -49,11 +47,18 @@ class KeyFrameControlNode(Node):
         # TODO : Verify
         super().__init__()
         self.keyframes = TransformKeyFrames(translate_keys, rotate_keys, scale_keys)
+        self.time = None            # simulation time of the last update
+        Node.animations.add(self)   # on demand viewers draw while it plays
+
+    def animating(self):
+        """ True until the simulation is past the last key, the simulation
+            keeps drawing until its last two states are drawn """
+        return self.time is None or self.time <= self.keyframes.end()
 
-    def draw(self, projection, view, model, color_shader, **param):
-        """ When redraw requested, interpolate our node transform from keys """
-        self.transform = self.keyframes.value(glfw.get_time())
-        super().draw(projection, view, model, color_shader, **param)
+    def update(self, step, time, inputs):
+        """ Simulation step: our node transform interpolated from keys """
+        self.time = time
+        return self.keyframes.value(time)
 
 class TransformKeyFrames:
     """ KeyFrames-like object dedicated to 3D transforms """
@@ -63,6 +68,11 @@ class TransformKeyFrames:
         self.rotate_keyframes = KeyFrames(rotate_keys, quaternion_slerp)
         self.scale_keyframes = KeyFrames(scale_keys)
 
+    def end(self):
+        """ time of the last key of the 3 sets """
+        return max(keyframes.times[-1] for keyframes in (
+            self.translate_keyframes, self.rotate_keyframes, self.scale_keyframes))
+
     def value(self, time):
         """ Compute each component's interpolation and compose TRS matrix """
         translate_value = translate(self.translate_keyframes.value(time))
@@ -97,11 +107,13 @@ class KeyFrames:
         return self.interpolate(self.values[indexInsertion-1], self.values[indexInsertion],fraction)
 
 class ViewerAnimation(Viewer):
-    """ Viewer for the robotic arm project """
+    """ Viewer for the robotic arm project, F2 restarts the animations """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.input.bind(glfw.KEY_F2, lambda: glfw.set_time(0))
+
     def do_for_each_drawable(self, drawable, view, projection, model, **param):
-        drawable.draw(projection, view, model, self.shaders, color=(1, 0, 1), win=self.win, **param)
-        if glfw.get_key(self.win, glfw.KEY_F2) == glfw.PRESS:
-            glfw.set_time(0)
+        drawable.draw(projection, view, model, self.shaders, color=(1, 0, 1), **param)
 
 def test_key_frames_1d():
     """ Test KeyFrames 1D"""
@@ -135,7 +147,8 @@ def launch_windows():
     shaders_repertory = "../shaders/"
     vert_name = "lambert_vert.glsl"
     frag_name = "lambert_frag.glsl"
-    viewer = ViewerAnimation(shaders_repertory+vert_name, shaders_repertory+frag_name)
+    viewer = ViewerAnimation(shaders_repertory+vert_name, shaders_repertory+frag_name,
+                             on_demand=True)
     translate_keys = {0: vec(0, 0, 0), 2: vec(1, 1, 0), 4: vec(0, 0, 0)}
     rotate_keys = {0: quaternion(), 2: quaternion_from_euler(180, 45, 90),
                    3: quaternion_from_euler(180, 0, 180), 4: quaternion()}
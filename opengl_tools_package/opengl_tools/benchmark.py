@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+Rendering benchmarks in a hidden window, run with
+python3 -m opengl_tools.benchmark [width height]
+"""
+import sys
+import time
+import glfw                         # lean window system wrapper for OpenGL
+import numpy as np
+from opengl_tools.gl import GL, set_mode  # OpenGL functions, see opengl_tools.gl
+from opengl_tools.clustered import ClusteredLights, assign
+from opengl_tools.color_mesh import ColorMesh
+from opengl_tools.deferred import DeferredRenderer
+from opengl_tools.frame_uniforms import FrameUniforms, MAX_LIGHTS
+from opengl_tools.framebuffer import Framebuffer
+from opengl_tools.geometry_pool import GeometryPool, supported as pool_supported
+from opengl_tools.resolution import DynamicResolution
+from opengl_tools.shader_registry import get_shader
+from opengl_tools.shaders_glsl import LAMBERT_VERT, LAMBERT_FRAG
+from opengl_tools.transform import identity, perspective, scale, translate
+from opengl_tools.vertex_array import VertexArray
+
+# lambert pipeline before the normal matrix moved out of the fragment
+# shader: a mat3 varying inverted for every pixel
+LEGACY_LAMBERT_VERT = """#version 330 core
+#include <frame.glsl>
+uniform mat4 model;
+uniform vec3 color;
+layout(location = 0) in vec3 position_in;
+layout(location = 1) in vec3 normals_in;
+out vec3 colors_out;
+out vec3 normals;
+out vec3 light_out;
+out mat3 model_out;
+void main() {
+    model_out = mat3(model);
+    gl_Position = view_projection * model * vec4(position_in, 1);
+    colors_out = color;
+    normals = normals_in;
+    light_out = light_positions[0].xyz;
+}"""
+
+LEGACY_LAMBERT_FRAG = """#version 330 core
+out vec4 outColor;
+in vec3 colors_out;
+in vec3 normals;
+in vec3 light_out;
+in mat3 model_out;
+void main() {
+    vec3 new_normals = transpose(inverse(model_out)) * normals;
+    outColor = vec4(colors_out, 1) * max(dot(normalize(new_normals), normalize(light_out)), 0);
+}"""
+
+def hidden_context(width=640, height=480):
+    """ GLFW window that is never shown, its GL context made current """
+    glfw.init()
+    glfw.window_hint(glfw.CONTEXT_VERSION_MAJOR, 3)
+    glfw.window_hint(glfw.CONTEXT_VERSION_MINOR, 3)
+    glfw.window_hint(glfw.OPENGL_FORWARD_COMPAT, GL.GL_TRUE)
+    glfw.window_hint(glfw.OPENGL_PROFILE, glfw.OPENGL_CORE_PROFILE)
+    glfw.window_hint(glfw.VISIBLE, False)
+    win = glfw.create_window(width, height, 'Benchmark', None, None)
+    glfw.make_context_current(win)
+    return win
+
+def frame_time(draw, frames=20):
+    """ average milliseconds taken by draw(), waiting for the GPU to finish """
+    draw()                              # warm up: shader and buffer setup
+    GL.glFinish()
+    start = time.perf_counter()
+    for _ in range(frames):
+        draw()
+    GL.glFinish()
+    return 1000 * (time.perf_counter() - start) / frames
+
+def layers(count):
+    """ vertex array of count screen covering quads with tilted normals,
+        each one shading every pixel again: a fill rate bound scene """
+    quad = np.array(((-1, -1), (1, -1), (1, 1), (-1, -1), (1, 1), (-1, 1)), np.float32)
+    depth = np.repeat(np.linspace(0.9, -0.9, count, dtype=np.float32), 6)
+    positions = np.column_stack((np.tile(quad, (count, 1)), depth))
+    normals = np.column_stack((positions[:, :2] * 0.5, np.ones(len(positions))))
+    return VertexArray([positions, normals.astype(np.float32)])
+
+def _lights(count):
+    """ count lights, half of them point lights spread around the screen """
+    angles = np.linspace(0, 2 * np.pi, count, endpoint=False)
+    return [((np.cos(a), np.sin(a), 1, i % 2), (1 / count, 1 / count, 1 / count, 4))
+            for i, a in enumerate(angles)]
+
+def lighting(width=1920, height=1080, overdraw=8, light_counts=(1, 4, MAX_LIGHTS), frames=20):
+    """ per fragment normal matrix vs CPU normal matrix with 1 to MAX_LIGHTS
+        lights, printed as milliseconds per frame, returned as a dict """
+    target = Framebuffer(width, height)
+    frame = FrameUniforms()
+    scene = layers(overdraw)
+    model = identity()
+    GL.glDisable(GL.GL_DEPTH_TEST)      # every layer is shaded: pure fill rate
+    GL.glDisable(GL.GL_CULL_FACE)
+
+    def draw_with(shader, lights):
+        def draw():
+            target.bind()
+            GL.glClear(GL.GL_COLOR_BUFFER_BIT)
+            frame.update(identity(), identity(), lights)
+            GL.glUseProgram(shader.glid)
+            GL.glUniformMatrix4fv(GL.glGetUniformLocation(shader.glid, 'model'), 1, True, model)
+            GL.glUniformMatrix3fv(GL.glGetUniformLocation(shader.glid, 'normal_matrix'),
+                                  1, True, model[:3, :3])
+            GL.glUniform3fv(GL.glGetUniformLocation(shader.glid, 'color'), 1, (1, 1, 1))
+            scene.draw(GL.GL_TRIANGLES)
+        return draw
+
+    results = {}
+    cases = [('per fragment normal matrix, 1 light',
+              get_shader(LEGACY_LAMBERT_VERT, LEGACY_LAMBERT_FRAG), _lights(1))]
+    for count in light_counts:
+        cases.append(('CPU normal matrix, %d light(s)' % count,
+                      get_shader(LAMBERT_VERT, LAMBERT_FRAG), _lights(count)))
+        cases.append(('CPU normal matrix, LIGHT_COUNT=%d' % count,
+                      get_shader(LAMBERT_VERT, LAMBERT_FRAG, [('LIGHT_COUNT', count)]),
+                      _lights(count)))
+    print('Lighting %dx%d, %d layers of overdraw' % (width, height, overdraw))
+    for name, shader, lights in cases:
+        results[name] = frame_time(draw_with(shader, lights), frames)
+        print('%-40s %8.2f ms' % (name, results[name]))
+    GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, 0)
+    return results
+
+def clustered(width=1920, height=1080, light_counts=(64, 256, 1024, 4096), frames=20):
+    """ clustered lights in front of a wall seen in perspective, spread on
+        the visible area (density grows with the count) then on an area
+        growing with the count (constant density, most lights off screen).
+        Prints CPU assignment and frame milliseconds, returned as a dict """
+    target = Framebuffer(width, height)
+    frame = FrameUniforms()
+    shader = get_shader(LAMBERT_VERT, LAMBERT_FRAG, ['CLUSTERED', ('LIGHT_COUNT', 0)])
+    wall = np.array(((-1, -1, 0), (1, -1, 0), (1, 1, 0), (-1, -1, 0), (1, 1, 0), (-1, 1, 0)), np.float32)
+    scene = VertexArray([100 * wall, np.tile(np.float32((0, 0, 1)), (6, 1))])
+    view, projection = translate(0, 0, -12), perspective(80, width / height, 0.5, 50)
+    model = identity()
+    GL.glDisable(GL.GL_CULL_FACE)
+    random = np.random.default_rng(0)
+
+    results = {}
+    print('Clustered lights %dx%d' % (width, height))
+    for density in ('growing', 'constant'):
+        for count in light_counts:
+            lights = ClusteredLights()
+            spread = 10 * (np.sqrt(count / light_counts[0]) if density == 'constant' else 1)
+            positions = np.column_stack((random.uniform(-spread, spread, (count, 2)),
+                                         np.full(count, 0.5)))
+            lights.add(positions, random.uniform(0.2, 1, (count, 3)), 1.5)
+            start = time.perf_counter()
+            counts = assign(lights.positions, lights.radii, view, projection)[1]
+            cpu = 1000 * (time.perf_counter() - start)
+
+            def draw():
+                target.bind()
+                GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
+                frame.update(view, projection, (), viewport=(width, height))
+                lights.update(view, projection)
+                GL.glUseProgram(shader.glid)
+                GL.glUniformMatrix4fv(GL.glGetUniformLocation(shader.glid, 'model'), 1, True, model)
+                GL.glUniformMatrix3fv(GL.glGetUniformLocation(shader.glid, 'normal_matrix'),
+                                      1, True, model[:3, :3])
+                GL.glUniform3fv(GL.glGetUniformLocation(shader.glid, 'color'), 1, (1, 1, 1))
+                scene.draw(GL.GL_TRIANGLES)
+            results[density, count] = (cpu, frame_time(draw, frames))
+            print('%s density, %5d lights: assign %6.2f ms, frame %8.2f ms, %5.1f lights'
+                  ' per lit cluster' % (density, count, cpu, results[density, count][1],
+                                        counts[counts > 0].mean()))
+    GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, 0)
+    return results
+
+def deferred(width=1920, height=1080, overdraw=(1, 4, 8), light_count=256, frames=20):
+    """ forward vs deferred shading of walls drawn back to front, each
+        one passing the depth test, lit by clustered lights. Prints frame
+        milliseconds, returned as a dict """
+    target = Framebuffer(width, height)
+    frame = FrameUniforms()
+    view, projection = translate(0, 0, -12), perspective(80, width / height, 0.5, 50)
+    wall = np.array(((-1, -1, 0), (1, -1, 0), (1, 1, 0), (-1, -1, 0), (1, 1, 0), (-1, 1, 0)), np.float32)
+    normals = np.tile(np.float32((0, 0, 1)), (6, 1))
+    lights = ClusteredLights()
+    random = np.random.default_rng(0)
+    lights.add(np.column_stack((random.uniform(-10, 10, (light_count, 2)), np.full(light_count, 0.5))),
+               random.uniform(0.2, 1, (light_count, 3)), 1.5)
+    defines = ['CLUSTERED', ('LIGHT_COUNT', 0)]
+    forward_shader = get_shader(LAMBERT_VERT, LAMBERT_FRAG, defines)
+    renderer = DeferredRenderer(defines)
+    deferred_shader = get_shader(LAMBERT_VERT, LAMBERT_FRAG, defines + ['DEFERRED'])
+    GL.glEnable(GL.GL_DEPTH_TEST)
+    GL.glDisable(GL.GL_CULL_FACE)
+
+    def draw_with(shader, scene, layers, path):
+        def draw():
+            target.bind()
+            GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
+            frame.update(view, projection, (), viewport=(width, height))
+            lights.update(view, projection)
+            if path == 'deferred':
+                renderer.begin((width, height))
+            GL.glUseProgram(shader.glid)
+            GL.glUniformMatrix4fv(GL.glGetUniformLocation(shader.glid, 'model'), 1, True, identity())
+            GL.glUniformMatrix3fv(GL.glGetUniformLocation(shader.glid, 'normal_matrix'),
+                                  1, True, np.identity(3, np.float32))
+            GL.glUniform3fv(GL.glGetUniformLocation(shader.glid, 'color'), 1, (1, 1, 1))
+            scene.draw(GL.GL_TRIANGLES)
+            if path == 'deferred':
+                renderer.end(view, projection, target.glid)
+        return draw
+
+    results = {}
+    print('Forward vs deferred %dx%d, %d clustered lights' % (width, height, light_count))
+    for layers in overdraw:
+        # walls from far to near: every one of them is shaded in forward
+        depths = np.repeat(np.linspace(-layers + 1, 0, layers, dtype=np.float32), 6)
+        positions = np.tile(20 * wall, (layers, 1))
+        positions[:, 2] = depths
+        scene = VertexArray([positions, np.tile(normals, (layers, 1))])
+        for path, shader in (('forward', forward_shader), ('deferred', deferred_shader)):
+            results[path, layers] = frame_time(draw_with(shader, scene, layers, path), frames)
+            print('%-8s %d layers %8.2f ms' % (path, layers, results[path, layers]))
+    GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, 0)
+    return results
+
+def cube():
+    """ (positions, normals) of a cube with flat faces, 36 vertices """
+    corners = np.array([(x, y, z) for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)], np.float32)
+    faces, normals = [], []
+    for axis in range(3):
+        for side in (-1, 1):
+            quad = np.flatnonzero(corners[:, axis] == side)
+            faces += [quad[0], quad[1], quad[3], quad[0], quad[3], quad[2]]
+            normals += 6 * [np.eye(3, dtype=np.float32)[axis] * side]
+    return corners[faces], np.array(normals)
+
+def static_props(width=1920, height=1080, counts=(500, 5000), meshes=50, frames=20):
+    """ static cubes drawn one ColorMesh at a time vs all at once from a
+        GeometryPool, with and without GPU frustum culling. Prints frame
+        milliseconds, returned as a dict """
+    if not pool_supported():
+        print('Static props: geometry pool needs OpenGL 4.3')
+        return {}
+    target = Framebuffer(width, height)
+    frame = FrameUniforms()
+    view, projection = translate(0, 0, -30), perspective(60, width / height, 1, 200)
+    defines = [('LIGHT_COUNT', 1)]
+    shader = get_shader(LAMBERT_VERT, LAMBERT_FRAG, defines)
+    shapes = [ColorMesh(list(cube())) for _ in range(meshes)]
+    random = np.random.default_rng(0)
+    GL.glEnable(GL.GL_DEPTH_TEST)
+    GL.glEnable(GL.GL_CULL_FACE)
+
+    def draw_with(drawables):
+        def draw():
+            target.bind()
+            GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
+            frame.update(view, projection, _lights(1), viewport=(width, height))
+            for mesh, model, color in drawables:
+                mesh.draw(projection, view, model, shader, color=color)
+        return draw
+
+    results = {}
+    print('Static props %dx%d, %d different meshes' % (width, height, meshes))
+    for count in counts:
+        props = [(shapes[number % meshes], translate(*random.uniform(-30, 30, 3)) @ scale(0.3),
+                  random.uniform(0.3, 1, 3)) for number in range(count)]
+        pool, culled = GeometryPool(defines), GeometryPool(defines, culling=True)
+        for mesh, model, color in props:
+            pool.add(mesh, model, color)
+            culled.add(mesh, model, color)
+        for name, drawables in (('one draw per mesh', props),
+                                ('geometry pool', [(pool, identity(), None)]),
+                                ('GPU culled pool', [(culled, identity(), None)])):
+            results[name, count] = frame_time(draw_with(drawables), frames)
+            print('%-18s %5d props %8.2f ms' % (name, count, results[name, count]))
+    GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, 0)
+    return results
+
+def dynamic_resolution(width=1920, height=1080, overdraw=32, budgets=(None, 8, 4), frames=60):
+    """ fill rate bound walls rendered at full size, then under frame
+        budgets by DynamicResolution. Prints the scale reached and the
+        frame milliseconds once settled, returned as a dict """
+    target = Framebuffer(width, height)
+    frame = FrameUniforms()
+    view, projection = translate(0, 0, -12), perspective(80, width / height, 0.5, 50)
+    shader = get_shader(LAMBERT_VERT, LAMBERT_FRAG, [('LIGHT_COUNT', 4)])
+    wall = np.array(((-1, -1, 0), (1, -1, 0), (1, 1, 0), (-1, -1, 0), (1, 1, 0), (-1, 1, 0)), np.float32)
+    positions = np.tile(20 * wall, (overdraw, 1))
+    positions[:, 2] = np.repeat(np.linspace(-overdraw + 1, 0, overdraw, dtype=np.float32), 6)
+    scene = VertexArray([positions, np.tile(np.float32((0, 0, 1)), (6 * overdraw, 1))])
+    GL.glEnable(GL.GL_DEPTH_TEST)
+    GL.glDisable(GL.GL_CULL_FACE)
+
+    def draw_with(resolution):
+        def draw():
+            if resolution is None:
+                target.bind()
+                GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
+                viewport = (width, height)
+            else:
+                viewport = resolution.begin((width, height))
+            frame.update(view, projection, _lights(4), viewport=viewport)
+            GL.glUseProgram(shader.glid)
+            GL.glUniformMatrix4fv(GL.glGetUniformLocation(shader.glid, 'model'), 1, True, identity())
+            GL.glUniformMatrix3fv(GL.glGetUniformLocation(shader.glid, 'normal_matrix'),
+                                  1, True, np.identity(3, np.float32))
+            GL.glUniform3fv(GL.glGetUniformLocation(shader.glid, 'color'), 1, (1, 1, 1))
+            scene.draw(GL.GL_TRIANGLES)
+            if resolution is not None:
+                resolution.end((width, height), target.glid)
+        return draw
+
+    results = {}
+    print('Dynamic resolution %dx%d, %d layers' % (width, height, overdraw))
+    for budget in budgets:
+        resolution = DynamicResolution(budget) if budget else None
+        draw = draw_with(resolution)
+        for _ in range(frames):         # let the scale settle
+            draw()
+            GL.glFinish()
+        scale_ = resolution.scale if resolution else 1.
+        results[budget] = (scale_, frame_time(draw, frames // 3))
+        print('budget %-5s scale %.2f %8.2f ms' % (budget and '%g ms' % budget, *results[budget]))
+    GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, 0)
+    return results
+
+def dispatch(count=2000, frames=20):
+    """ CPU bound frames of count small ColorMesh draws, through PyOpenGL
+        vs the raw ctypes functions of opengl_tools.gl, then with error
+        checks. Prints frame milliseconds and GL calls per draw, returned
+        as a dict """
+    target = Framebuffer(64, 64)        # a few pixels: only the calls cost
+    frame = FrameUniforms()
+    view, projection = translate(0, 0, -30), perspective(60, 1, 1, 200)
+    shader = get_shader(LAMBERT_VERT, LAMBERT_FRAG, [('LIGHT_COUNT', 1)])
+    mesh = ColorMesh(list(cube()))
+    random = np.random.default_rng(0)
+    props = [(translate(*random.uniform(-10, 10, 3)), random.uniform(0.3, 1, 3))
+             for _ in range(count)]
+
+    def draw():
+        target.bind()
+        GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
+        frame.update(view, projection, _lights(1), viewport=(64, 64))
+        for model, color in props:
+            mesh.draw(projection, view, model, shader, color=color)
+
+    results = {}
+    print('GL dispatch, %d ColorMesh draws' % count)
+    for name, mode in (('PyOpenGL', dict(raw=False)), ('raw ctypes', dict(raw=True)),
+                       ('raw ctypes, debug', dict(raw=True, debug=True))):
+        set_mode(**mode)
+        results[name] = frame_time(draw, frames)
+        print('%-18s %8.2f ms' % (name, results[name]))
+    set_mode(count=True)
+    GL.calls.clear()
+    draw()
+    print('%.1f GL calls per draw' % (sum(GL.calls.values()) / count))
+    set_mode()
+    GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, 0)
+    return results
+
+def main(arguments):
+    """ run the benchmarks at the resolution given on the command line """
+    width, height = (int(size) for size in arguments[:2]) if len(arguments) >= 2 else (1920, 1080)
+    hidden_context()
+    lighting(width, height)
+    clustered(width, height)
+    deferred(width, height)
+    static_props(width, height)
+    dynamic_resolution(width, height)
+    dispatch()
+    glfw.terminate()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
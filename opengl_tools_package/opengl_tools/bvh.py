@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Bounding volume hierarchies for ray picking
+MeshBVH: binned SAH tree over the triangles of one mesh, in mesh space
+SceneBVH: tree over the world boxes of every mesh below some Nodes,
+refitted when node transforms change
+"""
+from collections import namedtuple
+import numpy as np
+from opengl_tools.gl import GL      # OpenGL functions, see opengl_tools.gl
+from opengl_tools.transform import identity
+from opengl_tools.vertex_array import packed
+
+LEAF_SIZE = 8                       # primitives under which a node is a leaf
+BINS = 16                           # SAH candidate planes per axis
+
+# closest intersection found by a pick
+Hit = namedtuple('Hit', 'node mesh triangle barycentric distance point')
+
+def _area(low, high):
+    """ half surface area of boxes, the SAH cost measure """
+    extent = np.maximum(high - low, 0)
+    return extent[..., 0] * extent[..., 1] + extent[..., 1] * extent[..., 2] \
+        + extent[..., 2] * extent[..., 0]
+
+def _best_split(lows, highs, centroids, bins):
+    """ binned SAH: (cost, axis, bin index of each primitive, split bin) """
+    best = (np.inf, None, None, None)
+    low, high = centroids.min(axis=0), centroids.max(axis=0)
+    for axis in range(3):
+        extent = high[axis] - low[axis]
+        if extent <= 0:
+            continue
+        index = ((centroids[:, axis] - low[axis]) * (bins / extent)).astype(np.int64)
+        index = np.minimum(index, bins - 1)
+        counts = np.bincount(index, minlength=bins)
+        bin_low = np.full((bins, 3), np.inf)
+        bin_high = np.full((bins, 3), -np.inf)
+        np.minimum.at(bin_low, index, lows)
+        np.maximum.at(bin_high, index, highs)
+        # boxes and counts left and right of each of the bins - 1 planes
+        left = _area(np.minimum.accumulate(bin_low)[:-1], np.maximum.accumulate(bin_high)[:-1])
+        right = _area(np.minimum.accumulate(bin_low[::-1])[::-1][1:],
+                      np.maximum.accumulate(bin_high[::-1])[::-1][1:])
+        left_count = np.cumsum(counts)[:-1]
+        right_count = len(centroids) - left_count
+        cost = np.where((left_count > 0) & (right_count > 0),
+                        left * left_count + right * right_count, np.inf)
+        split = int(np.argmin(cost))
+        if cost[split] < best[0]:
+            best = (cost[split], axis, index, split + 1)
+    return best
+
+def build(lows, highs, leaf_size=LEAF_SIZE, bins=BINS):
+    """ SAH tree over primitive boxes, return (order, low, high, child,
+        start, count): primitives of leaf i are order[start[i]:start[i] +
+        count[i]], children of inner node i are child[i] and child[i] + 1 """
+    lows, highs = np.asarray(lows, np.float64), np.asarray(highs, np.float64)
+    centroids = (lows + highs) / 2
+    order = np.arange(len(lows))
+    low, high, child, start, count = [None], [None], [-1], [0], [len(lows)]
+    stack = [0]
+    while stack:
+        node = stack.pop()
+        first, items = start[node], order[start[node]:start[node] + count[node]]
+        low[node], high[node] = lows[items].min(axis=0), highs[items].max(axis=0)
+        if len(items) <= leaf_size:
+            continue
+        cost, _, index, split = _best_split(lows[items], highs[items], centroids[items], bins)
+        if cost >= len(items) * _area(low[node], high[node]):
+            continue  # splitting costs more than testing everything
+        mask = index < split
+        order[first:first + len(items)] = np.concatenate((items[mask], items[~mask]))
+        child[node] = len(low)
+        middle = int(np.count_nonzero(mask))
+        for offset, size in ((0, middle), (middle, len(items) - middle)):
+            low.append(None), high.append(None), child.append(-1)
+            start.append(first + offset), count.append(size)
+            stack.append(len(low) - 1)
+    return order, np.array(low), np.array(high), child, start, count
+
+def _ray_boxes(origin, inverse, low, high, limit):
+    """ entry distances of the ray in the boxes, inf when missed """
+    near = (low - origin) * inverse
+    far = (high - origin) * inverse
+    enter = np.minimum(near, far).max(axis=-1)
+    leave = np.maximum(near, far).min(axis=-1)
+    return np.where((enter <= leave) & (leave >= 0) & (enter <= limit),
+                    np.maximum(enter, 0), np.inf)
+
+def _inverse(direction):
+    """ per component inverse of a direction, without division by zero """
+    direction = np.where(np.abs(direction) < 1e-30, 1e-30, direction)
+    return 1 / direction
+
+class MeshBVH:
+    """ BVH over the triangles of one indexed mesh, in its local space """
+
+    def __init__(self, vertices, faces, leaf_size=LEAF_SIZE, bins=BINS):
+        vertices = np.asarray(vertices, np.float64).reshape(-1, 3)
+        faces = np.asarray(faces, np.int64).reshape(-1, 3)
+        triangles = vertices[faces]
+        tree = build(triangles.min(axis=1), triangles.max(axis=1), leaf_size, bins)
+        order, self.low, self.high, self.child, self.start, self.count = tree
+        self.triangles = order
+        # triangles stored in leaf order, so a leaf is a contiguous slice
+        self.v0 = triangles[order, 0]
+        self.e1 = triangles[order, 1] - self.v0
+        self.e2 = triangles[order, 2] - self.v0
+
+    def bounds(self):
+        """ (low, high) box of the whole mesh """
+        return self.low[0], self.high[0]
+
+    def leaves(self, origin, direction, limit=np.inf):
+        """ slices of stored triangles in the leaves crossed by the ray """
+        inverse = _inverse(direction)
+        stack, slices = [0], []
+        while stack:
+            node = stack.pop()
+            if self.child[node] < 0:
+                slices.append(slice(self.start[node], self.start[node] + self.count[node]))
+                continue
+            left = self.child[node]
+            # both children tested in one go
+            distances = _ray_boxes(origin, inverse, self.low[left:left + 2],
+                                   self.high[left:left + 2], limit)
+            stack.extend(left + i for i in np.argsort(-distances) if distances[i] < np.inf)
+        return slices
+
+    def intersect(self, origin, direction, limit=np.inf):
+        """ closest hit (distance, triangle, (u, v)) along origin + t * direction
+            with t in [0, limit], or None. Leaf triangles are all tested at
+            once with a vectorized Moller-Trumbore """
+        slices = self.leaves(origin, direction, limit)
+        if not slices:
+            return None
+        candidates = np.concatenate([np.arange(s.start, s.stop) for s in slices])
+        v0, e1, e2 = self.v0[candidates], self.e1[candidates], self.e2[candidates]
+        p = np.cross(direction, e2)
+        det = (e1 * p).sum(axis=1)
+        valid = np.abs(det) > 1e-12
+        inv_det = np.where(valid, 1 / np.where(valid, det, 1), 0)
+        s = origin - v0
+        u = (s * p).sum(axis=1) * inv_det
+        q = np.cross(s, e1)
+        v = (q @ direction) * inv_det
+        t = (e2 * q).sum(axis=1) * inv_det
+        valid &= (u >= 0) & (v >= 0) & (u + v <= 1) & (t >= 0) & (t <= limit)
+        if not valid.any():
+            return None
+        best = np.flatnonzero(valid)[np.argmin(t[valid])]
+        return t[best], int(self.triangles[candidates[best]]), (u[best], v[best])
+
+def mesh_bvh(mesh):
+    """ MeshBVH of a ColorMesh, built once and kept on the mesh """
+    if getattr(mesh, 'bvh', None) is None:
+        positions = packed(mesh.attributes[0])     # glTF views are interleaved
+        faces = mesh.index if mesh.index is not None else \
+            np.arange(len(positions)).reshape(-1, 3)
+        faces = getattr(mesh, 'levels', [faces])[0]  # full detail of a LODMesh
+        mesh.bvh = MeshBVH(positions, faces)
+    return mesh.bvh
+
+def _instances(drawables, model=identity(), node=None):
+    """ (node, mesh, world matrix) of every triangle mesh below drawables,
+        geometry pool objects included """
+    stack, instances = [(drawable, model, node) for drawable in drawables], []
+    while stack:
+        drawable, model, node = stack.pop()
+        if hasattr(drawable, 'children'):
+            model = model @ drawable.transform
+            stack.extend((child, model, drawable) for child in drawable.children)
+        elif getattr(drawable, 'primitive', None) == GL.GL_TRIANGLES and \
+                hasattr(drawable, 'attributes'):
+            instances.append((node, drawable, model))
+        elif hasattr(drawable, 'instances'):
+            instances.extend((owner or node, mesh, model @ object_model)
+                             for owner, mesh, object_model in drawable.instances())
+    return instances
+
+def _world_boxes(bvhs, matrices):
+    """ world boxes of local boxes moved by matrices, from their 8 corners """
+    low = np.array([bvh.low[0] for bvh in bvhs])
+    high = np.array([bvh.high[0] for bvh in bvhs])
+    center, half = (low + high) / 2, (high - low) / 2
+    rotation = np.asarray(matrices)[:, :3, :3]
+    world = np.einsum('nij,nj->ni', rotation, center) + np.asarray(matrices)[:, :3, 3]
+    extent = np.einsum('nij,nj->ni', np.abs(rotation), half)
+    return world - extent, world + extent
+
+class SceneBVH:
+    """ top level BVH over the meshes below a list of drawables (Nodes) """
+
+    def __init__(self, drawables):
+        self.drawables = drawables
+        self.rebuild()
+
+    def rebuild(self):
+        """ full build, needed when the hierarchy itself changes """
+        self.instances = _instances(self.drawables)
+        self.bvhs = [mesh_bvh(mesh) for _, mesh, _ in self.instances]
+        self.matrices = [np.array(model, np.float64) for _, _, model in self.instances]
+        self.inverses = [np.linalg.inv(model) for model in self.matrices]
+        if not self.instances:
+            self.tree = None
+            return
+        lows, highs = _world_boxes(self.bvhs, self.matrices)
+        self.tree = build(lows, highs, leaf_size=2)
+
+    def update(self):
+        """ refit boxes of instances whose world matrix changed, rebuilding
+            only if meshes were added or removed """
+        instances = _instances(self.drawables)
+        if [mesh for _, mesh, _ in instances] != [mesh for _, mesh, _ in self.instances]:
+            self.rebuild()
+            return
+        self.instances = instances
+        changed = [i for i, (_, _, model) in enumerate(instances)
+                   if not np.array_equal(model, self.matrices[i])]
+        if not changed:
+            return
+        for i in changed:
+            self.matrices[i] = np.array(instances[i][2], np.float64)
+            self.inverses[i] = np.linalg.inv(self.matrices[i])
+        self.refit()
+
+    def refit(self):
+        """ recompute every tree box bottom-up, keeping the topology """
+        order, low, high, child, start, count = self.tree
+        lows, highs = _world_boxes(self.bvhs, self.matrices)
+        for node in reversed(range(len(child))):  # children come after parents
+            if child[node] < 0:
+                items = order[start[node]:start[node] + count[node]]
+                low[node], high[node] = lows[items].min(axis=0), highs[items].max(axis=0)
+            else:
+                left = child[node]
+                low[node] = np.minimum(low[left], low[left + 1])
+                high[node] = np.maximum(high[left], high[left + 1])
+
+    def intersect(self, origin, direction):
+        """ closest Hit of a world space ray, or None """
+        if self.tree is None:
+            return None
+        origin, direction = np.asarray(origin, np.float64), np.asarray(direction, np.float64)
+        order, low, high, child, start, count = self.tree
+        inverse, stack, best = _inverse(direction), [0], None
+        while stack:
+            node = stack.pop()
+            limit = np.inf if best is None else best.distance
+            if _ray_boxes(origin, inverse, low[node], high[node], limit) == np.inf:
+                continue
+            if child[node] >= 0:
+                stack.extend((child[node] + 1, child[node]))
+                continue
+            for item in order[start[node]:start[node] + count[node]]:
+                # ray in mesh space: same t since direction is not normalized
+                matrix = self.inverses[item]
+                local = self.bvhs[item].intersect(matrix[:3, :3] @ origin + matrix[:3, 3],
+                                                  matrix[:3, :3] @ direction, limit)
+                if local is not None and (best is None or local[0] < best.distance):
+                    owner, mesh, _ = self.instances[item]
+                    point = origin + local[0] * direction
+                    best = Hit(owner, mesh, local[1], local[2], local[0], point)
+                    limit = local[0]
+        return best
+
+def pick_ray(position, winsize, view, projection):
+    """ world space (origin, direction) under a window position given with
+        y going up, as in GLFWTrackball.mouse; t=1 is the far plane """
+    x = 2 * position[0] / winsize[0] - 1
+    y = 2 * position[1] / winsize[1] - 1
+    unproject = np.linalg.inv(np.asarray(projection @ view, np.float64))
+    near, far = (unproject @ (x, y, z, 1) for z in (-1, 1))
+    near, far = near[:3] / near[3], far[:3] / far[3]
+    return near, far - near
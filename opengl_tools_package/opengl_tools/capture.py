@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Frame capture without stalling the render: glReadPixels into a ring of
+pixel buffer objects, mapped frames later, the pixels written to PNG files
+or piped to an encoder process by a background thread
+"""
+import ctypes
+import os
+import queue
+import struct
+import subprocess
+import threading
+import zlib
+import numpy as np
+from opengl_tools.gl import GL      # OpenGL functions, see opengl_tools.gl
+
+CAPTURE_RING = 3                    # frames in flight between read and map
+WRITER_QUEUE = 8                    # frames waiting for the writer, at most
+
+def png_bytes(pixels, level=1):
+    """ PNG file contents of an RGB or RGBA uint8 image, first row on top """
+    height, width, channels = pixels.shape
+    rows = np.empty((height, 1 + channels * width), np.uint8)
+    rows[:, 0] = 0                  # no filter
+    rows[:, 1:] = pixels.reshape(height, -1)
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + \
+            struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+    color_type = 6 if channels == 4 else 2
+    header = struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + \
+        chunk(b'IDAT', zlib.compress(rows.tobytes(), level)) + chunk(b'IEND', b'')
+
+def ffmpeg_command(output, size, fps=60):
+    """ ffmpeg reading raw bottom-up RGBA frames on stdin into output """
+    return ['ffmpeg', '-loglevel', 'error', '-y', '-f', 'rawvideo', '-pix_fmt', 'rgba',
+            '-s', '%dx%d' % tuple(size), '-r', str(fps), '-i', '-',
+            '-vf', 'vflip', '-pix_fmt', 'yuv420p', output]
+
+class FrameCapture:
+    """ Records size (width, height) frames of the bound read framebuffer.
+        output is a PNG file name pattern like 'frames/%05d.png', or any
+        other file written by the encoder command (ffmpeg by default) fed
+        with raw frames. Call capture() once per frame, before the buffer
+        swap, and close() at the end """
+
+    def __init__(self, output, size, fps=60, ring=CAPTURE_RING, command=None):
+        self.output, self.size = output, tuple(size)
+        self.frame_bytes = 4 * self.size[0] * self.size[1]
+        self.buffers = [int(buffer) for buffer in np.atleast_1d(GL.glGenBuffers(ring))]
+        for buffer in self.buffers:
+            GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, buffer)
+            GL.glBufferData(GL.GL_PIXEL_PACK_BUFFER, self.frame_bytes, None, GL.GL_STREAM_READ)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        self.fences = [None] * ring     # in flight reads, by buffer
+        self.frame = 0                  # frames read so far
+        self.stats = {'frames': 0, 'written': 0, 'read_waits': 0, 'writer_waits': 0}
+
+        self.encoder = None
+        if not output.lower().endswith('.png'):
+            command = command or ffmpeg_command(output, self.size, fps)
+            self.encoder = subprocess.Popen(command, stdin=subprocess.PIPE)
+        elif os.path.dirname(output):
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+        self.queue = queue.Queue(WRITER_QUEUE)
+        self.writer = threading.Thread(target=self._write, name='capture', daemon=True)
+        self.writer.start()
+
+    def capture(self):
+        """ start reading this frame, hand the one read a ring ago over """
+        slot = self.frame % len(self.buffers)
+        if self.fences[slot] is not None:
+            self._retire(slot)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, self.buffers[slot])
+        GL.glPixelStorei(GL.GL_PACK_ALIGNMENT, 1)
+        GL.glReadPixels(0, 0, *self.size, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        self.fences[slot] = (GL.glFenceSync(GL.GL_SYNC_GPU_COMMANDS_COMPLETE, 0), self.frame)
+        self.frame += 1
+
+    def _retire(self, slot):
+        """ copy out the pixels of slot, waiting only if still in flight """
+        fence, number = self.fences[slot]
+        self.fences[slot] = None
+        status = GL.glClientWaitSync(fence, GL.GL_SYNC_FLUSH_COMMANDS_BIT, 0)
+        if status == GL.GL_TIMEOUT_EXPIRED:
+            self.stats['read_waits'] += 1
+            GL.glClientWaitSync(fence, GL.GL_SYNC_FLUSH_COMMANDS_BIT, 10 ** 9)
+        GL.glDeleteSync(fence)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, self.buffers[slot])
+        address = GL.glMapBufferRange(GL.GL_PIXEL_PACK_BUFFER, 0, self.frame_bytes,
+                                      GL.GL_MAP_READ_BIT)
+        pixels = ctypes.string_at(address, self.frame_bytes)
+        GL.glUnmapBuffer(GL.GL_PIXEL_PACK_BUFFER)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        if self.queue.full():
+            self.stats['writer_waits'] += 1     # writer too slow: render waits
+        self.queue.put((number, pixels))
+        self.stats['frames'] += 1
+
+    def _write(self):
+        """ writer thread: frames from the queue to files or the encoder """
+        failed = False
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            number, pixels = item
+            if failed:
+                continue                # keep emptying the queue, not to block
+            try:
+                if self.encoder is not None:
+                    self.encoder.stdin.write(pixels)
+                else:
+                    image = np.frombuffer(pixels, np.uint8).reshape(self.size[1], self.size[0], 4)
+                    # RGB: the alpha cleared in the framebuffer is not opacity
+                    with open(self.output % number, 'wb') as file:
+                        file.write(png_bytes(image[::-1, :, :3]))
+                self.stats['written'] += 1
+            except (OSError, ValueError) as error:
+                print('ERROR: frame capture stopped,', error)
+                failed = True
+
+    def close(self):
+        """ hand over the frames still in flight, wait for the writer """
+        for offset in range(len(self.buffers)):
+            slot = (self.frame + offset) % len(self.buffers)
+            if self.fences[slot] is not None:
+                self._retire(slot)
+        self.queue.put(None)
+        self.writer.join()
+        if self.encoder is not None:
+            try:
+                self.encoder.stdin.close()
+            except OSError:
+                pass                    # encoder already gone, error printed
+            self.encoder.wait()
+        GL.glDeleteBuffers(len(self.buffers), self.buffers)
+        self.buffers = []
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Clustered forward shading: point lights sorted on the CPU into a grid of
+view space clusters (screen tiles x exponential depth slices), fetched
+by the CLUSTERED variant of lights.glsl from texture buffers
+"""
+import numpy as np
+from opengl_tools.gl import GL      # OpenGL functions, see opengl_tools.gl
+from opengl_tools.frame_uniforms import near_far, FRAME_SAMPLERS
+
+CLUSTER_GRID = (16, 9, 24)          # tiles along x, y and depth slices
+# samplers of the light data, cluster (offset, count) and light index buffers
+CLUSTER_SAMPLERS = ('cluster_lights', 'cluster_grid', 'cluster_indices')
+CLUSTER_UNITS = tuple(FRAME_SAMPLERS[name] for name in CLUSTER_SAMPLERS)
+
+# corners of the unit box, to bound a sphere on screen
+_CORNERS = np.array([(x, y, z) for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)], np.float64)
+
+def cluster_ranges(positions, radii, view, projection, grid=CLUSTER_GRID):
+    """ per light (low, high) inclusive cluster coordinates of the box
+        around its sphere, and the mask of lights in the view frustum """
+    grid = np.asarray(grid)
+    near, far = near_far(projection)
+    center = positions @ np.asarray(view, np.float64)[:3, :3].T + np.asarray(view)[:3, 3]
+    depth = -center[:, 2]
+    visible = (depth + radii > near) & (depth - radii < far)
+
+    # depth slices are exponential: slice = log(depth / near) / log(far / near)
+    slices = grid[2] / np.log(far / near)
+    z_low = np.log(np.clip(depth - radii, near, far) / near) * slices
+    z_high = np.log(np.clip(depth + radii, near, far) / near) * slices
+
+    # screen bounds of the view space box around the sphere, whole screen
+    # when the box crosses the camera plane
+    corners = center[:, None] + radii[:, None, None] * _CORNERS
+    projection = np.asarray(projection, np.float64)[[0, 1, 3]]
+    clip = corners @ projection[:, :3].T + projection[:, 3]    # x, y, w
+    inside = np.all(clip[..., 2] > 0, axis=1)
+    ndc = clip[..., :2] / np.where(clip[..., 2:] > 0, clip[..., 2:], 1)
+    ndc_low = np.where(inside[:, None], ndc.min(axis=1), -1)
+    ndc_high = np.where(inside[:, None], ndc.max(axis=1), 1)
+    xy_low, xy_high = (ndc_low + 1) / 2 * grid[:2], (ndc_high + 1) / 2 * grid[:2]
+    visible &= np.all((xy_high >= 0) & (xy_low < grid[:2]), axis=1)
+
+    low = np.column_stack((xy_low, z_low)).astype(np.int64)
+    high = np.column_stack((xy_high, z_high)).astype(np.int64)
+    return np.clip(low, 0, grid - 1), np.clip(high, 0, grid - 1), visible
+
+def assign(positions, radii, view, projection, grid=CLUSTER_GRID):
+    """ light lists of every cluster: (offsets, counts, indices) so that the
+        lights of cluster (x, y, z) are indices[offset:offset + count] at
+        offset, count = offsets[i], counts[i] with i = (z * gy + y) * gx + x """
+    positions = np.asarray(positions, np.float64).reshape(-1, 3)
+    radii = np.asarray(radii, np.float64).ravel()
+    clusters = int(np.prod(grid))
+    low, high, visible = cluster_ranges(positions, radii, view, projection, grid)
+    size = high - low + 1
+    per_light = np.where(visible, size.prod(axis=1), 0)
+
+    # one (light, cluster) pair per covered cluster, all lights at once
+    light = np.repeat(np.arange(len(positions)), per_light)
+    first = np.repeat(np.cumsum(per_light) - per_light, per_light)
+    local = np.arange(len(light)) - first
+    x = low[light, 0] + local % size[light, 0]
+    local //= size[light, 0]
+    y = low[light, 1] + local % size[light, 1]
+    z = low[light, 2] + local // size[light, 1]
+    cluster = (z * grid[1] + y) * grid[0] + x
+
+    order = np.argsort(cluster, kind='stable')
+    counts = np.bincount(cluster, minlength=clusters)
+    offsets = np.cumsum(counts) - counts
+    return offsets.astype(np.uint32), counts.astype(np.uint32), light[order].astype(np.uint32)
+
+class TextureBuffer:
+    """ buffer object read in shaders through a samplerBuffer """
+
+    def __init__(self, internal_format):
+        self.buffer = GL.glGenBuffers(1)
+        self.glid = GL.glGenTextures(1)
+        self.internal_format = internal_format
+
+    def upload(self, data):
+        """ replace the whole content, the buffer is orphaned every time """
+        data = np.ascontiguousarray(data)
+        GL.glBindBuffer(GL.GL_TEXTURE_BUFFER, self.buffer)
+        GL.glBufferData(GL.GL_TEXTURE_BUFFER, max(data.nbytes, 16), data if data.nbytes else None,
+                        GL.GL_STREAM_DRAW)
+        GL.glBindBuffer(GL.GL_TEXTURE_BUFFER, 0)
+        GL.glBindTexture(GL.GL_TEXTURE_BUFFER, self.glid)
+        GL.glTexBuffer(GL.GL_TEXTURE_BUFFER, self.internal_format, self.buffer)
+        GL.glBindTexture(GL.GL_TEXTURE_BUFFER, 0)
+
+    def bind(self, unit):
+        GL.glActiveTexture(GL.GL_TEXTURE0 + unit)
+        GL.glBindTexture(GL.GL_TEXTURE_BUFFER, self.glid)
+        GL.glActiveTexture(GL.GL_TEXTURE0)
+
+    def __del__(self):
+        GL.glDeleteTextures([self.glid])
+        GL.glDeleteBuffers(1, [self.buffer])
+
+class ClusteredLights:
+    """ Any number of point lights, assigned to clusters every frame """
+
+    def __init__(self, grid=CLUSTER_GRID):
+        self.grid = tuple(grid)
+        self.positions = np.zeros((0, 3), np.float32)
+        self.colors = np.zeros((0, 3), np.float32)
+        self.radii = np.zeros(0, np.float32)
+        self.lights = TextureBuffer(GL.GL_RGBA32F)    # position radius, color
+        self.clusters = TextureBuffer(GL.GL_RG32UI)   # offset, count
+        self.indices = TextureBuffer(GL.GL_R32UI)
+        self.dirty = True
+
+    def add(self, positions, colors, radii):
+        """ add lights from (n, 3) positions, (n, 3) colors and n radii """
+        positions = np.asarray(positions, np.float32).reshape(-1, 3)
+        self.positions = np.concatenate((self.positions, positions))
+        self.colors = np.concatenate((self.colors, np.asarray(colors, np.float32).reshape(-1, 3)))
+        self.radii = np.concatenate((self.radii, np.broadcast_to(
+            np.asarray(radii, np.float32), len(positions))))
+        self.dirty = True
+
+    def update(self, view, projection):
+        """ assign the lights to the clusters of this camera and upload """
+        if self.dirty:   # light data only changes when lights do
+            data = np.zeros((len(self.positions), 2, 4), np.float32)
+            data[:, 0, :3], data[:, 0, 3], data[:, 1, :3] = self.positions, self.radii, self.colors
+            self.lights.upload(data)
+            self.dirty = False
+        offsets, counts, indices = assign(self.positions, self.radii, view, projection, self.grid)
+        self.clusters.upload(np.column_stack((offsets, counts)))
+        self.indices.upload(indices)
+        self.bind()
+
+    def bind(self):
+        """ bind the three texture buffers to CLUSTER_UNITS """
+        for buffer, unit in zip((self.lights, self.clusters, self.indices), CLUSTER_UNITS):
+            buffer.bind(unit)
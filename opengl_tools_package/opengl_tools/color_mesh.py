@@ -4,7 +4,8 @@ ColorMesh, high level object for an object
 """
 
 from opengl_tools.vertex_array import VertexArray
-import OpenGL.GL as GL              # standard Python OpenGL wrapper
+from opengl_tools.transform import normal_matrix
+from opengl_tools.gl import GL      # OpenGL functions, see opengl_tools.gl
 
 class ColorMesh:
     """ ColorMesh, high level object for an object """
@@ -16,6 +17,8 @@ class ColorMesh:
         self.primitive=primitive
         self.usage = usage
         self.uniforms3fv=uniforms
+        self.index_range = (None, 0)    # (count, first) index sub-range drawn
+        self.normal_matrix = (None, None)  # (model bytes, normal matrix)
         self.vertex_array = VertexArray(self.attributes, self.index, self.usage)
 
     def draw(self, projection, view, model, color_shader, color=(1, 1, 1, 1), **param):
@@ -24,20 +27,22 @@ class ColorMesh:
         """
         GL.glUseProgram(color_shader.glid)
 
-        projection_location = GL.glGetUniformLocation(color_shader.glid, 'projection')
-        view_location = GL.glGetUniformLocation(color_shader.glid, 'view')
+        # projection and view come from the per frame 'Frame' uniform block
         model_location = GL.glGetUniformLocation(color_shader.glid, 'model')
+        normal_location = GL.glGetUniformLocation(color_shader.glid, 'normal_matrix')
         color_location = GL.glGetUniformLocation(color_shader.glid, 'color')
 
-        GL.glUniformMatrix4fv(projection_location, 1, True, projection)
-        GL.glUniformMatrix4fv(view_location, 1, True, view)
         GL.glUniformMatrix4fv(model_location, 1, True, model)
         GL.glUniform3fv(color_location, 1, color)
 
+        # normal matrix inverted on the CPU, only when the model matrix changes
+        if normal_location >= 0:
+            GL.glUniformMatrix3fv(normal_location, 1, True, self.get_normal_matrix(model))
+
         # Add the uniforms parameters
         for key, value in self.uniforms3fv.items():
             location = GL.glGetUniformLocation(color_shader.glid, key)
-            GL.glUniform3fv(location, 1, True, value)
+            GL.glUniform3fv(location, 1, value)
 
         # Add the other parameters
         for key, value in param.items():
@@ -45,7 +50,14 @@ class ColorMesh:
             GL.glUniformMatrix4fv(location, 1, True, value)
 
         # Call the shader
-        self.vertex_array.draw(self.primitive)
+        self.vertex_array.draw(self.primitive, *self.index_range)
+
+    def get_normal_matrix(self, model):
+        """ normal matrix for model, cached while the object does not move """
+        key = model.tobytes()
+        if self.normal_matrix[0] != key:
+            self.normal_matrix = (key, normal_matrix(model))
+        return self.normal_matrix[1]
 
     def updateVertexArray(self):
         self.vertex_array = VertexArray(self.attributes, self.index)
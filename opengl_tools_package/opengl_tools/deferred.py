@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Deferred rendering: geometry pass into a G-buffer (albedo, normal, depth)
+then one full screen lighting pass over the Frame and clustered lights
+"""
+import numpy as np
+from opengl_tools.gl import GL      # OpenGL functions, see opengl_tools.gl
+from opengl_tools.framebuffer import pool
+from opengl_tools.shader_registry import get_shader
+from opengl_tools.shaders_glsl import DEFERRED_VERT, DEFERRED_FRAG
+
+# G-buffer attachments: albedo, world normal (zero where unlit), depth
+GBUFFER_COLORS = (GL.GL_RGBA8, GL.GL_RGBA16F)
+GBUFFER_DEPTH = GL.GL_DEPTH_COMPONENT24
+GBUFFER_SAMPLERS = ('albedo_map', 'normal_map', 'depth_map')
+
+class DeferredRenderer:
+    """ Renders the drawables of a Viewer drawn between begin() and end(),
+        their shaders built with the 'DEFERRED' define """
+
+    def __init__(self, defines=()):
+        # lighting pass sees the same lights as the forward shaders would
+        self.shader = get_shader(DEFERRED_VERT, DEFERRED_FRAG,
+                                 [define for define in defines if define != 'DEFERRED'])
+        self.vertex_array = GL.glGenVertexArrays(1)   # no attributes, but needed
+        self.gbuffer = None
+
+    def begin(self, viewport):
+        """ geometry pass: bind and clear a G-buffer of the viewport size """
+        self.gbuffer = pool.acquire(viewport[0], viewport[1], GBUFFER_COLORS,
+                                    GBUFFER_DEPTH, GL.GL_NEAREST)
+        self.gbuffer.bind()
+        for attachment in range(len(GBUFFER_COLORS)):
+            GL.glClearBufferfv(GL.GL_COLOR, attachment, (0, 0, 0, 0))
+        GL.glClearBufferfv(GL.GL_DEPTH, 0, (1,))
+
+    def end(self, view, projection, target=0):
+        """ lighting pass into framebuffer target, also writing the G-buffer
+            depth there for later forward drawing: a shader write, as a
+            blit needs the same depth format on both sides """
+        width, height = self.gbuffer.width, self.gbuffer.height
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, target)
+        GL.glViewport(0, 0, width, height)
+        GL.glEnable(GL.GL_DEPTH_TEST)   # else no depth writes
+        GL.glDepthFunc(GL.GL_ALWAYS)
+        GL.glUseProgram(self.shader.glid)
+        inverse = np.linalg.inv(np.asarray(projection @ view, np.float64))
+        location = GL.glGetUniformLocation(self.shader.glid, 'inverse_view_projection')
+        GL.glUniformMatrix4fv(location, 1, True, inverse.astype(np.float32))
+        textures = self.gbuffer.colors + [self.gbuffer.depth]
+        for unit, (name, texture) in enumerate(zip(GBUFFER_SAMPLERS, textures)):
+            GL.glActiveTexture(GL.GL_TEXTURE0 + unit)
+            GL.glBindTexture(GL.GL_TEXTURE_2D, texture)
+            GL.glUniform1i(GL.glGetUniformLocation(self.shader.glid, name), unit)
+        GL.glBindVertexArray(self.vertex_array)
+        GL.glDrawArrays(GL.GL_TRIANGLES, 0, 3)
+        GL.glBindVertexArray(0)
+        GL.glDepthFunc(GL.GL_LESS)
+        for unit in range(len(textures)):
+            GL.glActiveTexture(GL.GL_TEXTURE0 + unit)
+            GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+        GL.glActiveTexture(GL.GL_TEXTURE0)
+        GL.glUseProgram(0)
+        pool.release(self.gbuffer)
+        self.gbuffer = None
+
+    def __del__(self):
+        GL.glDeleteVertexArrays(1, [self.vertex_array])
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Per frame uniform buffer object: camera and lighting data shared by every
+shader declaring the 'Frame' block of shaders_glsl.FRAME_BLOCK
+"""
+import numpy as np
+from opengl_tools.gl import GL      # OpenGL functions, see opengl_tools.gl
+
+FRAME_BINDING = 0                   # uniform buffer binding point of 'Frame'
+MAX_LIGHTS = 8                      # light cap, array sizes of FRAME_BLOCK
+
+# texture units of per frame resources, kept away from the units used by
+# material textures and set once per program in bind_frame_block
+FRAME_SAMPLERS = {'shadow_map': 12, 'cluster_lights': 13, 'cluster_grid': 14,
+                  'cluster_indices': 15}
+
+# std140 layout of the 'Frame' block
+FRAME_LAYOUT = np.dtype({
+    'names': ['view', 'projection', 'view_projection', 'camera_position',
+              'light_positions', 'light_colors', 'light_count', 'time', 'viewport',
+              'shadow_matrix'],
+    'formats': [('<f4', (4, 4)), ('<f4', (4, 4)), ('<f4', (4, 4)), ('<f4', 4),
+                ('<f4', (MAX_LIGHTS, 4)), ('<f4', (MAX_LIGHTS, 4)), '<i4', '<f4', ('<f4', 4),
+                ('<f4', (4, 4))],
+    'offsets': [0, 64, 128, 192, 208, 208 + 16 * MAX_LIGHTS,
+                208 + 32 * MAX_LIGHTS, 212 + 32 * MAX_LIGHTS, 224 + 32 * MAX_LIGHTS,
+                240 + 32 * MAX_LIGHTS],
+    'itemsize': 304 + 32 * MAX_LIGHTS})
+
+def near_far(projection):
+    """ (near, far) clipping distances of a projection matrix """
+    zz, zw = float(projection[2][2]), float(projection[2][3])
+    if projection[3][2] == 0:           # orthographic
+        return (zw + 1) / zz, (zw - 1) / zz
+    return zw / (zz - 1), zw / (zz + 1)
+
+def bind_frame_block(program):
+    """ attach the 'Frame' block of a linked program to FRAME_BINDING and
+        its per frame samplers to their FRAME_SAMPLERS units """
+    index = GL.glGetUniformBlockIndex(program, 'Frame')
+    if index != GL.GL_INVALID_INDEX:
+        GL.glUniformBlockBinding(program, index, FRAME_BINDING)
+    GL.glUseProgram(program)
+    for name, unit in FRAME_SAMPLERS.items():
+        location = GL.glGetUniformLocation(program, name)
+        if location >= 0:
+            GL.glUniform1i(location, unit)
+    GL.glUseProgram(0)
+
+class FrameUniforms:
+    """ Uniform buffer holding the 'Frame' block, written once per frame """
+
+    def __init__(self):
+        self.data = np.zeros(1, FRAME_LAYOUT)
+        self.glid = GL.glGenBuffers(1)
+        GL.glBindBuffer(GL.GL_UNIFORM_BUFFER, self.glid)
+        GL.glBufferData(GL.GL_UNIFORM_BUFFER, self.data.nbytes, None, GL.GL_DYNAMIC_DRAW)
+        GL.glBindBuffer(GL.GL_UNIFORM_BUFFER, 0)
+        GL.glBindBufferBase(GL.GL_UNIFORM_BUFFER, FRAME_BINDING, self.glid)
+
+    def update(self, view, projection, lights=(), time=0., viewport=(1, 1), shadow_matrix=None):
+        """ upload camera matrices, the first MAX_LIGHTS lights, the time
+            in seconds, the viewport size and the light view projection of
+            the shadow map. Lights are (position, color) pairs: a 3d
+            position is the direction of a directional light, (x, y, z, 1)
+            a point light whose radius is the 4th color component """
+        frame = self.data[0]
+        frame['view'], frame['projection'] = view, projection
+        frame['view_projection'] = projection @ view
+        frame['camera_position'] = np.linalg.inv(view)[:, 3]
+        lights = list(lights)[:MAX_LIGHTS]
+        frame['light_count'] = len(lights)
+        frame['light_positions'], frame['light_colors'] = (0, 0, 1, 0), 0  # unused: black
+        for number, (position, color) in enumerate(lights):
+            frame['light_positions'][number] = (tuple(position) + (0,))[:4]
+            frame['light_colors'][number] = (tuple(color) + (0,))[:4]
+        frame['time'] = time
+        frame['viewport'] = (viewport[0], viewport[1], *near_far(projection))
+        frame['shadow_matrix'] = np.identity(4) if shadow_matrix is None else shadow_matrix
+        GL.glBindBuffer(GL.GL_UNIFORM_BUFFER, self.glid)
+        GL.glBufferSubData(GL.GL_UNIFORM_BUFFER, 0, self.data.nbytes, self.data)
+        GL.glBindBuffer(GL.GL_UNIFORM_BUFFER, 0)
+
+    def __del__(self):
+        GL.glDeleteBuffers(1, [self.glid])
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Offscreen render targets: framebuffer object with color and depth textures
+"""
+from opengl_tools.gl import GL      # OpenGL functions, see opengl_tools.gl
+
+class Framebuffer:
+    """ Framebuffer object rendering into textures, one per color format
+        (attachments 0, 1, ...) plus an optional depth texture """
+
+    def __init__(self, width, height, colors=(GL.GL_RGBA8,),
+                 depth=GL.GL_DEPTH_COMPONENT24, filtering=GL.GL_LINEAR):
+        self.glid = GL.glGenFramebuffers(1)
+        self.formats, self.depth_format, self.filtering = colors, depth, filtering
+        self.colors, self.depth = [], None
+        self.width, self.height = 0, 0
+        self.resize(width, height)
+
+    def _texture(self, internal_format, data_format, attachment):
+        texture = GL.glGenTextures(1)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, texture)
+        GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, internal_format, self.width, self.height,
+                        0, data_format, GL.GL_FLOAT, None)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, self.filtering)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, self.filtering)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
+        GL.glFramebufferTexture2D(GL.GL_FRAMEBUFFER, attachment, GL.GL_TEXTURE_2D, texture, 0)
+        return texture
+
+    def resize(self, width, height):
+        """ (re)allocate the attachments, nothing done if the size is the same """
+        width, height = max(int(width), 1), max(int(height), 1)
+        if (width, height) == (self.width, self.height):
+            return
+        self.width, self.height = width, height
+        self._release_textures()
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, self.glid)
+        self.colors = [self._texture(color, GL.GL_RGBA, GL.GL_COLOR_ATTACHMENT0 + i)
+                       for i, color in enumerate(self.formats)]
+        if self.depth_format:
+            self.depth = self._texture(self.depth_format, GL.GL_DEPTH_COMPONENT,
+                                       GL.GL_DEPTH_ATTACHMENT)
+        attachments = [GL.GL_COLOR_ATTACHMENT0 + i for i in range(len(self.colors))]
+        if attachments:
+            GL.glDrawBuffers(len(attachments), attachments)
+        else:
+            GL.glDrawBuffer(GL.GL_NONE)    # depth only, e.g. shadow maps
+            GL.glReadBuffer(GL.GL_NONE)
+        status = GL.glCheckFramebufferStatus(GL.GL_FRAMEBUFFER)
+        if status != GL.GL_FRAMEBUFFER_COMPLETE:
+            print('ERROR: incomplete framebuffer', hex(status))
+        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, 0)
+
+    def bind(self, target=GL.GL_FRAMEBUFFER):
+        """ render into this framebuffer, viewport covering all of it """
+        GL.glBindFramebuffer(target, self.glid)
+        GL.glViewport(0, 0, self.width, self.height)
+
+    def _release_textures(self):
+        textures = self.colors + ([self.depth] if self.depth else [])
+        if textures:
+            GL.glDeleteTextures(textures)
+        self.colors, self.depth = [], None
+
+    def __del__(self):
+        self._release_textures()
+        GL.glDeleteFramebuffers(1, [self.glid])
+
+class FramebufferPool:
+    """ Hands out framebuffers of a given size and formats, reusing the
+        ones released by earlier passes or viewers instead of allocating """
+
+    def __init__(self, limit=8):
+        self.free, self.limit = [], limit
+
+    def acquire(self, width, height, colors=(GL.GL_RGBA8,), depth=GL.GL_DEPTH_COMPONENT24,
+                filtering=GL.GL_LINEAR):
+        """ free framebuffer matching the request, a new one if none """
+        key = (max(int(width), 1), max(int(height), 1), tuple(colors), depth, filtering)
+        for i, framebuffer in enumerate(self.free):
+            if self._key(framebuffer) == key:
+                return self.free.pop(i)
+        return Framebuffer(width, height, colors, depth, filtering)
+
+    def release(self, framebuffer):
+        """ give a framebuffer back, the oldest free ones are deleted """
+        self.free.append(framebuffer)
+        del self.free[:-self.limit]
+
+    def clear(self):
+        """ delete every free framebuffer, before the GL context goes away """
+        self.free.clear()
+
+    @staticmethod
+    def _key(framebuffer):
+        return (framebuffer.width, framebuffer.height, tuple(framebuffer.formats),
+                framebuffer.depth_format, framebuffer.filtering)
+
+# default pool of the process, framebuffers live in the current context
+pool = FramebufferPool()
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Geometry pool: static triangle meshes suballocated in shared vertex and
+index buffers, per object data in a shader storage buffer, the whole set
+drawn with a single glMultiDrawElementsIndirect (OpenGL 4.3 and above),
+optionally after frustum culling in a compute shader
+"""
+import ctypes
+import numpy as np
+from opengl_tools.gl import GL      # OpenGL functions, see opengl_tools.gl
+from opengl_tools.shader_registry import get_shader, get_compute_shader
+from opengl_tools.shaders_glsl import POOL_VERT, POOL_CULL, POOL_SHADOW_VERT, SHADOW_FRAG, \
+    LAMBERT_FRAG
+from opengl_tools.transform import identity, normal_matrix
+from opengl_tools.vertex_array import packed
+
+POOL_BINDING = 1                    # shader storage binding of the object data
+CULL_BINDINGS = (2, 3, 4)           # all commands, visible commands, visible count
+CULL_GROUP = 64                     # local size of the culling compute shader
+POOL_VERSION = (4, 3)               # SSBOs and multi draw indirect
+VERTEX_SIZE = 6                     # floats per vertex: position, normal
+OBJECT_SIZE = 40                    # floats per object: model, normal matrix, color, sphere
+COMMAND_SIZE = 5                    # uint per DrawElementsIndirectCommand
+
+def supported():
+    """ True if the current context can draw a GeometryPool """
+    version = (GL.glGetIntegerv(GL.GL_MAJOR_VERSION), GL.glGetIntegerv(GL.GL_MINOR_VERSION))
+    return tuple(int(number) for number in version) >= POOL_VERSION
+
+def pool_meshes(drawables, model=identity(), param=None):
+    """ (mesh, world matrix, color, node) of every triangle mesh below
+        drawables, color being the 'color' parameter its Nodes pass down
+        and node the one holding the mesh """
+    stack, meshes = [(drawable, model, param or {}, None) for drawable in drawables], []
+    while stack:
+        drawable, model, param, node = stack.pop()
+        if hasattr(drawable, 'children'):
+            param = dict(param, **drawable.param)
+            model = model @ drawable.transform
+            stack.extend((child, model, param, drawable) for child in drawable.children)
+        elif getattr(drawable, 'primitive', None) == GL.GL_TRIANGLES and \
+                hasattr(drawable, 'attributes'):
+            meshes.append((drawable, model, param.get('color', (1, 1, 1)), node))
+    return meshes
+
+def frustum_planes(matrix):
+    """ 6 (a, b, c, d) planes, normals inward and normalized, of the clip
+        volume of matrix (projection @ view @ model) in model space """
+    matrix = np.asarray(matrix, np.float64)
+    planes = np.array([matrix[3] + sign * matrix[axis] for axis in range(3) for sign in (1, -1)])
+    return (planes / np.linalg.norm(planes[:, :3], axis=1, keepdims=True)).astype(np.float32)
+
+class RangeAllocator:
+    """ first fit allocation of [offset, offset + size) ranges in a buffer
+        of capacity elements, growing it when nothing fits """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.free = [(0, capacity)]          # (offset, size), sorted by offset
+
+    def allocate(self, size):
+        """ offset of a new range, None if capacity must grow first """
+        for number, (offset, free) in enumerate(self.free):
+            if free >= size:
+                self.free[number:number + 1] = [(offset + size, free - size)] if free > size else []
+                return offset
+        return None
+
+    def release(self, offset, size):
+        """ give a range back, merged with its free neighbours """
+        self.free.append((offset, size))
+        self.free.sort()
+        merged = [self.free[0]]
+        for offset, size in self.free[1:]:
+            last_offset, last_size = merged[-1]
+            if last_offset + last_size == offset:
+                merged[-1] = (last_offset, last_size + size)
+            else:
+                merged.append((offset, size))
+        self.free = merged
+
+    def grow(self, capacity):
+        """ extend to capacity elements, the new space being free """
+        self.release(self.capacity, capacity - self.capacity)
+        self.capacity = capacity
+
+class GeometryPool:
+    """ Static meshes drawn in one call. Vertices are (position, normal)
+        float32 in one buffer, indices uint32 in another; every object has
+        a model matrix, normal matrix, color and bounding sphere in the
+        'PoolObjects' storage buffer, found with its draw command's
+        baseInstance. With culling, a compute shader copies the commands of
+        the objects in the frustum for the draw, at a constant CPU cost.
+        Shadow maps draw the pool with draw_depth(), picking goes through
+        the meshes instances() returns """
+
+    def __init__(self, defines=(), vertices=1 << 16, indices=1 << 18, objects=256,
+                 culling=False):
+        self.shader = get_shader(POOL_VERT, LAMBERT_FRAG, defines)
+        self.cull_shader = get_compute_shader(POOL_CULL) if culling else None
+        self.vertex_ranges, self.index_ranges = RangeAllocator(vertices), RangeAllocator(indices)
+        self.objects = np.zeros((objects, OBJECT_SIZE), np.float32)
+        self.commands = np.zeros((objects, COMMAND_SIZE), np.uint32)
+        self.ranges = [None] * objects       # (vertex offset, count, index offset, count)
+        self.sources = [None] * objects      # (node, mesh, model) added, for picking
+        self.version = 0                     # changes with every object change
+        self.depth_shader = None             # shadow pass shader, on first use
+        self.count, self.free_handles = 0, []  # commands drawn, removed handles
+        self.dirty = True
+
+        self.glid = GL.glGenVertexArrays(1)
+        self.vertex_buffer, self.index_buffer, self.id_buffer, self.object_buffer, \
+            self.command_buffer, self.visible_buffer, self.counter_buffer = GL.glGenBuffers(7)
+        for buffer, size in ((self.vertex_buffer, 4 * VERTEX_SIZE * vertices),
+                             (self.index_buffer, 4 * indices)):
+            GL.glBindBuffer(GL.GL_COPY_WRITE_BUFFER, buffer)
+            GL.glBufferData(GL.GL_COPY_WRITE_BUFFER, size, None, GL.GL_STATIC_DRAW)
+        GL.glBindBuffer(GL.GL_COPY_WRITE_BUFFER, 0)
+        self._resize_objects(objects)
+        self._bind_layout()
+
+    def _bind_layout(self):
+        """ vertex array state over the current buffers """
+        GL.glBindVertexArray(self.glid)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.vertex_buffer)
+        for location in (0, 1):
+            GL.glEnableVertexAttribArray(location)
+            GL.glVertexAttribPointer(location, 3, GL.GL_FLOAT, False, 4 * VERTEX_SIZE,
+                                     ctypes.c_void_p(12 * location))
+        # object index = baseInstance of the command, as a per instance attribute
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.id_buffer)
+        GL.glEnableVertexAttribArray(3)
+        GL.glVertexAttribIPointer(3, 1, GL.GL_UNSIGNED_INT, 0, None)
+        GL.glVertexAttribDivisor(3, 1)
+        GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.index_buffer)
+        GL.glBindVertexArray(0)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+
+    def _resize_objects(self, objects):
+        """ room for objects objects in the CPU arrays and id buffer """
+        extra = objects - len(self.ranges)
+        self.objects = np.concatenate((self.objects, np.zeros((extra, OBJECT_SIZE), np.float32)))
+        self.commands = np.concatenate((self.commands, np.zeros((extra, COMMAND_SIZE), np.uint32)))
+        self.ranges += [None] * extra
+        self.sources += [None] * extra
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.id_buffer)
+        GL.glBufferData(GL.GL_ARRAY_BUFFER, np.arange(objects, dtype=np.uint32), GL.GL_STATIC_DRAW)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+
+    def _grow(self, buffer, allocator, needed, element_bytes):
+        """ new buffer of at least twice the capacity, old content copied """
+        capacity = max(2 * allocator.capacity, allocator.capacity + needed)
+        grown = GL.glGenBuffers(1)
+        GL.glBindBuffer(GL.GL_COPY_WRITE_BUFFER, grown)
+        GL.glBufferData(GL.GL_COPY_WRITE_BUFFER, capacity * element_bytes, None, GL.GL_STATIC_DRAW)
+        GL.glBindBuffer(GL.GL_COPY_READ_BUFFER, buffer)
+        GL.glCopyBufferSubData(GL.GL_COPY_READ_BUFFER, GL.GL_COPY_WRITE_BUFFER, 0, 0,
+                               allocator.capacity * element_bytes)
+        GL.glBindBuffer(GL.GL_COPY_READ_BUFFER, 0)
+        GL.glBindBuffer(GL.GL_COPY_WRITE_BUFFER, 0)
+        GL.glDeleteBuffers(1, [buffer])
+        allocator.grow(capacity)
+        return grown
+
+    def _allocate(self, vertex_count, index_count):
+        """ (vertex offset, index offset), growing the buffers if needed """
+        vertex_offset = self.vertex_ranges.allocate(vertex_count)
+        index_offset = self.index_ranges.allocate(index_count)
+        grown = vertex_offset is None or index_offset is None
+        if vertex_offset is None:
+            self.vertex_buffer = self._grow(self.vertex_buffer, self.vertex_ranges,
+                                            vertex_count, 4 * VERTEX_SIZE)
+            vertex_offset = self.vertex_ranges.allocate(vertex_count)
+        if index_offset is None:
+            self.index_buffer = self._grow(self.index_buffer, self.index_ranges, index_count, 4)
+            index_offset = self.index_ranges.allocate(index_count)
+        if grown:
+            self._bind_layout()            # vertex array sees the new buffers
+        return vertex_offset, index_offset
+
+    def add(self, mesh, model=identity(), color=(1, 1, 1), node=None):
+        """ copy a triangle ColorMesh (positions, normals attributes) in the
+            pool, drawn with model and color. node is the Node picking
+            reports for it. Returns its handle """
+        positions = np.asarray(packed(mesh.attributes[0]), np.float32).reshape(-1, 3)
+        normals = np.asarray(packed(mesh.attributes[1]), np.float32).reshape(-1, 3) \
+            if len(mesh.attributes) > 1 and mesh.attributes[1] is not None \
+            else np.zeros_like(positions)
+        index = np.arange(len(positions)) if mesh.index is None else np.asarray(mesh.index)
+        vertices = np.hstack((positions, normals))
+        index = index.astype(np.uint32).ravel()
+
+        if self.free_handles:
+            handle = self.free_handles.pop()
+        else:
+            handle, self.count = self.count, self.count + 1
+            if handle == len(self.ranges):
+                self._resize_objects(2 * len(self.ranges))
+        vertex_offset, index_offset = self._allocate(len(vertices), len(index))
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.vertex_buffer)
+        GL.glBufferSubData(GL.GL_ARRAY_BUFFER, vertices.itemsize * VERTEX_SIZE * vertex_offset,
+                           vertices.nbytes, vertices)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+        GL.glBindBuffer(GL.GL_COPY_WRITE_BUFFER, self.index_buffer)
+        GL.glBufferSubData(GL.GL_COPY_WRITE_BUFFER, 4 * index_offset, index.nbytes, index)
+        GL.glBindBuffer(GL.GL_COPY_WRITE_BUFFER, 0)
+
+        self.ranges[handle] = (vertex_offset, len(vertices), index_offset, len(index))
+        center = (positions.min(axis=0) + positions.max(axis=0)) / 2
+        radius = np.linalg.norm(positions - center, axis=1).max(initial=0)
+        self.objects[handle, 36:] = tuple(center) + (radius,)
+        # count, instanceCount, firstIndex, baseVertex, baseInstance
+        self.commands[handle] = (len(index), 1, index_offset, vertex_offset, handle)
+        self.sources[handle] = (node, mesh, model)
+        self.set_object(handle, model, color)
+        return handle
+
+    def add_drawables(self, *drawables):
+        """ add every triangle mesh below drawables, pre-transformed by their
+            Nodes as they are now. Returns the handles """
+        return [self.add(mesh, model, color, node)
+                for mesh, model, color, node in pool_meshes(drawables)]
+
+    def remove(self, handle):
+        """ free the object handle and its vertex and index ranges """
+        vertex_offset, vertex_count, index_offset, index_count = self.ranges[handle]
+        self.vertex_ranges.release(vertex_offset, vertex_count)
+        self.index_ranges.release(index_offset, index_count)
+        self.ranges[handle] = self.sources[handle] = None
+        self.commands[handle] = 0            # empty draw, kept in the list
+        self.free_handles.append(handle)
+        self.dirty = True
+        self.version += 1
+
+    def set_object(self, handle, model=identity(), color=(1, 1, 1)):
+        """ new model matrix and color of the object handle """
+        matrix = np.identity(4, np.float32)
+        matrix[:3, :3] = normal_matrix(model)
+        self.objects[handle, :16] = np.asarray(model, np.float32).ravel()
+        self.objects[handle, 16:32] = matrix.ravel()
+        self.objects[handle, 32:36] = tuple(color[:3]) + (1,)
+        self.dirty = True
+        self.version += 1
+        if self.sources[handle] is not None:
+            node, mesh, _ = self.sources[handle]
+            self.sources[handle] = (node, mesh, model)
+
+    def instances(self):
+        """ (node, mesh, model) of every object, as SceneBVH picks them """
+        return [source for source in self.sources if source is not None]
+
+    def _upload(self):
+        """ object data and draw commands of every handle """
+        GL.glBindBuffer(GL.GL_SHADER_STORAGE_BUFFER, self.object_buffer)
+        GL.glBufferData(GL.GL_SHADER_STORAGE_BUFFER, self.objects, GL.GL_STATIC_DRAW)
+        GL.glBindBuffer(GL.GL_SHADER_STORAGE_BUFFER, 0)
+        GL.glBindBuffer(GL.GL_DRAW_INDIRECT_BUFFER, self.command_buffer)
+        GL.glBufferData(GL.GL_DRAW_INDIRECT_BUFFER, self.commands, GL.GL_STATIC_DRAW)
+        if self.cull_shader is not None:
+            GL.glBindBuffer(GL.GL_DRAW_INDIRECT_BUFFER, self.visible_buffer)
+            GL.glBufferData(GL.GL_DRAW_INDIRECT_BUFFER, self.commands.nbytes, None, GL.GL_DYNAMIC_DRAW)
+            GL.glBindBuffer(GL.GL_DRAW_INDIRECT_BUFFER, self.counter_buffer)
+            GL.glBufferData(GL.GL_DRAW_INDIRECT_BUFFER, 4, None, GL.GL_DYNAMIC_DRAW)
+        GL.glBindBuffer(GL.GL_DRAW_INDIRECT_BUFFER, 0)
+        self.dirty = False
+
+    def cull(self, matrix):
+        """ visible commands of the objects in the frustum of matrix
+            (projection @ view @ model), the rest left as empty draws """
+        for buffer in (self.visible_buffer, self.counter_buffer):
+            GL.glBindBuffer(GL.GL_SHADER_STORAGE_BUFFER, buffer)
+            GL.glClearBufferData(GL.GL_SHADER_STORAGE_BUFFER, GL.GL_R32UI, GL.GL_RED_INTEGER,
+                                 GL.GL_UNSIGNED_INT, None)
+        GL.glBindBuffer(GL.GL_SHADER_STORAGE_BUFFER, 0)
+        for binding, buffer in zip((POOL_BINDING,) + CULL_BINDINGS, (
+                self.object_buffer, self.command_buffer, self.visible_buffer, self.counter_buffer)):
+            GL.glBindBufferBase(GL.GL_SHADER_STORAGE_BUFFER, binding, buffer)
+        glid = self.cull_shader.glid
+        GL.glUseProgram(glid)
+        GL.glUniform1ui(GL.glGetUniformLocation(glid, 'object_count'), self.count)
+        GL.glUniform4fv(GL.glGetUniformLocation(glid, 'planes'), 6, frustum_planes(matrix))
+        self.cull_shader.dispatch((self.count + CULL_GROUP - 1) // CULL_GROUP)
+        GL.glMemoryBarrier(GL.GL_COMMAND_BARRIER_BIT | GL.GL_SHADER_STORAGE_BARRIER_BIT)
+
+    def visible_count(self):
+        """ objects kept by the last cull, read back: waits for the GPU """
+        GL.glBindBuffer(GL.GL_SHADER_STORAGE_BUFFER, self.counter_buffer)
+        count = GL.glGetBufferSubData(GL.GL_SHADER_STORAGE_BUFFER, 0, 4).view(np.uint32)
+        GL.glBindBuffer(GL.GL_SHADER_STORAGE_BUFFER, 0)
+        return int(count[0])
+
+    def draw(self, projection, view, model, color_shader=None, **param):
+        """ every object in one glMultiDrawElementsIndirect, moved by model.
+            color_shader is ignored, the pool draws with its own shader """
+        if not self.count:
+            return
+        if self.dirty:
+            self._upload()
+        commands = self.command_buffer
+        if self.cull_shader is not None:
+            self.cull(projection @ view @ model)
+            commands = self.visible_buffer
+        GL.glUseProgram(self.shader.glid)
+        GL.glUniformMatrix4fv(GL.glGetUniformLocation(self.shader.glid, 'model'), 1, True, model)
+        GL.glUniformMatrix3fv(GL.glGetUniformLocation(self.shader.glid, 'normal_matrix'),
+                              1, True, normal_matrix(model))
+        GL.glBindBufferBase(GL.GL_SHADER_STORAGE_BUFFER, POOL_BINDING, self.object_buffer)
+        GL.glBindBuffer(GL.GL_DRAW_INDIRECT_BUFFER, commands)
+        GL.glBindVertexArray(self.glid)
+        GL.glMultiDrawElementsIndirect(GL.GL_TRIANGLES, GL.GL_UNSIGNED_INT, None, self.count, 0)
+        GL.glBindVertexArray(0)
+        GL.glBindBuffer(GL.GL_DRAW_INDIRECT_BUFFER, 0)
+
+    def draw_depth(self, light_view_projection, model=identity()):
+        """ every object in a depth only pass, culled to the light frustum
+            if culling, leaves the depth shader bound """
+        if not self.count:
+            return
+        if self.dirty:
+            self._upload()
+        if self.depth_shader is None:
+            self.depth_shader = get_shader(POOL_SHADOW_VERT, SHADOW_FRAG)
+        commands = self.command_buffer
+        if self.cull_shader is not None:
+            self.cull(light_view_projection @ model)
+            commands = self.visible_buffer
+        glid = self.depth_shader.glid
+        GL.glUseProgram(glid)
+        GL.glUniformMatrix4fv(GL.glGetUniformLocation(glid, 'light_view_projection'),
+                              1, True, light_view_projection)
+        GL.glUniformMatrix4fv(GL.glGetUniformLocation(glid, 'model'), 1, True, model)
+        GL.glBindBufferBase(GL.GL_SHADER_STORAGE_BUFFER, POOL_BINDING, self.object_buffer)
+        GL.glBindBuffer(GL.GL_DRAW_INDIRECT_BUFFER, commands)
+        GL.glBindVertexArray(self.glid)
+        GL.glMultiDrawElementsIndirect(GL.GL_TRIANGLES, GL.GL_UNSIGNED_INT, None, self.count, 0)
+        GL.glBindVertexArray(0)
+        GL.glBindBuffer(GL.GL_DRAW_INDIRECT_BUFFER, 0)
+
+    def __del__(self):
+        GL.glDeleteVertexArrays(1, [self.glid])
+        GL.glDeleteBuffers(7, [self.vertex_buffer, self.index_buffer, self.id_buffer,
+                               self.object_buffer, self.command_buffer, self.visible_buffer,
+                               self.counter_buffer])
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+OpenGL entry points of the opengl_tools classes, imported as
+from opengl_tools.gl import GL in place of import OpenGL.GL as GL.
+The functions called every frame are resolved once as raw ctypes functions
+taking NumPy arrays as they are, with no wrapper, conversion or error check:
+their errors are drained and reported before the next PyOpenGL call, not
+raised by it. The others and the constants come from PyOpenGL.
+OPENGL_TOOLS_GL, or set_mode(), selects other modes: 'debug' checks
+glGetError after every call, 'count' counts the calls of each function,
+'pyopengl' uses PyOpenGL for every function
+"""
+import collections
+import ctypes
+import os
+import numpy as np
+import OpenGL.GL                    # standard Python OpenGL wrapper
+from OpenGL.error import GLError
+from OpenGL.platform import PLATFORM
+
+_enum, _uint, _int, _bool = ctypes.c_uint, ctypes.c_uint, ctypes.c_int, ctypes.c_ubyte
+_pointer, _intptr = ctypes.c_void_p, ctypes.c_ssize_t
+
+# (result type, argument types) of the entry points of the rendering loop
+HOT = {
+    'glUseProgram': (None, (_uint,)),
+    'glBindVertexArray': (None, (_uint,)),
+    'glBindBuffer': (None, (_enum, _uint)),
+    'glBindBufferBase': (None, (_enum, _uint, _uint)),
+    'glBindFramebuffer': (None, (_enum, _uint)),
+    'glBindTexture': (None, (_enum, _uint)),
+    'glActiveTexture': (None, (_enum,)),
+    'glEnable': (None, (_enum,)),
+    'glDisable': (None, (_enum,)),
+    'glViewport': (None, (_int, _int, _int, _int)),
+    'glClear': (None, (_uint,)),
+    'glDrawArrays': (None, (_enum, _int, _int)),
+    'glDrawElements': (None, (_enum, _int, _enum, _pointer)),
+    'glMultiDrawElementsIndirect': (None, (_enum, _enum, _pointer, _int, _int)),
+    'glGetUniformLocation': (_int, (_uint, ctypes.c_char_p)),
+    'glUniform1i': (None, (_int, _int)),
+    'glUniform1ui': (None, (_int, _uint)),
+    'glUniform3fv': (None, (_int, _int, _pointer)),
+    'glUniform4fv': (None, (_int, _int, _pointer)),
+    'glUniformMatrix3fv': (None, (_int, _int, _bool, _pointer)),
+    'glUniformMatrix4fv': (None, (_int, _int, _bool, _pointer)),
+    'glBufferSubData': (None, (_enum, _intptr, _intptr, _pointer)),
+    'glGetError': (_enum, ()),
+}
+
+# OpenGL 1.1 entry points: exported by the GL library, which is the only
+# place to find them on Windows, where wglGetProcAddress returns NULL
+GL_1_1 = {'glEnable', 'glDisable', 'glViewport', 'glClear', 'glBindTexture',
+          'glDrawArrays', 'glDrawElements', 'glGetError'}
+
+# addresses some wglGetProcAddress implementations return for failures
+INVALID_ADDRESSES = {1, 2, 3, ctypes.c_void_p(-1).value}
+
+MAX_ERRORS = 16                     # glGetError calls to drain the error flags
+
+def _floats(value):
+    """ value as a contiguous float32 array, not copied if it is one """
+    if type(value) is np.ndarray and value.dtype == np.float32 and value.flags.c_contiguous:
+        return value
+    return np.ascontiguousarray(value, np.float32)
+
+def _raw(name):
+    """ ctypes function of an entry point, None if the driver lacks it """
+    result, arguments = HOT[name]
+    prototype = PLATFORM.functionTypeFor(PLATFORM.GL)(result, *arguments)
+    if name in GL_1_1:
+        try:
+            return prototype((name, PLATFORM.GL))
+        except AttributeError:
+            return None
+    address = PLATFORM.getExtensionProcedure(name.encode())
+    if not address or address in INVALID_ADDRESSES:
+        return None
+    return prototype(address)
+
+def _direct(name, function):
+    """ function called with array arguments passed by address """
+    # converted arrays are held in a local for the whole call: .ctypes.data
+    # of a temporary points to memory freed before the driver reads it
+    if name.startswith('glUniformMatrix'):
+        def uniform_matrix(location, count, transpose, value):
+            value = _floats(value)
+            function(location, count, transpose, value.ctypes.data)
+        return uniform_matrix
+    if name.startswith('glUniform') and name.endswith('fv'):
+        def uniform_vector(location, count, value):
+            value = _floats(value)
+            function(location, count, value.ctypes.data)
+        return uniform_vector
+    if name == 'glBufferSubData':
+        def buffer_sub_data(target, offset, size, data):
+            data = np.ascontiguousarray(data)
+            function(target, offset, size, data.ctypes.data)
+        return buffer_sub_data
+    if name == 'glGetUniformLocation':
+        names = {}                  # str => bytes, not encoded every call
+        def get_uniform_location(program, uniform):
+            if uniform not in names:
+                names[uniform] = uniform.encode() if isinstance(uniform, str) else uniform
+            return function(program, names[uniform])
+        return get_uniform_location
+    return function
+
+class Dispatch:
+    """ OpenGL.GL look-alike resolving every name once, on first use, as
+        the current mode requires: functions are only looked up after a
+        context exists, which some platforms need """
+
+    def __init__(self, raw=True, debug=False, count=False):
+        self.calls = collections.Counter()      # calls by function, when counting
+        self.reported = set()                   # (error, call) drained and reported
+        self.get_error = None                   # unchecked glGetError, once resolved
+        self.raw = self.debug = False
+        self.set_mode(raw, debug, count)
+
+    def set_mode(self, raw=True, debug=False, count=False):
+        """ raw ctypes hot functions, glGetError checks, call counting """
+        resolved = [name for name in vars(self) if name.startswith('gl')]
+        if resolved:
+            self.drain('set_mode')              # errors of the previous mode
+        for name in resolved:
+            delattr(self, name)                  # resolved again in the new mode
+        self.raw, self.debug, self.count = raw, debug, count
+
+    def __getattr__(self, name):
+        value = getattr(OpenGL.GL, name)
+        if not name.startswith('gl'):
+            setattr(self, name, value)          # constants and types
+            return value
+        if self.raw and name in HOT:
+            function = _raw(name)
+            value = value if function is None else _direct(name, function)
+        elif self.raw and not self.debug:
+            value = self._drained(name, value)
+        if self.debug:
+            value = self._checked(name, value)
+        if self.count:
+            value = self._counted(name, value)
+        setattr(self, name, value)
+        return value
+
+    def _error(self):
+        """ next GL error flag, read without PyOpenGL's checks """
+        if self.get_error is None:
+            self.get_error = _raw('glGetError') or OpenGL.GL.glGetError
+        return self.get_error()
+
+    def drain(self, before):
+        """ clear the error flags raw calls left unchecked, reported once as
+            theirs: PyOpenGL would raise them from the call before, a
+            function that did nothing wrong """
+        if not self.raw or self.debug:
+            return                              # every call is checked
+        for _ in range(MAX_ERRORS):
+            error = self._error()
+            if not error:
+                break
+            if (error, before) not in self.reported:
+                self.reported.add((error, before))
+                print('WARNING: GL error 0x%x from the calls before %s,'
+                      ' OPENGL_TOOLS_GL=debug finds the call' % (error, before))
+
+    def _drained(self, name, function):
+        def drained(*args, **kwargs):
+            self.drain(name)
+            return function(*args, **kwargs)
+        return drained
+
+    def _checked(self, name, function):
+        def checked(*args, **kwargs):
+            result = function(*args, **kwargs)
+            error = self._error()
+            if error:
+                raise GLError(error, result, args, description='%s%r' % (name, args))
+            return result
+        return checked
+
+    def _counted(self, name, function):
+        calls = self.calls
+        def counted(*args, **kwargs):
+            calls[name] += 1
+            return function(*args, **kwargs)
+        return counted
+
+    def report(self, count=20):
+        """ print the most called functions, when counting """
+        total = sum(self.calls.values())
+        for name, calls in self.calls.most_common(count):
+            print('%-32s %10d %5.1f%%' % (name, calls, 100 * calls / total))
+
+def _mode(words):
+    """ set_mode arguments from OPENGL_TOOLS_GL, like 'debug count' """
+    words = set(words.replace(',', ' ').split())
+    for word in words - {'debug', 'count', 'pyopengl'}:
+        print('WARNING: unknown OPENGL_TOOLS_GL mode', word)
+    return dict(raw='pyopengl' not in words, debug='debug' in words, count='count' in words)
+
+# shared by every opengl_tools module
+GL = Dispatch(**_mode(os.environ.get('OPENGL_TOOLS_GL', '')))
+
+def set_mode(raw=True, debug=False, count=False):
+    """ switch the dispatch mode of every opengl_tools module, see Dispatch """
+    GL.set_mode(raw, debug, count)
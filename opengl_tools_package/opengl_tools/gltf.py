@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+glTF 2.0 / GLB loader
+Accessors are NumPy views on the memory-mapped file, uploaded as is
+Return the root Node of the glTF scene
+"""
+import base64
+import json
+import mmap
+import os                           # os function, i.e. checking file status
+import struct
+import numpy as np
+from opengl_tools.color_mesh import ColorMesh
+from opengl_tools.node import Node
+from opengl_tools.transform import translate, scale, quaternion_matrix, identity
+from opengl_tools.vertex_array import Attribute, GL_TYPES
+
+# accessor componentType => numpy dtype, accessor type => component count
+COMPONENT_TYPES = {5120: np.int8, 5121: np.uint8, 5122: np.int16,
+                   5123: np.uint16, 5125: np.uint32, 5126: np.float32}
+TYPE_SIZES = {'SCALAR': 1, 'VEC2': 2, 'VEC3': 3, 'VEC4': 4,
+              'MAT2': 4, 'MAT3': 9, 'MAT4': 16}
+
+# glTF attribute name => shader layout location, same order as ColorMesh
+# ([vertices, normals]) with texture coordinates next
+ATTRIBUTES = ('POSITION', 'NORMAL', 'TEXCOORD_0')
+
+GLB_MAGIC, GLB_JSON, GLB_BIN = 0x46546C67, 0x4E4F534A, 0x004E4942
+
+class GLTF:
+    """ Parsed glTF document with its buffers mapped in memory """
+
+    def __init__(self, file):
+        self.file = file
+        self.maps = []
+        self.views = {}             # buffer view index => (data, stride)
+        with open(file, 'rb') as gltf:
+            if file.lower().endswith('.glb'):
+                self.document, binary = self._map_glb(gltf)
+            else:
+                self.document, binary = json.load(gltf), None
+        self.buffers = [self._buffer(info, binary)
+                        for info in self.document.get('buffers', [])]
+
+    def _map(self, handle):
+        """ read only memory map of a whole opened file, as a uint8 array """
+        mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self.maps.append(mapped)
+        return np.frombuffer(mapped, np.uint8)
+
+    def _map_glb(self, handle):
+        """ JSON document and binary chunk view of a .glb file """
+        data = self._map(handle)
+        magic, version, length = struct.unpack_from('<III', data, 0)
+        if magic != GLB_MAGIC or version != 2:
+            raise ValueError('%s is not a glTF 2.0 binary' % self.file)
+        document, binary, offset = None, None, 12
+        while offset < length:
+            size, kind = struct.unpack_from('<II', data, offset)
+            chunk = data[offset + 8:offset + 8 + size]
+            if kind == GLB_JSON:
+                document = json.loads(chunk.tobytes())
+            elif kind == GLB_BIN and binary is None:
+                binary = chunk
+            offset += 8 + size
+        return document, binary
+
+    def _buffer(self, info, binary):
+        """ uint8 view of a buffer: GLB chunk, mapped .bin file or data URI """
+        uri = info.get('uri')
+        if uri is None:
+            return binary
+        if uri.startswith('data:'):
+            return np.frombuffer(base64.b64decode(uri.split(',', 1)[1]), np.uint8)
+        with open(os.path.join(os.path.dirname(self.file), uri), 'rb') as handle:
+            return self._map(handle)
+
+    def buffer_view(self, index):
+        """ uint8 view of a buffer view, with its byte stride (0 if packed).
+            The same array every time, so the attributes interleaved in it
+            share one GL buffer (VertexArray matches them by identity) """
+        if index not in self.views:
+            view = self.document['bufferViews'][index]
+            start = view.get('byteOffset', 0)
+            data = self.buffers[view['buffer']][start:start + view['byteLength']]
+            self.views[index] = (data, view.get('byteStride', 0))
+        return self.views[index]
+
+    def accessor(self, index):
+        """ zero-copy (count, components) view of an accessor """
+        accessor = self.document['accessors'][index]
+        dtype = np.dtype(COMPONENT_TYPES[accessor['componentType']])
+        size, count = TYPE_SIZES[accessor['type']], accessor['count']
+        if 'bufferView' not in accessor:   # no data means all zeros
+            return np.zeros((count, size), dtype)
+        data, stride = self.buffer_view(accessor['bufferView'])
+        stride = stride or size * dtype.itemsize
+        values = np.ndarray((count, size), dtype, data, accessor.get('byteOffset', 0),
+                            (stride, dtype.itemsize))
+        if 'sparse' in accessor:    # only sparse accessors need their own copy
+            values = self._sparse(accessor['sparse'], values.copy(), dtype)
+        return values
+
+    def _sparse(self, sparse, values, dtype):
+        """ apply the sparse substitutions of an accessor to values """
+        indices, _ = self.buffer_view(sparse['indices']['bufferView'])
+        start = sparse['indices'].get('byteOffset', 0)
+        index_type = np.dtype(COMPONENT_TYPES[sparse['indices']['componentType']])
+        indices = np.frombuffer(indices, index_type, sparse['count'], start)
+        data, _ = self.buffer_view(sparse['values']['bufferView'])
+        start = sparse['values'].get('byteOffset', 0)
+        values[indices] = np.frombuffer(data, dtype, indices.size * values.shape[1],
+                                        start).reshape(-1, values.shape[1])
+        return values
+
+    def attribute(self, index):
+        """ VertexArray Attribute sharing the GL buffer of its buffer view """
+        accessor = self.document['accessors'][index]
+        if 'bufferView' not in accessor or 'sparse' in accessor:
+            return self.accessor(index)
+        dtype = np.dtype(COMPONENT_TYPES[accessor['componentType']])
+        data, stride = self.buffer_view(accessor['bufferView'])
+        return Attribute(data, TYPE_SIZES[accessor['type']], GL_TYPES[dtype],
+                         accessor.get('normalized', False), stride,
+                         accessor.get('byteOffset', 0), accessor['count'])
+
+    def close(self):
+        """ release the file mappings, once every view has been dropped """
+        self.views = {}
+        for mapped in self.maps:
+            mapped.close()
+        self.maps = []
+
+def node_transform(info):
+    """ 4x4 node matrix from glTF 'matrix' (column major) or TRS fields """
+    if 'matrix' in info:
+        return np.array(info['matrix'], 'f').reshape(4, 4).T
+    x, y, z, w = info.get('rotation', (0, 0, 0, 1))
+    return (translate(info.get('translation', (0, 0, 0)))
+            @ quaternion_matrix(np.array((w, x, y, z), 'f'))
+            @ scale(info.get('scale', (1, 1, 1))).astype('f'))
+
+def load_gltf(file, scene=None):
+    """ load a .gltf or .glb file, return its scene as a Node hierarchy
+        whose leaves are one ColorMesh per glTF primitive """
+    try:
+        gltf = GLTF(file)
+    except (OSError, ValueError, KeyError) as error:
+        print('ERROR: unable to load', file, error)
+        return Node(name=file)
+
+    document = gltf.document
+    meshes = []
+    for mesh in document.get('meshes', []):
+        primitives = []
+        for primitive in mesh['primitives']:
+            attributes = [gltf.attribute(primitive['attributes'][name])
+                          if name in primitive['attributes'] else None
+                          for name in ATTRIBUTES]
+            index = primitive.get('indices')
+            index = None if index is None else np.ascontiguousarray(
+                gltf.accessor(index).reshape(-1))
+            drawable = ColorMesh(attributes, index,
+                                 primitive=primitive.get('mode', 4))
+            materials = document.get('materials', [])
+            drawable.material = (materials[primitive['material']]
+                                 if 'material' in primitive else {})
+            primitives.append(drawable)
+        meshes.append(primitives)
+
+    nodes = [Node(name=info.get('name', ''), transform=node_transform(info),
+                  children=meshes[info['mesh']] if 'mesh' in info else ())
+             for info in document.get('nodes', [])]
+    for node, info in zip(nodes, document.get('nodes', [])):
+        node.add(*(nodes[child] for child in info.get('children', ())))
+
+    children = {child for info in document.get('nodes', [])
+                for child in info.get('children', ())}
+    roots = [i for i in range(len(nodes)) if i not in children]
+    scenes = document.get('scenes', [{'nodes': roots}])
+    scene = document.get('scene', 0) if scene is None else scene
+    root = Node(name=file, transform=identity(),
+                children=[nodes[i] for i in scenes[scene].get('nodes', ())])
+    root.gltf = gltf  # keep the mapped file alive with the scene
+    count = sum(len(primitives) for primitives in meshes)
+    print('Loaded %s\t(%d nodes, %d primitives)' % (file, len(nodes), count))
+    return root
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Keyboard and mouse input gathered by the GLFW callbacks and snapshot once
+per frame: drawables bind callbacks to keys instead of polling glfw.get_key
+"""
+import weakref
+from collections import namedtuple
+import glfw                         # lean window system wrapper for OpenGL
+
+# input of one frame: keys and mouse buttons held, keys pressed since the
+# previous frame, mouse position with y going up
+InputState = namedtuple('InputState', 'keys buttons pressed mouse')
+
+def _reference(callback):
+    """ bound methods are kept weakly, not to keep their drawable alive """
+    if hasattr(callback, '__self__') and hasattr(callback, '__func__'):
+        return weakref.WeakMethod(callback)
+    return lambda: callback
+
+class Input:
+    """ Events as they arrive from the window callbacks, turned into one
+        InputState per frame by frame(), which also calls the callbacks
+        bound to the keys pressed since the previous frame """
+
+    def __init__(self):
+        self.keys, self.buttons, self.mouse = set(), set(), (0, 0)
+        self.events = []                # (key, action) since the last frame
+        self.bindings = {}              # key => [(callback reference, repeat)]
+        self.state = InputState(frozenset(), frozenset(), frozenset(), self.mouse)
+
+    def on_key(self, key, action):
+        if action == glfw.PRESS:
+            self.keys.add(key)
+        elif action == glfw.RELEASE:
+            self.keys.discard(key)
+        if action != glfw.RELEASE:
+            self.events.append((key, action))
+
+    def on_mouse_button(self, button, action):
+        if action == glfw.PRESS:
+            self.buttons.add(button)
+        elif action == glfw.RELEASE:
+            self.buttons.discard(button)
+
+    def on_mouse_move(self, position):
+        self.mouse = position
+
+    def bind(self, key, callback, repeat=False):
+        """ call callback() in the next frame after key is pressed, and
+            while it auto-repeats if repeat is True """
+        self.bindings.setdefault(key, []).append((_reference(callback), repeat))
+
+    def unbind(self, key, callback):
+        """ remove the bindings of callback to key """
+        self.bindings[key] = [(reference, repeat) for reference, repeat in
+                              self.bindings.get(key, ()) if reference() != callback]
+
+    def frame(self):
+        """ InputState of the frame starting, after running the bindings """
+        events, self.events = self.events, []
+        self.state = InputState(frozenset(self.keys), frozenset(self.buttons),
+                                frozenset(key for key, _ in events), self.mouse)
+        for key, action in events:
+            bindings = self.bindings.get(key, ())
+            for reference, repeat in bindings:
+                callback = reference()
+                if callback is not None and (repeat or action == glfw.PRESS):
+                    callback()
+            if any(reference() is None for reference, _ in bindings):
+                self.bindings[key] = [(reference, repeat) for reference, repeat in
+                                      bindings if reference() is not None]
+        return self.state
+
+# shared by the viewer windows and the drawables binding keys
+events = Input()
+
+def bind_key(key, callback, repeat=False):
+    """ call callback() once per press of key, see Input.bind """
+    events.bind(key, callback, repeat)
@@ -3,12 +3,32 @@
 3D resources loader
 Return an list of ColorMesh
 """
+from multiprocessing import Pool, shared_memory
+import numpy as np
 import pyassimp                     # 3D ressource loader
 import pyassimp.errors              # assimp error management + exceptions
 from opengl_tools.color_mesh import ColorMesh
+from opengl_tools import meshopt
+
+def _mesh_arrays(mesh):
+    """ vertices, normals, tex coords (or None) and faces of an assimp mesh """
+    # tex coords in raster order: compute 1 - y to follow OpenGL convention
+    tex_uv = ((0, 1) + mesh.texturecoords[0][:, :2] * (1, -1)
+              if mesh.texturecoords.size else None)
+    return mesh.vertices, mesh.normals, tex_uv, mesh.faces
+
+def load(file, optimize=False):
+    """ load resources from file using pyassimp, return list of ColorMesh.
+        With optimize, meshes go through opengl_tools.meshopt first and the
+        optimized result is cached next to the file for the next runs """
+    if optimize:
+        cached = meshopt.load_cache(file)
+        if cached is not None:
+            meshes = [ColorMesh(attributes[:2], faces) for attributes, faces in cached]
+            size = sum(faces.shape[0] for _, faces in cached)
+            print('Loaded %s\t(%d meshes, %d faces, cached)' % (file, len(meshes), size))
+            return meshes
 
-def load(file):
-    """ load resources from file using pyassimp, return list of ColorMesh """
     try:
         option = pyassimp.postprocess.aiProcessPreset_TargetRealtime_MaxQuality
         scene = pyassimp.load(file, option)
@@ -16,9 +36,136 @@ def load(file):
         print('ERROR: pyassimp unable to load', file)
         return []  # error reading => return empty list
 
-    meshes = [ColorMesh([m.vertices, m.normals], m.faces) for m in scene.meshes]
+    if optimize:
+        optimized = [meshopt.optimize(list(_mesh_arrays(m)[:3]), m.faces, name=file)[:2]
+                     for m in scene.meshes]
+        meshopt.save_cache(file, optimized)
+        meshes = [ColorMesh(attributes[:2], faces) for attributes, faces in optimized]
+    else:
+        meshes = [ColorMesh([m.vertices, m.normals], m.faces) for m in scene.meshes]
     size = sum((mesh.faces.shape[0] for mesh in scene.meshes))
     print('Loaded %s\t(%d meshes, %d faces)' % (file, len(scene.meshes), size))
 
     pyassimp.release(scene)
     return meshes
+
+def import_arrays(file):
+    """ GL free import: list of (vertices, normals, tex_uv, faces) copies """
+    try:
+        option = pyassimp.postprocess.aiProcessPreset_TargetRealtime_MaxQuality
+        scene = pyassimp.load(file, option)
+    except pyassimp.errors.AssimpError:
+        print('ERROR: pyassimp unable to load', file)
+        return []  # error reading => return empty list
+    meshes = [tuple(None if a is None else np.array(a) for a in _mesh_arrays(m))
+              for m in scene.meshes]
+    pyassimp.release(scene)
+    return meshes
+
+# -------------- parallel import through shared memory -----------------------
+def _import_shared(file):
+    """ Worker side: import file with pyassimp, copy every array into one
+        shared memory block and return only its name and array layouts.
+        Any failure returns no block, the parent reports the file """
+    try:
+        option = pyassimp.postprocess.aiProcessPreset_TargetRealtime_MaxQuality
+        scene = pyassimp.load(file, option)
+    except Exception:   # AssimpError, or whatever a broken file raises
+        return file, None, []
+
+    block = None
+    try:
+        arrays = [[None if a is None else np.ascontiguousarray(a)
+                   for a in _mesh_arrays(mesh)] for mesh in scene.meshes]
+
+        # one block per file, each array aligned on 16 bytes inside it
+        layouts, offset = [], 0
+        for mesh in arrays:
+            layout = []
+            for array in mesh:
+                if array is None:
+                    layout.append(None)
+                    continue
+                layout.append((offset, array.shape, array.dtype.str))
+                offset += -(-array.nbytes // 16) * 16
+            layouts.append(layout)
+
+        block = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        for mesh, layout in zip(arrays, layouts):
+            for array, entry in zip(mesh, layout):
+                if array is not None:
+                    start, shape, dtype = entry
+                    np.ndarray(shape, dtype, block.buf, start)[...] = array
+        name = block.name
+        block.close()   # parent process owns the block from now on
+        return file, name, layouts
+    except Exception:
+        if block is not None:
+            block.close()
+            block.unlink()
+        return file, None, []
+    finally:
+        pyassimp.release(scene)
+
+def _copy_block(name):
+    """ parent side: a worker's block as one array owned by this process,
+        so no mapping outlives the block nor the block the arrays. The
+        block is freed """
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        return np.frombuffer(block.buf, np.uint8).copy()
+    finally:
+        block.close()
+        block.unlink()
+
+def _unlink_block(name):
+    """ free a worker's block left uncopied """
+    try:
+        block = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    block.close()
+    block.unlink()
+
+def _color_mesh(vertices, normals, _tex_uv, faces):
+    """ default load_many factory, same meshes as load() """
+    return ColorMesh([vertices, normals], faces)
+
+def load_many(files, factory=_color_mesh, processes=None):
+    """ load several files in parallel, return a list of mesh lists.
+        pyassimp imports run in worker processes, arrays come back through
+        shared memory and factory(vertices, normals, tex_uv, faces) builds
+        the drawables (and their VAOs) here, on the GL thread """
+    with Pool(processes) as pool:
+        results = pool.map(_import_shared, files, chunksize=1)
+
+    # every block is freed here, even if a copy fails; a factory raising
+    # below leaves nothing in shared memory
+    copies, names = {}, [name for _, name, _ in results if name is not None]
+    try:
+        for name in names:
+            copies[name] = _copy_block(name)
+    finally:
+        for name in names:
+            if name not in copies:
+                _unlink_block(name)
+
+    scenes = []
+    for file, name, layouts in results:
+        if name is None:
+            print('ERROR: pyassimp unable to load', file)
+            scenes.append([])  # error reading => empty list for this file
+            continue
+
+        data = copies[name]
+        meshes = []
+        for layout in layouts:
+            arrays = [None if entry is None else
+                      np.ndarray(entry[1], entry[2], data, entry[0])
+                      for entry in layout]
+            meshes.append(factory(*arrays))
+
+        size = sum(layout[3][1][0] for layout in layouts)
+        print('Loaded %s\t(%d meshes, %d faces)' % (file, len(layouts), size))
+        scenes.append(meshes)
+    return scenes
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Level of detail: ColorMesh with a chain of simplified index buffers and
+the Node choosing the level from the projected size on screen
+"""
+import numpy as np
+from opengl_tools.color_mesh import ColorMesh
+from opengl_tools.node import Node
+from opengl_tools.simplify import simplify, LOD_RATIOS
+
+# projected bounding sphere radius (fraction of half the viewport height)
+# under which each coarser level is used
+LOD_THRESHOLDS = (0.25, 0.12, 0.06)
+
+class LODMesh(ColorMesh):
+    """ ColorMesh whose index buffer holds every level one after the other """
+
+    def __init__(self, attributes, levels, **param):
+        self.levels = [np.asarray(level, np.uint32).ravel() for level in levels]
+        sizes = [level.size for level in self.levels]
+        self.ranges = list(zip(sizes, np.cumsum([0] + sizes[:-1]).tolist()))
+        super().__init__(attributes, np.concatenate(self.levels), **param)
+        self.set_level(0)
+
+        # bounding sphere of the positions, for the screen size estimate
+        positions = np.asarray(attributes[0], np.float64).reshape(-1, 3)
+        self.center = (positions.min(axis=0) + positions.max(axis=0)) / 2
+        self.radius = float(np.linalg.norm(positions - self.center, axis=1).max())
+
+    def set_level(self, level):
+        """ draw level 'level' (0 is full resolution) from now on """
+        self.level = min(level, len(self.ranges) - 1)
+        self.index_range = self.ranges[self.level]
+
+def lod_mesh(mesh, ratios=LOD_RATIOS):
+    """ LODMesh from a ColorMesh (e.g. from loader.load), simplified with
+        quadric error metrics to ratio * triangles for each level """
+    levels = simplify(mesh.attributes[0], mesh.index, ratios)
+    return LODMesh(mesh.attributes, levels, uniforms=mesh.uniforms3fv,
+                   primitive=mesh.primitive, usage=mesh.usage)
+
+class LODNode(Node):
+    """ Node selecting the level of its LODMesh children from their
+        bounding sphere projected with the frame's projection matrix """
+
+    def __init__(self, thresholds=LOD_THRESHOLDS, hysteresis=0.15, **param):
+        super().__init__(**param)   # forward base constructor named arguments
+        self.thresholds, self.hysteresis = thresholds, hysteresis
+        self.level = 0
+
+    def bounding_sphere(self):
+        """ sphere (center, radius) around every LODMesh child """
+        meshes = [child for child in self.children if isinstance(child, LODMesh)]
+        if not meshes:
+            return np.zeros(3), 0.
+        low = np.min([mesh.center - mesh.radius for mesh in meshes], axis=0)
+        high = np.max([mesh.center + mesh.radius for mesh in meshes], axis=0)
+        center = (low + high) / 2
+        radius = max(np.linalg.norm(mesh.center - center) + mesh.radius for mesh in meshes)
+        return center, radius
+
+    def screen_size(self, projection, view, model):
+        """ projected sphere radius, as a fraction of half the viewport height """
+        center, radius = self.bounding_sphere()
+        model = model @ self.transform
+        depth = -(view @ model @ np.append(center, 1))[2]
+        scale = np.linalg.norm(model[:3, :3], axis=0).max()
+        if depth <= 1e-6:
+            return float('inf')  # camera inside or behind: full detail
+        return radius * scale * projection[1][1] / depth
+
+    def select(self, size):
+        """ level for a screen size, only leaving the current level once the
+            size is out of its bounds by the hysteresis margin """
+        level = self.level
+        while level < len(self.thresholds) and size < self.thresholds[level] * (1 - self.hysteresis):
+            level += 1
+        while level > 0 and size > self.thresholds[level - 1] * (1 + self.hysteresis):
+            level -= 1
+        return level
+
+    def draw(self, projection, view, model, color_shader, **param):
+        self.level = self.select(self.screen_size(projection, view, model))
+        for child in self.children:
+            if isinstance(child, LODMesh):
+                child.set_level(self.level)
+
+        # call Node's draw method to pursue the hierarchical tree calling
+        super().draw(projection, view, model, color_shader, **param)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Mesh optimization: vertex welding, post-transform vertex cache order
+(Tipsify), overdraw order of the Tipsify clusters and vertex fetch order
+Offline use: python3 -m opengl_tools.meshopt file.obj ... writes the cache
+"""
+import os                           # os function, i.e. checking file status
+import sys
+from collections import deque
+import numpy as np
+
+CACHE_SIZE = 16                     # typical post-transform cache entries
+CACHE_SUFFIX = '.meshopt.npz'
+
+# -------------- metrics -------------------------------------------------------
+def cache_misses(faces, cache_size=CACHE_SIZE):
+    """ number of vertex transforms with a FIFO post-transform cache """
+    fifo, cached, misses = deque(), set(), 0
+    for vertex in np.asarray(faces).ravel().tolist():
+        if vertex in cached:
+            continue
+        misses += 1
+        fifo.append(vertex)
+        cached.add(vertex)
+        if len(fifo) > cache_size:
+            cached.discard(fifo.popleft())
+    return misses
+
+def statistics(faces, vertex_count, cache_size=CACHE_SIZE):
+    """ ACMR (transforms per triangle) and ATVR (transforms per vertex) """
+    misses = cache_misses(faces, cache_size)
+    return misses / max(len(faces), 1), misses / max(vertex_count, 1)
+
+# -------------- optimization stages ----------------------------------------
+def weld(attributes, faces):
+    """ merge vertices whose attributes are all identical """
+    used = [np.ascontiguousarray(a) for a in attributes if a is not None]
+    rows = np.hstack([a.reshape(len(a), -1).view(np.uint8) for a in used])
+    rows = np.ascontiguousarray(rows).view(np.dtype((np.void, rows.shape[1])))
+    _, first, inverse = np.unique(rows.ravel(), return_index=True,
+                                  return_inverse=True)
+    welded = [None if a is None else a[first] for a in attributes]
+    return welded, inverse.ravel()[faces].astype(np.uint32)
+
+def _adjacency(faces, vertex_count):
+    """ CSR vertex => triangles table: triangles[offsets[v]:offsets[v+1]] """
+    order = np.argsort(faces.ravel(), kind='stable')
+    offsets = np.zeros(vertex_count + 1, np.int64)
+    np.cumsum(np.bincount(faces.ravel(), minlength=vertex_count), out=offsets[1:])
+    return (order // 3).tolist(), offsets.tolist()
+
+def tipsify(faces, vertex_count, cache_size=CACHE_SIZE):
+    """ Sander et al. 2007 linear-speed vertex cache optimization, return
+        the new triangle order and the start of each cluster (cache flush) """
+    triangles, offsets = _adjacency(faces, vertex_count)
+    corners = faces.tolist()
+    live = np.diff(offsets).tolist()          # triangles left per vertex
+    stamps = [-cache_size - 1] * vertex_count  # time each vertex entered cache
+    emitted = [False] * len(corners)
+    dead_end, order, clusters = [], [], [0]
+    time, cursor, fanning = cache_size + 1, 1, 0 if vertex_count else -1
+
+    while fanning >= 0:
+        candidates = []
+        for triangle in triangles[offsets[fanning]:offsets[fanning + 1]]:
+            if emitted[triangle]:
+                continue
+            for vertex in corners[triangle]:
+                dead_end.append(vertex)
+                candidates.append(vertex)
+                live[vertex] -= 1
+                if time - stamps[vertex] > cache_size:
+                    stamps[vertex] = time
+                    time += 1
+            emitted[triangle] = True
+            order.append(triangle)
+
+        # next fanning vertex: still in cache after its remaining triangles
+        best, priority = -1, -1
+        for vertex in candidates:
+            if live[vertex] > 0:
+                age = time - stamps[vertex]
+                score = age if age + 2 * live[vertex] <= cache_size else 0
+                if score > priority:
+                    best, priority = vertex, score
+        if best < 0:
+            while dead_end and best < 0:
+                vertex = dead_end.pop()
+                best = vertex if live[vertex] > 0 else -1
+            while best < 0 and cursor < vertex_count:
+                best = cursor if live[cursor] > 0 else -1
+                cursor += 1
+            if best >= 0 and len(order) < len(corners):
+                clusters.append(len(order))   # cache was flushed here
+        fanning = best
+    return np.array(order, np.int64), np.array(clusters, np.int64)
+
+def overdraw(vertices, faces, clusters):
+    """ sort clusters outer-facing first, so they tend to occlude the rest
+        (Sander et al. 2007 linear-speed overdraw ordering) """
+    triangles = vertices[faces].astype(np.float64)
+    normals = np.cross(triangles[:, 1] - triangles[:, 0],
+                       triangles[:, 2] - triangles[:, 0])
+    areas = np.linalg.norm(normals, axis=1)
+    centers = triangles.mean(axis=1)
+    weights = np.maximum(areas, 1e-12)
+    center = (centers * weights[:, None]).sum(axis=0) / weights.sum()
+
+    cluster = np.repeat(np.arange(len(clusters)), np.diff(np.append(clusters, len(faces))))
+    sums = np.zeros((len(clusters), 3))
+    np.add.at(sums, cluster, centers * weights[:, None])
+    cluster_centers = sums / np.bincount(cluster, weights, len(clusters))[:, None]
+    cluster_normals = np.zeros((len(clusters), 3))
+    np.add.at(cluster_normals, cluster, normals)
+    score = ((cluster_centers - center) * cluster_normals).sum(axis=1)
+    rank = np.argsort(-score, kind='stable')
+    return np.argsort(np.argsort(rank)[cluster], kind='stable')
+
+def fetch_order(attributes, faces):
+    """ renumber vertices by first use, dropping unreferenced ones """
+    flat = faces.ravel()
+    _, first = np.unique(flat, return_index=True)
+    used = flat[np.sort(first)]
+    remap = np.zeros(len(next(a for a in attributes if a is not None)), np.int64)
+    remap[used] = np.arange(used.size)
+    reordered = [None if a is None else a[used] for a in attributes]
+    return reordered, remap[faces].astype(np.uint32)
+
+def optimize(attributes, faces, cache_size=CACHE_SIZE, name=''):
+    """ full pipeline on an indexed triangle mesh, attributes[0] being the
+        positions. Return optimized (attributes, faces) and the statistics """
+    faces = np.asarray(faces, np.uint32).reshape(-1, 3)
+    count = len(attributes[0])
+    before = statistics(faces, count, cache_size)
+
+    attributes, faces = weld(attributes, faces)
+    count = len(attributes[0])
+    order, clusters = tipsify(faces, count, cache_size)
+    faces = faces[order]
+    faces = faces[overdraw(attributes[0], faces, clusters)]
+    attributes, faces = fetch_order(attributes, faces)
+
+    after = statistics(faces, len(attributes[0]), cache_size)
+    print('Optimized %s\tACMR %.3f -> %.3f, ATVR %.3f -> %.3f' % (
+        name, before[0], after[0], before[1], after[1]))
+    return attributes, faces, {'acmr': (before[0], after[0]),
+                               'atvr': (before[1], after[1])}
+
+# -------------- optimized mesh cache -----------------------------------------
+def cache_file(file):
+    """ cache file storing the optimized meshes of a source file """
+    return file + CACHE_SUFFIX
+
+def save_cache(file, meshes):
+    """ store a list of (attributes, faces) next to the source file """
+    arrays = {}
+    for number, (attributes, faces) in enumerate(meshes):
+        arrays['faces_%d' % number] = faces
+        for location, attribute in enumerate(attributes):
+            if attribute is not None:
+                arrays['attribute_%d_%d' % (number, location)] = attribute
+    np.savez(cache_file(file), count=len(meshes), **arrays)
+
+def load_cache(file):
+    """ list of (attributes, faces) if the cache is newer than file, or None """
+    cache = cache_file(file)
+    if not os.path.exists(cache) or os.path.getmtime(cache) < os.path.getmtime(file):
+        return None
+    with np.load(cache) as arrays:
+        meshes = []
+        for number in range(int(arrays['count'])):
+            locations = [int(key.split('_')[2]) for key in arrays.files
+                         if key.startswith('attribute_%d_' % number)]
+            attributes = [None] * (max(locations) + 1)
+            for location in locations:
+                attributes[location] = arrays['attribute_%d_%d' % (number, location)]
+            meshes.append((attributes, arrays['faces_%d' % number]))
+    return meshes
+
+def main(files):
+    """ offline stage: optimize each file's meshes and write its cache """
+    from opengl_tools.loader import import_arrays
+    for file in files:
+        meshes = []
+        for vertices, normals, tex_uv, faces in import_arrays(file):
+            attributes, faces, _ = optimize([vertices, normals, tex_uv], faces,
+                                            name=file)
+            meshes.append((attributes, faces))
+        save_cache(file, meshes)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
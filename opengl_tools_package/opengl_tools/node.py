@@ -2,25 +2,177 @@
 """
 Create Node to hierachical modeling
 """
-import glfw                         # lean window system wrapper for OpenGL
-from opengl_tools.transform import identity
-from opengl_tools.axis import xAxis, yAxis, zAxis
+import weakref
+import numpy as np
+from opengl_tools.transform import identity, normal_matrix
+from opengl_tools.axis import Axis, xAxis, yAxis, zAxis
+from opengl_tools.color_mesh import ColorMesh
 from opengl_tools.transform import rotate
 
+def _bakeable(mesh):
+    """ plain ColorMesh (or Axis) of numpy attributes, drawn as is """
+    return type(mesh).draw in (ColorMesh.draw, Axis.draw) and \
+        all(attribute is None or isinstance(attribute, (np.ndarray, list, tuple))
+            for attribute in mesh.attributes)
+
+def _group_key(mesh, param):
+    """ meshes drawn with equal key go through the same shader inputs: same
+        primitive, attribute layout and uniforms """
+    layout = tuple(None if attribute is None else np.asarray(attribute).shape[-1]
+                   for attribute in mesh.attributes)
+    uniforms = dict(param, **mesh.uniforms3fv)
+    if isinstance(mesh, Axis):
+        uniforms['color'] = mesh.color
+    return (mesh.primitive, layout, mesh.index is None,
+            tuple((name, repr(value)) for name, value in sorted(uniforms.items())))
+
+def merge_meshes(meshes, normals=True):
+    """ one ColorMesh from (mesh, model, param) sharing a _group_key, each
+        pre-transformed by its model: positions in attribute 0 and, with
+        normals, the normals in attribute 1 """
+    attributes, indices, offset = [[] for _ in meshes[0][0].attributes], [], 0
+    for mesh, model, _ in meshes:
+        model = np.asarray(model, np.float32)
+        for number, attribute in enumerate(mesh.attributes):
+            if attribute is None:
+                continue
+            attribute = np.asarray(attribute, np.float32)
+            if number == 0 and attribute.shape[-1] == 3:
+                attribute = attribute @ model[:3, :3].T + model[:3, 3]
+            elif number == 1 and normals and attribute.shape[-1] == 3:
+                attribute = attribute @ normal_matrix(model).T
+                attribute /= np.maximum(np.linalg.norm(attribute, axis=-1, keepdims=True), 1e-12)
+            attributes[number].append(attribute)
+        if mesh.index is not None:
+            count, first = mesh.index_range
+            index = np.asarray(mesh.index, np.uint32).ravel()
+            index = index[first:] if count is None else index[first:first + count]
+            indices.append(index + offset)
+        offset += len(mesh.attributes[0])
+    attributes = [np.concatenate(attribute) if attribute else None for attribute in attributes]
+    mesh, _, param = meshes[0]
+    merged = ColorMesh(attributes, np.concatenate(indices) if indices else None,
+                       dict(mesh.uniforms3fv), mesh.primitive)
+    if isinstance(mesh, Axis):
+        param = dict(param, color=mesh.color)
+    return merged, param
+
+class FrozenMesh:
+    """ merged mesh of a frozen Node, drawn with the Node parameters that
+        were on the way to its meshes """
+    def __init__(self, mesh, param):
+        self.mesh, self.param = mesh, param
+        self.primitive, self.vertex_array = mesh.primitive, mesh.vertex_array
+        self.attributes, self.index, self.index_range = mesh.attributes, mesh.index, mesh.index_range
+
+    def draw(self, projection, view, model, color_shader, **param):
+        self.mesh.draw(projection, view, model, color_shader, **dict(param, **self.param))
+
 class Node:
     """ Scene graph transform and parameter broadcast node """
-    def __init__(self, name='', children=(), transform=identity(), **param):
+    changes = 0                         # goes up with any node version
+    animations = weakref.WeakSet()      # nodes asking for frames, see animating()
+
+    def __init__(self, name='', children=(), transform=identity(), static=False, **param):
+        # version goes up each time the transform or the children change,
+        # static tells the subtree below is not expected to move
+        self.version, self.static = 0, static
         self.transform, self.param, self.name = transform, param, name
         self.children = list(iter(children))
+        self.frozen = None              # children replaced by freeze()
+        self.baked, self.checked = (), 0   # (node, version) merged by freeze()
         # For each node, we will have his axis
         self.add(xAxis(), yAxis(), zAxis())
 
+    @property
+    def transform(self):
+        return self._transform
+
+    @transform.setter
+    def transform(self, transform):
+        """ new local transform, only a different matrix makes it dirty """
+        if getattr(self, '_transform', None) is None or \
+                not np.array_equal(transform, self._transform):
+            self.touch()
+        self._transform = transform
+
     def add(self, *drawables):
         """ Add drawables to this node, simply updating children list """
+        self.unfreeze()                 # static nodes freeze again when drawn
         self.children.extend(drawables)
+        self.touch()
+
+    def touch(self):
+        """ mark the node changed, e.g. after editing its param uniforms:
+            new version, and a new frame for on demand viewers """
+        self.version += 1
+        Node.changes += 1
+
+    def animating(self):
+        """ True while the node moves by itself (nodes added to
+            Node.animations only), so on demand viewers keep drawing """
+        return False
+
+    def update(self, step, time, inputs):
+        """ advance the node by step seconds to simulation time, with
+            inputs the keys held: new local transform, or None to keep it.
+            Runs in the Simulation, possibly on a worker thread, so no GL
+            calls and no reading of the render interpolated transform """
+        return None
+
+    def freeze(self, normals=True):
+        """ replace the meshes below this node by a few merged meshes, pre-
+            transformed into this node's space: one draw per primitive,
+            attribute layout and uniforms instead of one per mesh. Nodes
+            drawing or updating themselves (RotationControlNode...) stay
+            live under a node holding their baked transform. Attribute 1 is
+            taken as normals unless normals is False """
+        if self.frozen is not None:
+            return
+        groups, live, baked = {}, [], []
+        stack = [(child, identity(), {}) for child in reversed(self.children)]
+        while stack:
+            drawable, model, param = stack.pop()
+            if type(drawable).draw is Node.draw and type(drawable).update is Node.update:
+                model, param = model @ drawable.transform, dict(param, **drawable.param)
+                baked.append((drawable, drawable.version))
+                children = drawable.children if drawable.frozen is None else drawable.frozen
+                stack.extend((child, model, param) for child in reversed(children))
+            elif isinstance(drawable, ColorMesh) and _bakeable(drawable):
+                groups.setdefault(_group_key(drawable, param), []).append((drawable, model, param))
+            elif not np.array_equal(model, identity()) or param:
+                holder = Node(transform=model, **param)
+                holder.children = [drawable]    # no axes of its own
+                live.append(holder)
+            else:
+                live.append(drawable)
+        self.frozen = self.children
+        self.children = [FrozenMesh(*merge_meshes(meshes, normals))
+                         for meshes in groups.values()] + live
+        self.touch()
+        self.baked, self.checked = baked, Node.changes
+
+    def stale(self):
+        """ True if a node merged by freeze() changed since: its transform,
+            children or touched param are not in the merged meshes """
+        if self.frozen is None or self.checked == Node.changes:
+            return False
+        self.checked = Node.changes
+        return any(node.version != version for node, version in self.baked)
+
+    def unfreeze(self):
+        """ get back the children as they were before freeze() """
+        if self.frozen is not None:
+            self.children, self.frozen, self.baked = self.frozen, None, ()
+            self.touch()
 
     def draw(self, projection, view, model, color_shader, **param):
         """ Recursive draw, passing down named parameters & model matrix. """
+        if self.stale():
+            self.unfreeze()             # merged again below, as it is now
+            self.freeze()
+        elif self.static and self.frozen is None:
+            self.freeze()               # static subtrees are merged once
         # merge named parameters given at initialization with those given here
         param = dict(param, **self.param)
         model = model @ self.transform
@@ -29,16 +181,16 @@ class Node:
             child.draw(projection, view, model, color_shader, **param)
 
 class RotationControlNode(Node):
-    def __init__(self, key_up, key_down, axis, angle=0, **param):
-        super().__init__(**param)   # forward base constructor named arguments
-        self.angle, self.axis = angle, axis
+    """ Node turning around axis at speed degrees per second while key_up
+        or key_down is held """
+    def __init__(self, key_up, key_down, axis, angle=0, speed=120, **param):
+        super().__init__(transform=rotate(axis=axis, angle=angle), **param)
+        self.angle, self.axis, self.speed = angle, axis, speed
         self.key_up, self.key_down = key_up, key_down
 
-    def draw(self, projection, view, model, color_shader, win=None, **param):
-        assert win is not None
-        self.angle += 2 * int(glfw.get_key(win, self.key_up) == glfw.PRESS)
-        self.angle -= 2 * int(glfw.get_key(win, self.key_down) == glfw.PRESS)
-        self.transform = rotate(axis=self.axis, angle=self.angle)
-
-        # call Node's draw method to pursue the hierarchical tree calling
-        super().draw(projection, view, model, color_shader, win=win, **param)
+    def update(self, step, time, inputs):
+        turn = (self.key_up in inputs) - (self.key_down in inputs)
+        if not turn:
+            return None
+        self.angle += turn * self.speed * step
+        return rotate(axis=self.axis, angle=self.angle)
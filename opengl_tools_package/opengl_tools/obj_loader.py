@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Wavefront OBJ/MTL loader written with NumPy only, no assimp needed
+Return an list of ColorMesh, like loader.load
+"""
+import os                           # os function, i.e. checking file status
+import re                           # bulk line extraction on the whole file
+import sys
+import time
+from itertools import chain
+import numpy as np
+from opengl_tools.color_mesh import ColorMesh
+
+_VERTEX = re.compile(rb'^v[ \t]+([^\r\n#]*)', re.M)
+_TEXCOORD = re.compile(rb'^vt[ \t]+([^\r\n#]*)', re.M)
+_NORMAL = re.compile(rb'^vn[ \t]+([^\r\n#]*)', re.M)
+_FACE = re.compile(rb'^f[ \t]+([^\r\n#]*)', re.M)
+_USEMTL = re.compile(rb'^usemtl[ \t]+([^\r\n#]*)', re.M)
+_MTLLIB = re.compile(rb'^mtllib[ \t]+([^\r\n#]*)', re.M)
+
+def _floats(lines, width):
+    """ (len(lines), width) float32 array from 'x y z ...' text lines """
+    if not lines:
+        return np.zeros((0, width), np.float32)
+    # lines parsed at once, 'inf' between them to check their value counts
+    values = np.fromstring(b' inf '.join(lines), np.float32, sep=' ')
+    ends = np.flatnonzero(np.isinf(values))
+    if len(ends) == len(lines) - 1:
+        counts = np.diff(np.concatenate(([-1], ends, [values.size]))) - 1
+        if counts[0] >= width and np.all(counts == counts[0]):
+            return values[np.isfinite(values)].reshape(len(lines), -1)[:, :width]
+    # lines of different lengths (optional w, colors...): slow path
+    rows = [(line.split() + [b'0'] * width)[:width] for line in lines]
+    return np.array(rows, np.float32)
+
+def _corners(tokens):
+    """ (n, 3) int64 array of v/vt/vn indices, 0 when an index is missing """
+    fields = tokens[0].count(b'/') + 1
+    text = b' '.join(tokens)
+    text = text.replace(b'//', b'/0/') if fields == 3 else text
+    values = np.fromstring(text.replace(b'/', b' '), np.int64, sep=' ')
+    if values.size == len(tokens) * fields:
+        corners = np.zeros((len(tokens), 3), np.int64)
+        corners[:, :fields] = values.reshape(-1, fields)
+        return corners
+    # mixed corner formats in the same file: slow path
+    rows = [[int(i) if i else 0 for i in (token.split(b'/') + [b'', b''])[:3]]
+            for token in tokens]
+    return np.array(rows, np.int64)
+
+def _resolve(indices, count, declared):
+    """ 1-based and negative (relative) OBJ indices to 0-based, -1 if none """
+    indices = indices - 1
+    relative = indices < -1
+    if relative.any():
+        indices[relative] += declared[relative] + 1
+    return np.where((indices >= 0) & (indices < count), indices, -1)
+
+def _declared_before(data, pattern, offsets):
+    """ number of lines matching pattern before each of the given offsets """
+    starts = np.array([m.start() for m in pattern.finditer(data)], np.int64)
+    return np.searchsorted(starts, offsets)
+
+def _triangulate(counts):
+    """ fan triangulation: (t, 3) corner indices of polygons of 'counts' """
+    counts = np.asarray(counts, np.int64)
+    starts = np.cumsum(counts) - counts
+    triangles = np.maximum(counts - 2, 0)
+    polygon = np.repeat(np.arange(counts.size), triangles)
+    first = np.repeat(np.cumsum(triangles) - triangles, triangles)
+    step = np.arange(polygon.size) - first + 1
+    corner = starts[polygon]
+    return np.stack((corner, corner + step, corner + step + 1), axis=1)
+
+def smooth_normals(vertices, faces):
+    """ area weighted vertex normals of an indexed triangle mesh """
+    triangles = vertices[faces]
+    face_normals = np.cross(triangles[:, 1] - triangles[:, 0],
+                            triangles[:, 2] - triangles[:, 0])
+    normals = np.zeros(vertices.shape, np.float64)
+    for corner in range(3):
+        np.add.at(normals, faces[:, corner], face_normals)
+    norm = np.linalg.norm(normals, axis=1, keepdims=True)
+    return (normals / np.where(norm > 0, norm, 1)).astype(np.float32)
+
+def load_mtl(file):
+    """ parse a MTL file, return a dict of material name => properties """
+    materials, current = {}, None
+    try:
+        with open(file, 'r') as mtl:
+            lines = mtl.read().splitlines()
+    except FileNotFoundError:
+        print('ERROR: unable to load material file', file)
+        return materials
+    for line in lines:
+        tokens = line.split('#')[0].split()
+        if not tokens:
+            continue
+        key, values = tokens[0], tokens[1:]
+        if key == 'newmtl':
+            current = materials[' '.join(values)] = {}
+        elif current is None:
+            continue
+        elif key.startswith('map_'):
+            # texture path relative to the MTL file, keep the last token only
+            path = os.path.join(os.path.dirname(file), values[-1])
+            current[key] = path
+        elif key in ('Ka', 'Kd', 'Ks', 'Ke', 'Tf'):
+            current[key] = np.array(values[:3], np.float32)
+        elif key in ('Ns', 'Ni', 'd', 'Tr', 'illum'):
+            current[key] = float(values[0])
+    return materials
+
+def parse_obj(file, smooth=False):
+    """ parse an OBJ file without any GL call, return one tuple per material:
+        (vertices, normals, tex_uv or None, faces, material properties) """
+    with open(file, 'rb') as obj:
+        data = obj.read()
+
+    positions = _floats(_VERTEX.findall(data), 3)
+    texcoords = _floats(_TEXCOORD.findall(data), 2)
+    normals = _floats(_NORMAL.findall(data), 3)
+
+    materials = {}
+    for library in _MTLLIB.findall(data):
+        path = os.path.join(os.path.dirname(file), library.strip().decode())
+        materials.update(load_mtl(path))
+
+    # faces are grouped per material, from one usemtl line to the next
+    groups, start, name = {}, 0, None
+    for match in chain(_USEMTL.finditer(data), [None]):
+        end = match.start() if match else len(data)
+        groups.setdefault(name, []).append((start, end))
+        if match:
+            start, name = match.end(), match.group(1).strip().decode()
+
+    meshes = []
+    for name, parts in groups.items():
+        faces, face_offsets = [], []
+        for start, end in parts:
+            matches = list(_FACE.finditer(data, start, end))
+            faces += [m.group(1).split() for m in matches]
+            face_offsets += [m.start() for m in matches]
+        if not faces:
+            continue
+
+        counts = np.fromiter(map(len, faces), np.int64, len(faces))
+        corners = _corners(list(chain.from_iterable(faces)))
+        if (corners < 0).any():  # relative indices need the line positions
+            polygon = np.repeat(np.array(face_offsets, np.int64), counts)
+            declared = [_declared_before(data, pattern, polygon)
+                        for pattern in (_VERTEX, _TEXCOORD, _NORMAL)]
+        else:
+            declared = [None, None, None]
+        vertex = _resolve(corners[:, 0], len(positions), declared[0])
+        texcoord = _resolve(corners[:, 1], len(texcoords), declared[1])
+        normal = _resolve(corners[:, 2], len(normals), declared[2])
+        normal = np.full_like(normal, -1) if smooth else normal
+
+        # de-duplicate v/vt/vn triplets, keeping first appearance order
+        keys = ((vertex * (len(texcoords) + 1) + texcoord + 1)
+                * (len(normals) + 1) + normal + 1)
+        _, first, inverse = np.unique(keys, return_index=True,
+                                      return_inverse=True)
+        order = np.argsort(first)
+        rank = np.empty_like(order)
+        rank[order] = np.arange(order.size)
+        unique = first[order]
+        indices = rank[inverse.ravel()][_triangulate(counts)]
+
+        mesh_vertices = positions[vertex[unique]]
+        if smooth:  # weld on positions so normals are shared along seams
+            welded = smooth_normals(positions, vertex[unique][indices])
+            mesh_normals = welded[vertex[unique]]
+        elif (normal[unique] < 0).any():
+            mesh_normals = smooth_normals(mesh_vertices, indices)
+        else:
+            mesh_normals = normals[normal[unique]]
+        tex_uv = None
+        if len(texcoords) and (texcoord[unique] >= 0).all():
+            # tex coords in raster order: 1 - y, same as the assimp loaders
+            tex_uv = (0, 1) + texcoords[texcoord[unique]] * (1, -1)
+            tex_uv = tex_uv.astype(np.float32)
+
+        meshes.append((np.ascontiguousarray(mesh_vertices, np.float32),
+                       np.ascontiguousarray(mesh_normals, np.float32),
+                       tex_uv, indices.astype(np.uint32),
+                       materials.get(name, {})))
+    return meshes
+
+def _color_mesh(vertices, normals, _tex_uv, faces):
+    """ default load_obj factory, same meshes as loader.load() """
+    return ColorMesh([vertices, normals], faces)
+
+def load_obj(file, smooth=False, factory=_color_mesh):
+    """ load an OBJ file without pyassimp, return list of ColorMesh (or of
+        factory(vertices, normals, tex_uv, faces) results) """
+    try:
+        parsed = parse_obj(file, smooth)
+    except (OSError, ValueError, IndexError) as error:
+        print('ERROR: unable to load', file, error)
+        return []  # error reading => return empty list
+
+    meshes = []
+    for vertices, normals, tex_uv, faces, material in parsed:
+        mesh = factory(vertices, normals, tex_uv, faces)
+        mesh.material = material
+        meshes.append(mesh)
+    size = sum(faces.shape[0] for _, _, _, faces, _ in parsed)
+    print('Loaded %s\t(%d meshes, %d faces)' % (file, len(meshes), size))
+    return meshes
+
+def benchmark(file, repeat=3):
+    """ compare parse_obj with the pyassimp import used by loader.load """
+    import pyassimp                 # only needed for the comparison
+    timings = {}
+    for name in ('numpy', 'assimp'):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            if name == 'numpy':
+                parse_obj(file)
+            else:
+                option = pyassimp.postprocess.aiProcessPreset_TargetRealtime_MaxQuality
+                pyassimp.release(pyassimp.load(file, option))
+            best = min(best, time.perf_counter() - start)
+        timings[name] = best
+    print('%s\tnumpy %.3fs, assimp %.3fs (x%.1f)' % (
+        file, timings['numpy'], timings['assimp'],
+        timings['assimp'] / timings['numpy']))
+    return timings
+
+if __name__ == '__main__':
+    for obj_file in sys.argv[1:]:
+        benchmark(obj_file)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Hardware occlusion culling: the bounding box of a Node is drawn in a
+GL_ANY_SAMPLES_PASSED query, its subtree skipped while the box is hidden.
+Results are read one or more frames late, never waiting for the GPU
+"""
+import random
+import numpy as np
+from opengl_tools.gl import GL      # OpenGL functions, see opengl_tools.gl
+from opengl_tools.frame_uniforms import near_far
+from opengl_tools.node import Node
+from opengl_tools.shader_registry import get_shader
+from opengl_tools.shaders_glsl import SHADOW_VERT, SHADOW_FRAG
+from opengl_tools.transform import identity, scale, translate
+from opengl_tools.vertex_array import VertexArray
+
+# frames a visible node stays visible without being queried again
+OCCLUSION_INTERVAL = 8
+
+# unit cube [-1, 1]^3 as 12 triangles, drawn without face culling
+_CORNERS = np.array([(x, y, z) for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)], np.float32)
+_FACES = np.array([(0, 1, 3), (0, 3, 2), (4, 6, 7), (4, 7, 5), (0, 4, 5), (0, 5, 1),
+                   (2, 3, 7), (2, 7, 6), (0, 2, 6), (0, 6, 4), (1, 5, 7), (1, 7, 3)], np.uint32)
+
+class _BoxDrawer:
+    """ depth tested, invisible boxes, shared by every OcclusionNode """
+    _instance = None
+
+    @classmethod
+    def get(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        self.shader = get_shader(SHADOW_VERT, SHADOW_FRAG)   # depth only pass
+        self.vertex_array = VertexArray([_CORNERS], _FACES)
+        self.matrix_location = GL.glGetUniformLocation(self.shader.glid, 'light_view_projection')
+        self.model_location = GL.glGetUniformLocation(self.shader.glid, 'model')
+        self.conditional = False        # inside glBeginConditionalRender
+
+    def draw(self, query, view_projection, model):
+        """ box of model matrix counted by query, no color or depth written """
+        cull = GL.glIsEnabled(GL.GL_CULL_FACE)
+        GL.glColorMask(False, False, False, False)
+        GL.glDepthMask(False)
+        GL.glDisable(GL.GL_CULL_FACE)
+        GL.glUseProgram(self.shader.glid)
+        GL.glUniformMatrix4fv(self.matrix_location, 1, True, view_projection)
+        GL.glUniformMatrix4fv(self.model_location, 1, True, model)
+        GL.glBeginQuery(GL.GL_ANY_SAMPLES_PASSED, query)
+        self.vertex_array.draw(GL.GL_TRIANGLES)
+        GL.glEndQuery(GL.GL_ANY_SAMPLES_PASSED)
+        GL.glColorMask(True, True, True, True)
+        GL.glDepthMask(True)
+        if cull:
+            GL.glEnable(GL.GL_CULL_FACE)
+
+def mesh_box(mesh):
+    """ (low, high) box of a mesh in its own space, kept on the mesh """
+    if getattr(mesh, 'local_box', None) is None:
+        positions = np.asarray(mesh.attributes[0], np.float64).reshape(-1, 3)
+        mesh.local_box = np.array([positions.min(axis=0), positions.max(axis=0)])
+    return mesh.local_box
+
+def subtree_box(drawables, model=identity(), nodes=None):
+    """ (low, high) box around every mesh below drawables, in the space of
+        model, None if there is no mesh. The nodes on the way are appended
+        to nodes, if given """
+    stack, corners = [(drawable, model) for drawable in drawables], []
+    while stack:
+        drawable, model = stack.pop()
+        if hasattr(drawable, 'children'):
+            if nodes is not None:
+                nodes.append(drawable)
+            model = model @ drawable.transform
+            stack.extend((child, model) for child in drawable.children)
+        elif hasattr(drawable, 'attributes') and drawable.attributes and \
+                isinstance(drawable.attributes[0], np.ndarray):
+            box = mesh_box(drawable)
+            local = box[np.indices((2, 2, 2)).reshape(3, -1).T, (0, 1, 2)]
+            corners.append(local @ np.asarray(model, np.float64)[:3, :3].T + np.asarray(model)[:3, 3])
+    if not corners:
+        return None
+    corners = np.concatenate(corners)
+    return corners.min(axis=0), corners.max(axis=0)
+
+class OcclusionNode(Node):
+    """ Node whose children are only drawn while its bounding box is not
+        hidden behind what was drawn before it, so draw occluders (near,
+        large objects) first. Hidden nodes query their box every frame and
+        reappear one frame late; visible ones are queried every 'interval'
+        frames. With conditional, the box query and the children draw go
+        together through glBeginConditionalRender instead """
+
+    def __init__(self, interval=OCCLUSION_INTERVAL, conditional=False, **param):
+        super().__init__(**param)   # forward base constructor named arguments
+        self.interval, self.conditional = interval, conditional
+        self.query = int(GL.glGenQueries(1)[0])
+        self.pending = False            # query issued, result not read yet
+        self.visible = True
+        self.frame = random.randrange(interval)   # spread the queries over frames
+        self.box, self.box_versions = None, None   # (node, version) below
+        self.box_checked = None         # Node.changes when last checked
+        self.stats = {'drawn': 0, 'culled': 0, 'queries': 0}
+
+    def bounding_box(self):
+        """ (low, high) local box of the children, refreshed when this node
+            or one below changes: moves, new children """
+        if self.box_checked == Node.changes:
+            return self.box
+        self.box_checked = Node.changes
+        if self.box_versions is None or \
+                any(node.version != version for node, version in self.box_versions):
+            nodes = []
+            self.box = subtree_box(self.children, nodes=nodes)
+            self.box_versions = [(node, node.version) for node in nodes + [self]]
+        return self.box
+
+    def _read_query(self):
+        """ latest query result if the GPU has it, without waiting """
+        if self.pending:
+            available = np.zeros(1, np.uint32)
+            GL.glGetQueryObjectuiv(self.query, GL.GL_QUERY_RESULT_AVAILABLE, available)
+            if available[0]:
+                result = np.zeros(1, np.uint32)
+                GL.glGetQueryObjectuiv(self.query, GL.GL_QUERY_RESULT, result)
+                self.visible, self.pending = bool(result[0]), False
+
+    def draw(self, projection, view, model, color_shader, **param):
+        box = self.bounding_box()
+        drawer = _BoxDrawer.get()
+        if box is None or (self.conditional and drawer.conditional):
+            super().draw(projection, view, model, color_shader, **param)
+            return
+        low, high = box
+        box_model = model @ self.transform @ translate(*(low + high) / 2) @ \
+            scale(*np.maximum((high - low) / 2, 1e-6))
+
+        # box crossing the near plane would be clipped: always visible
+        row = np.asarray(view @ box_model)[2]          # view space z of the corners
+        depth = -(_CORNERS @ row[:3] + row[3])
+        if depth.min() <= near_far(projection)[0]:
+            self.visible, self.pending = True, False
+            self._draw_children(projection, view, model, color_shader, **param)
+            return
+
+        if self.conditional:
+            # the GPU waits for the box result, the CPU does not
+            drawer.draw(self.query, projection @ view, box_model)
+            drawer.conditional = True
+            GL.glBeginConditionalRender(self.query, GL.GL_QUERY_WAIT)
+            self._draw_children(projection, view, model, color_shader, **param)
+            GL.glEndConditionalRender()
+            drawer.conditional = False
+            self.stats['queries'] += 1
+            return
+
+        self._read_query()
+        self.frame += 1
+        # hidden nodes ask every frame, visible ones every interval frames,
+        # before drawing the children so they do not hide their own box
+        if not self.pending and (not self.visible or self.frame % self.interval == 0):
+            drawer.draw(self.query, projection @ view, box_model)
+            self.pending = True
+            self.stats['queries'] += 1
+        if self.visible:
+            self._draw_children(projection, view, model, color_shader, **param)
+        else:
+            self.stats['culled'] += 1
+
+    def _draw_children(self, projection, view, model, color_shader, **param):
+        self.stats['drawn'] += 1
+        super().draw(projection, view, model, color_shader, **param)
+
+    def __del__(self):
+        GL.glDeleteQueries(1, [self.query])
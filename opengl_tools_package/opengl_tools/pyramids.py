@@ -2,7 +2,7 @@
 """
 Pyramid as scene object
 """
-import OpenGL.GL as GL              # standard Python OpenGL wrapper
+from opengl_tools.gl import GL      # OpenGL functions, see opengl_tools.gl
 import numpy as np                  # all matrix manipulations & OpenGL args
 from opengl_tools.color_mesh import ColorMesh
 
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Dynamic resolution: the scene is drawn into an offscreen color and depth
+target scaled to keep its GPU time, measured with timer queries, within a
+frame budget, then upsampled to the window by a filtered blit
+"""
+import math
+import numpy as np
+from opengl_tools.gl import GL      # OpenGL functions, see opengl_tools.gl
+from opengl_tools.framebuffer import pool
+
+FRAME_BUDGET = 1000 / 60            # default GPU milliseconds per frame
+SCALE_RANGE = (0.5, 1.0)            # render size / window size, per axis
+SCALE_STEP = 0.05                   # scales are multiples of this, less reallocation
+HEADROOM = 0.8                      # scale up only below this part of the budget
+
+class GPUTimer:
+    """ Ring of GL_TIME_ELAPSED queries, their results read frames later
+        when available, never waiting for the GPU """
+
+    def __init__(self, size=4):
+        self.queries = [int(query) for query in GL.glGenQueries(size)]
+        self.pending = []               # issued queries, oldest first
+        self.running = None
+
+    def begin(self):
+        """ start timing, skipped if every query is still in flight """
+        free = [query for query in self.queries if query not in self.pending]
+        if free:
+            self.running = free[0]
+            GL.glBeginQuery(GL.GL_TIME_ELAPSED, self.running)
+
+    def end(self):
+        if self.running is not None:
+            GL.glEndQuery(GL.GL_TIME_ELAPSED)
+            self.pending.append(self.running)
+            self.running = None
+
+    def results(self):
+        """ milliseconds of the finished queries, oldest first """
+        times, result = [], np.zeros(1, np.uint32)   # nanoseconds, 4 s at most
+        while self.pending:
+            available = np.zeros(1, np.uint32)
+            GL.glGetQueryObjectuiv(self.pending[0], GL.GL_QUERY_RESULT_AVAILABLE, available)
+            if not available[0]:
+                break
+            GL.glGetQueryObjectuiv(self.pending.pop(0), GL.GL_QUERY_RESULT, result)
+            times.append(int(result[0]) / 1e6)
+        return times
+
+    def __del__(self):
+        GL.glDeleteQueries(len(self.queries), self.queries)
+
+class DynamicResolution:
+    """ Scales the render size between frames to hold the GPU time of the
+        scene pass under budget milliseconds. Draw between begin() and
+        end(), which replace binding the default framebuffer """
+
+    def __init__(self, budget=FRAME_BUDGET, scale_range=SCALE_RANGE):
+        self.budget, self.scale_range = budget, scale_range
+        self.scale = scale_range[1]
+        self.gpu_time = None            # smoothed milliseconds of the scene pass
+        self.settle = 0                 # results to skip, measured before a change
+        self.timer = GPUTimer()
+        self.target = None
+
+    def size(self, window_size):
+        """ render size for a window framebuffer size at the current scale """
+        return tuple(max(int(round(side * self.scale)), 1) for side in window_size)
+
+    def begin(self, window_size):
+        """ bind and clear an offscreen target at the scaled size, returned """
+        size = self.size(window_size)
+        self.target = pool.acquire(*size, colors=(GL.GL_RGBA8,),
+                                   depth=GL.GL_DEPTH_COMPONENT24, filtering=GL.GL_LINEAR)
+        self.target.bind()
+        GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
+        self.timer.begin()
+        return size
+
+    def end(self, window_size, target=0):
+        """ upsample into framebuffer target, the window by default, then
+            rescale from the GPU times available """
+        self.timer.end()
+        width, height = self.target.width, self.target.height
+        GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, self.target.glid)
+        GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, target)
+        GL.glBlitFramebuffer(0, 0, width, height, 0, 0, *window_size,
+                             GL.GL_COLOR_BUFFER_BIT, GL.GL_LINEAR)
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, target)
+        GL.glViewport(0, 0, *window_size)
+        pool.release(self.target)
+        self.target = None
+        for gpu_time in self.timer.results():
+            self._adjust(gpu_time)
+
+    def _adjust(self, gpu_time):
+        """ new scale from one more measure: GPU time goes with the pixel
+            count, so with the square of the scale """
+        if self.settle:
+            self.settle -= 1            # still at the previous scale
+            return
+        self.gpu_time = gpu_time if self.gpu_time is None else 0.8 * self.gpu_time + 0.2 * gpu_time
+        ratio = self.budget / max(self.gpu_time, 1e-3)
+        if 1 <= ratio <= 1 / HEADROOM:
+            return                      # within budget, not far below
+        # aim at HEADROOM of the budget, by limited steps
+        scale = self.scale * np.clip(np.sqrt(ratio * HEADROOM), 0.8, 1.1)
+        # rounded down: over budget always goes one step down at least
+        scale = np.clip(round(math.floor(scale / SCALE_STEP + 1e-6) * SCALE_STEP, 6), *self.scale_range)
+        if scale != self.scale:
+            self.scale, self.gpu_time = float(scale), None
+            self.settle = len(self.timer.pending)
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Binary scene files: a Node hierarchy with TRS transforms, its meshes,
+materials, textures and keyframe tracks in one file. A JSON table of
+contents is followed by 64 byte aligned array sections, memory-mapped on
+load so meshes are uploaded straight from the mapped pages
+"""
+import json
+import mmap
+import struct
+import numpy as np
+from opengl_tools.axis import Axis
+from opengl_tools.color_mesh import ColorMesh
+from opengl_tools.node import Node
+from opengl_tools import meshopt
+from opengl_tools.transform import translate, scale, quaternion_matrix, \
+    quaternion_from_matrix, quaternion_slerp
+from opengl_tools.vertex_array import packed
+
+SCENE_MAGIC = b'OGTSCENE'
+SCENE_VERSION = 1
+SECTION_ALIGN = 64                  # bytes, start of every array section
+TRACKS = ('translation', 'rotation', 'scale')
+BAKE_RATE = 60                      # samples per second of baked keyframe nodes
+
+def _align(offset):
+    return -(-offset // SECTION_ALIGN) * SECTION_ALIGN
+
+def decompose(matrix):
+    """ (translation, rotation quaternion (w, x, y, z), scale) of a 4x4
+        matrix, None if it does not recompose exactly (shear) """
+    matrix = np.asarray(matrix, np.float64)
+    factors = np.linalg.norm(matrix[:3, :3], axis=0)
+    if np.linalg.det(matrix[:3, :3]) < 0:
+        factors[0] *= -1            # mirrored
+    if not np.all(np.abs(factors) > 1e-12):
+        return None
+    rotation = quaternion_from_matrix(matrix[:3, :3] / factors)
+    trs = (matrix[:3, 3], rotation, factors)
+    return trs if np.allclose(compose(*trs), matrix, atol=1e-5) else None
+
+def compose(translation, rotation, factors):
+    """ 4x4 matrix of a translation, rotation quaternion and scale """
+    rotation = quaternion_matrix(np.asarray(rotation, np.float64))
+    return (translate(translation) @ rotation @ scale(factors)).astype('f')
+
+class TrackNode(Node):
+    """ Node animated by keyframe tracks: translation (n, 3), rotation
+        quaternions (n, 4) and scale (n,) or (n, 3), composed T.R.S, or
+        matrix (n, 4, 4) sampled transforms; each a (times, values) pair,
+        sampled in the simulation update """
+
+    def __init__(self, tracks, **param):
+        super().__init__(**param)
+        self.tracks = {name: (np.asarray(times, np.float32), np.asarray(values, np.float32))
+                       for name, (times, values) in tracks.items()}
+        self.time = None            # simulation time of the last update
+        Node.animations.add(self)   # on demand viewers draw while it plays
+
+    def end(self):
+        """ time of the last key of the tracks """
+        return max((times[-1] for times, _ in self.tracks.values() if len(times)), default=0)
+
+    def sample(self, time):
+        """ local transform at time, keys clamped at both ends """
+        values = {}
+        for name, (times, keys) in self.tracks.items():
+            if name == 'matrix':
+                return np.array([np.interp(time, times, column)
+                                 for column in keys.reshape(len(times), -1).T], 'f').reshape(4, 4)
+            if name == 'rotation' and len(times) > 1:
+                after = int(np.clip(np.searchsorted(times, time), 1, len(times) - 1))
+                span = max(times[after] - times[after - 1], 1e-9)
+                fraction = float(np.clip((time - times[after - 1]) / span, 0, 1))
+                values[name] = quaternion_slerp(keys[after - 1], keys[after], fraction)
+            elif name == 'rotation':
+                values[name] = keys[0]
+            else:
+                values[name] = np.array([np.interp(time, times, column)
+                                         for column in keys.reshape(len(times), -1).T])
+        scaling = values.get('scale', np.ones(3))
+        return compose(values.get('translation', np.zeros(3)),
+                       values.get('rotation', np.array((1, 0, 0, 0))),
+                       scaling if scaling.size == 3 else scaling[0])
+
+    def update(self, step, time, inputs):
+        self.time = time
+        return self.sample(time)
+
+    def animating(self):
+        return self.time is None or self.time <= self.end()
+
+# -------------- saving -------------------------------------------------------
+class _Writer:
+    """ JSON table of contents and array sections being gathered """
+
+    def __init__(self, optimize=True):
+        self.optimize = optimize
+        self.sections, self.size = [], 0
+        self.document = {'nodes': [], 'meshes': [], 'materials': [], 'textures': [], 'tracks': []}
+        self.indices = {}               # id() of saved objects => index
+        self.warned = set()
+
+    def array(self, data):
+        """ section reference of an array, appended at the next alignment """
+        data = packed(data)
+        offset = _align(self.size)
+        self.sections.append((offset, data))
+        self.size = offset + data.nbytes
+        return {'offset': offset, 'dtype': data.dtype.str, 'shape': list(data.shape)}
+
+    def warn(self, kind, message):
+        if kind not in self.warned:
+            self.warned.add(kind)
+            print('WARNING:', message)
+
+    def shared(self, kind, obj, make):
+        """ index of obj in the document list kind, added once by make() """
+        key = (kind, id(obj))
+        if key not in self.indices:
+            info = make(obj)
+            self.indices[key] = len(self.document[kind])
+            self.document[kind].append(info)
+        return self.indices[key]
+
+    def node(self, node):
+        if type(node) not in (Node, TrackNode) and not hasattr(node, 'keyframes'):
+            self.warn(type(node), '%s saved as a plain Node' % type(node).__name__)
+        info = {'name': node.name, 'static': bool(node.static), 'children': []}
+        trs = decompose(node.transform)
+        if trs is None:
+            info['matrix'] = np.asarray(node.transform, np.float32).ravel().tolist()
+        else:
+            info.update(zip(TRACKS, (value.tolist() for value in trs)))
+        param = {key: np.asarray(value).tolist() for key, value in node.param.items()
+                 if isinstance(value, (int, float, tuple, list, np.ndarray))}
+        if len(param) != len(node.param):
+            self.warn('param', 'non numeric node parameters are not saved')
+        if param:
+            info['param'] = param
+        track = self.track(node)
+        if track is not None:
+            info['track'] = len(self.document['tracks'])
+            self.document['tracks'].append(track)
+        index = len(self.document['nodes'])
+        self.document['nodes'].append(info)
+        children = node.frozen if node.frozen is not None else node.children
+        for child in children:
+            if isinstance(child, Axis):
+                continue                # every Node makes its own axes
+            if isinstance(child, Node):
+                info['children'].append(['node', self.node(child)])
+            elif hasattr(child, 'attributes') and hasattr(child, 'vertex_array'):
+                info['children'].append(['mesh', self.shared('meshes', child, self.mesh)])
+            else:
+                self.warn(type(child), '%s drawables are not saved' % type(child).__name__)
+        return index
+
+    def track(self, node):
+        """ keyframe tracks of a TrackNode or a KeyFrameControlNode """
+        if isinstance(node, TrackNode):
+            tracks = node.tracks
+        elif hasattr(node, 'keyframes'):
+            # composed by the node's own code (S.R.T in 5/main.py): baked
+            end = node.keyframes.end()
+            times = np.append(np.arange(0, end, 1 / BAKE_RATE), end)
+            tracks = {'matrix': (times, [node.keyframes.value(time) for time in times])}
+        else:
+            return None
+        return {name: {'times': self.array(np.asarray(times, np.float32)),
+                       'values': self.array(np.asarray(values, np.float32))}
+                for name, (times, values) in tracks.items()}
+
+    def mesh(self, mesh):
+        attributes = [None if data is None else packed(data) for data in mesh.attributes]
+        index = None if mesh.index is None else np.asarray(mesh.index)
+        if self.optimize and mesh.primitive == 4 and index is not None and attributes \
+                and attributes[0] is not None and index.size % 3 == 0:
+            attributes, index, _ = meshopt.optimize(attributes, index,
+                                                   name='mesh %d' % len(self.document['meshes']))
+        info = {'primitive': int(mesh.primitive),
+                'attributes': [None if data is None else self.array(data) for data in attributes],
+                'index': None if index is None else self.array(index.ravel()),
+                'uniforms': {key: np.asarray(value).tolist()
+                             for key, value in mesh.uniforms3fv.items()}}
+        material = getattr(mesh, 'material', None)
+        if material:
+            info['material'] = len(self.document['materials'])
+            self.document['materials'].append(material)
+        texture = getattr(mesh, 'texture', None)
+        if isinstance(texture, (str, np.ndarray)):
+            info['texture'] = self.shared('textures', texture, self.texture)
+        return info
+
+    def texture(self, texture):
+        """ pixels (height, width, channels) as is, image files as their
+            encoded bytes for the application to decode """
+        if isinstance(texture, str):
+            with open(texture, 'rb') as image:
+                encoded = np.frombuffer(image.read(), np.uint8)
+            return {'name': texture, 'encoded': True, 'data': self.array(encoded)}
+        return {'encoded': False, 'data': self.array(texture)}
+
+def save_scene(node, file, optimize=True):
+    """ write the hierarchy below node to file. Triangle meshes go through
+        opengl_tools.meshopt first unless optimize is False. Node
+        subclasses are saved as plain Nodes, keyframe animated ones as
+        TrackNodes playing their transform sampled BAKE_RATE times a
+        second """
+    writer = _Writer(optimize)
+    writer.node(node)
+    document = json.dumps(writer.document, separators=(',', ':')).encode()
+    header = struct.pack('<8sII', SCENE_MAGIC, SCENE_VERSION, len(document))
+    start = _align(len(header) + len(document))
+    with open(file, 'wb') as output:
+        output.write(header + document)
+        output.write(b'\0' * (start - len(header) - len(document)))
+        for offset, data in writer.sections:
+            output.seek(start + offset)
+            output.write(data.tobytes())
+        output.truncate(start + _align(writer.size))
+    print('Saved %s\t(%d nodes, %d meshes, %.1f MB)' % (
+        file, len(writer.document['nodes']), len(writer.document['meshes']),
+        (start + writer.size) / 2**20))
+
+# -------------- loading ------------------------------------------------------
+class SceneFile:
+    """ Table of contents and read only mapping of a scene file """
+
+    def __init__(self, file):
+        with open(file, 'rb') as handle:
+            self.map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, size = struct.unpack_from('<8sII', self.map, 0)
+        if magic != SCENE_MAGIC or version != SCENE_VERSION:
+            self.map.close()
+            raise ValueError('%s is not a version %d scene file' % (file, SCENE_VERSION))
+        header = struct.calcsize('<8sII')
+        self.document = json.loads(self.map[header:header + size])
+        self.start = _align(header + size)
+
+    def array(self, section):
+        """ zero-copy read only view of a section """
+        if section is None:
+            return None
+        dtype, shape = np.dtype(section['dtype']), tuple(section['shape'])
+        return np.ndarray(shape, dtype, self.map, self.start + section['offset'])
+
+def load_scene(file):
+    """ root Node of a scene file written by save_scene, None on error """
+    try:
+        scene = SceneFile(file)
+    except (OSError, ValueError) as error:
+        print('ERROR: unable to load', file, error)
+        return None
+    document = scene.document
+    textures = [scene.array(info['data']) for info in document['textures']]
+    meshes = []
+    for info in document['meshes']:
+        mesh = ColorMesh([scene.array(section) for section in info['attributes']],
+                         scene.array(info['index']), info['uniforms'], info['primitive'])
+        if 'material' in info:
+            mesh.material = document['materials'][info['material']]
+        if 'texture' in info:
+            mesh.texture = textures[info['texture']]
+        meshes.append(mesh)
+
+    nodes = []
+    for info in document['nodes']:
+        transform = np.array(info['matrix'], 'f').reshape(4, 4) if 'matrix' in info \
+            else compose(*(info[name] for name in TRACKS))
+        param = dict(name=info['name'], transform=transform, static=info['static'],
+                     **info.get('param', {}))
+        if 'track' in info:
+            tracks = {name: (scene.array(track['times']), scene.array(track['values']))
+                      for name, track in document['tracks'][info['track']].items()}
+            nodes.append(TrackNode(tracks, **param))
+        else:
+            nodes.append(Node(**param))
+    for node, info in zip(nodes, document['nodes']):
+        node.add(*((nodes if kind == 'node' else meshes)[index]
+                   for kind, index in info['children']))
+    root = nodes[0] if nodes else Node(name=file)
+    root.scene_file = scene     # keep the mapping alive with the scene
+    print('Loaded %s\t(%d nodes, %d meshes)' % (file, len(nodes), len(meshes)))
+    return root
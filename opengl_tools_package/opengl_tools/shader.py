@@ -3,15 +3,66 @@
 Low Level OpenGL Wrapper for Shader
 """
 
-import OpenGL.GL as GL              # standard Python OpenGL wrapper
+import hashlib                      # program binary cache keys
 import os                           # os function, i.e. checking file status
+import re
+import struct
+import time
+import numpy as np
+from OpenGL.error import GLError
+from opengl_tools.gl import GL      # OpenGL functions, see opengl_tools.gl
+from opengl_tools.frame_uniforms import bind_frame_block
+from opengl_tools.shaders_glsl import INCLUDES
+
+# program binaries from glGetProgramBinary are stored here, set the
+# environment variable to an empty string to disable the cache
+SHADER_CACHE = os.environ.get('OPENGL_TOOLS_SHADER_CACHE', os.path.join(
+    os.path.expanduser('~'), '.cache', 'opengl_tools', 'shaders'))
+
+_INCLUDE = re.compile(r'^[ \t]*#[ \t]*include[ \t]*(["<])([^">]+)[">].*$', re.M)
+_VERSION = re.compile(r'^[ \t]*#[ \t]*version[^\n]*\n?', re.M)
+
+def _expand(source, folder, included):
+    """ replace #include "file" (relative to folder first) and #include
+        <name> (from shaders_glsl.INCLUDES first) lines by their contents """
+    def include(match):
+        quote, name = match.groups()
+        path = os.path.join(folder, name)
+        if name in included:
+            return ''                      # already included once
+        included.add(name)
+        if (quote == '<' or not os.path.exists(path)) and name in INCLUDES:
+            return _expand(INCLUDES[name], folder, included)
+        if os.path.exists(path):
+            return _expand(open(path, 'r').read(), os.path.dirname(path), included)
+        raise ValueError('GLSL #include %s not found' % name)
+    return _INCLUDE.sub(include, source)
+
+def preprocess(source, defines=(), folder='.'):
+    """ GLSL source with #include lines expanded, a single #version line on
+        top followed by one #define per entry of defines (names, or
+        (name, value) pairs) """
+    source = _expand(source, folder, set())
+    versions = _VERSION.findall(source)
+    source = _VERSION.sub('', source)
+    lines = [versions[0].strip()] if versions else []
+    for define in defines:
+        name, value = (define, '') if isinstance(define, str) else define
+        lines.append(('#define %s %s' % (name, value)).strip())
+    return '\n'.join(lines + [source])
 
 class Shader:
     """ Helper class to create and automatically destroy shader program """
     @staticmethod
-    def _compile_shader(src, shader_type):
+    def _read_source(src, defines=()):
+        folder = os.path.dirname(src) if os.path.exists(src) else '.'
         src = open(src, 'r').read() if os.path.exists(src) else src
         src = src.decode('ascii') if isinstance(src, bytes) else src
+        return preprocess(src, defines, folder)
+
+    @staticmethod
+    def _compile_shader(src, shader_type):
+        src = Shader._read_source(src)
         shader = GL.glCreateShader(shader_type)
         GL.glShaderSource(shader, src)
         GL.glCompileShader(shader)
@@ -25,25 +76,123 @@ class Shader:
             return None
         return shader
 
-    def __init__(self, vertex_source, fragment_source):
-        """ Shader can be initialized with raw strings or source file names """
+    def __init__(self, vertex_source, fragment_source, defines=()):
+        """ Shader can be initialized with raw strings or source file names,
+            defines are added after #version in both stages """
         self.glid = None
-        vert = self._compile_shader(vertex_source, GL.GL_VERTEX_SHADER)
-        frag = self._compile_shader(fragment_source, GL.GL_FRAGMENT_SHADER)
-        if vert and frag:
+        start = time.perf_counter()
+        vertex_source = self._read_source(vertex_source, defines)
+        fragment_source = self._read_source(fragment_source, defines)
+        cache = self._cache_file(vertex_source, fragment_source)
+        self.glid = self._load_binary(cache)
+        self.from_cache = self.glid is not None
+        if not self.from_cache:
+            self._build(((vertex_source, GL.GL_VERTEX_SHADER),
+                         (fragment_source, GL.GL_FRAGMENT_SHADER)), cache)
+        self.startup_time = time.perf_counter() - start
+        if self.glid:
+            bind_frame_block(self.glid)
+            print('Shader %s in %.1f ms' % ('loaded from binary cache' if self.from_cache
+                                             else 'compiled', 1000 * self.startup_time))
+
+    def _build(self, stages, cache=None):
+        """ compile and link (source, shader type) stages, storing the
+            binary in cache """
+        shaders = [self._compile_shader(source, shader_type) for source, shader_type in stages]
+        if all(shaders):
             self.glid = GL.glCreateProgram()  # pylint: disable=E1111
-            GL.glAttachShader(self.glid, vert)
-            GL.glAttachShader(self.glid, frag)
+            if cache:
+                GL.glProgramParameteri(self.glid, GL.GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL.GL_TRUE)
+            for shader in shaders:
+                GL.glAttachShader(self.glid, shader)
             GL.glLinkProgram(self.glid)
-            GL.glDeleteShader(vert)
-            GL.glDeleteShader(frag)
+            for shader in shaders:
+                GL.glDeleteShader(shader)
             status = GL.glGetProgramiv(self.glid, GL.GL_LINK_STATUS)
             if not status:
                 print(GL.glGetProgramInfoLog(self.glid).decode('ascii'))
                 GL.glDeleteProgram(self.glid)
                 self.glid = None
+            elif cache:
+                self._save_binary(cache)
+
+    # -------------- program binary cache -------------------------------------
+    @staticmethod
+    def _cache_file(*sources):
+        """ cache file for these sources on this driver, None if no cache """
+        if not SHADER_CACHE or not bool(GL.glProgramBinary) or \
+                not GL.glGetIntegerv(GL.GL_NUM_PROGRAM_BINARY_FORMATS):
+            return None
+        key = hashlib.sha256()
+        for name in (GL.GL_VENDOR, GL.GL_RENDERER, GL.GL_VERSION):
+            key.update(GL.glGetString(name) or b'')
+        for source in sources:
+            key.update(b'\0' + source.encode())
+        return os.path.join(SHADER_CACHE, key.hexdigest() + '.bin')
+
+    def _load_binary(self, cache):
+        """ program created from a cached binary, None if missing or rejected """
+        if not cache or not os.path.exists(cache):
+            return None
+        with open(cache, 'rb') as binary:
+            data = binary.read()
+        program = GL.glCreateProgram()  # pylint: disable=E1111
+        try:
+            if len(data) >= 4:          # else empty or cut short by a crash
+                binary_format, = struct.unpack_from('<I', data)
+                GL.glProgramBinary(program, binary_format, data[4:], len(data) - 4)
+                if GL.glGetProgramiv(program, GL.GL_LINK_STATUS):
+                    return program
+        except (struct.error, GLError):
+            pass                        # truncated or unknown binary format
+        # driver update or other change: recompile from sources
+        GL.glDeleteProgram(program)
+        try:
+            os.remove(cache)
+        except OSError:
+            pass                        # removed meanwhile, or read only cache
+        return None
+
+    def _save_binary(self, cache):
+        """ store glGetProgramBinary output as format + binary bytes """
+        length = GL.glGetProgramiv(self.glid, GL.GL_PROGRAM_BINARY_LENGTH)
+        if not length:
+            return
+        written = np.zeros(1, np.int32)
+        binary_format = np.zeros(1, np.uint32)
+        data = np.empty(length, np.uint8)
+        GL.glGetProgramBinary(self.glid, length, written, binary_format, data)
+        try:
+            os.makedirs(SHADER_CACHE, exist_ok=True)
+            with open(cache, 'wb') as binary:
+                binary.write(struct.pack('<I', int(binary_format[0])))
+                binary.write(data[:int(written[0])].tobytes())
+        except OSError as error:
+            print('WARNING: unable to write shader cache', cache, error)
 
     def __del__(self):
         GL.glUseProgram(0)
         if self.glid:                      # if this is a valid shader object
             GL.glDeleteProgram(self.glid)  # object dies => destroy GL object
+
+class ComputeShader(Shader):
+    """ Compute program, with the same includes, defines and binary cache """
+
+    def __init__(self, compute_source, defines=()):  # pylint: disable=W0231
+        self.glid = None
+        start = time.perf_counter()
+        compute_source = self._read_source(compute_source, defines)
+        cache = self._cache_file(compute_source)
+        self.glid = self._load_binary(cache)
+        self.from_cache = self.glid is not None
+        if not self.from_cache:
+            self._build(((compute_source, GL.GL_COMPUTE_SHADER),), cache)
+        self.startup_time = time.perf_counter() - start
+        if self.glid:
+            print('Compute shader %s in %.1f ms' % ('loaded from binary cache' if self.from_cache
+                                                     else 'compiled', 1000 * self.startup_time))
+
+    def dispatch(self, groups_x, groups_y=1, groups_z=1):
+        """ run groups_x * groups_y * groups_z work groups """
+        GL.glUseProgram(self.glid)
+        GL.glDispatchCompute(groups_x, groups_y, groups_z)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Shared shader programs: one GL program per (sources, defines) permutation
+"""
+from opengl_tools.shader import Shader, ComputeShader
+
+# feature flags understood by shaders_glsl.MESH_VERT / MESH_FRAG
+FEATURES = ('LIT', 'VERTEX_COLOR', 'TEXTURED', 'SKINNED', 'INSTANCED')
+
+class ShaderRegistry:
+    """ Hands out the same Shader for the same preprocessed sources, so
+        drawables never compile a program of their own """
+
+    def __init__(self):
+        self.shaders = {}
+
+    def get(self, vertex_source, fragment_source, defines=()):
+        """ shared Shader for these sources (strings or file names) once
+            #include are expanded and defines (names or (name, value)) added """
+        defines = tuple(sorted(defines, key=str))
+        vertex = Shader._read_source(vertex_source, defines)
+        fragment = Shader._read_source(fragment_source, defines)
+        key = (vertex, fragment)
+        if key not in self.shaders:
+            self.shaders[key] = Shader(vertex, fragment)
+        return self.shaders[key]
+
+    def get_compute(self, compute_source, defines=()):
+        """ shared ComputeShader, as get() for vertex and fragment shaders """
+        defines = tuple(sorted(defines, key=str))
+        compute = Shader._read_source(compute_source, defines)
+        key = (compute,)
+        if key not in self.shaders:
+            self.shaders[key] = ComputeShader(compute)
+        return self.shaders[key]
+
+    def clear(self):
+        """ release every program, to call before the GL context goes away """
+        self.shaders.clear()
+
+# default registry of the process, GL programs live in the current context
+registry = ShaderRegistry()
+
+def get_shader(vertex_source, fragment_source, defines=()):
+    """ shared Shader from the default registry """
+    return registry.get(vertex_source, fragment_source, defines)
+
+def get_compute_shader(compute_source, defines=()):
+    """ shared ComputeShader from the default registry """
+    return registry.get_compute(compute_source, defines)
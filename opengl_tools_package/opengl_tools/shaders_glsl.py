@@ -3,9 +3,107 @@
 GLSL Vertex and Fragment Shaders
 """
 
+# Per frame data written once per frame by Viewer.run (see FrameUniforms),
+# matrices are row major like the numpy ones. Array sizes must match
+# frame_uniforms.MAX_LIGHTS. Lights are homogeneous: light_positions.w is 0
+# for a directional light (xyz towards the light) and 1 for a point light,
+# whose radius of influence is light_colors.a
+FRAME_BLOCK = """
+layout(std140, row_major) uniform Frame {
+    mat4 view;
+    mat4 projection;
+    mat4 view_projection;
+    vec4 camera_position;
+    vec4 light_positions[8];
+    vec4 light_colors[8];
+    int light_count;
+    float time;
+    vec4 viewport;          // width, height, near, far
+    mat4 shadow_matrix;     // light view projection of the shadow map
+};
+"""
+
+# Lambert diffuse term summed over the lights of the Frame block. Defining
+# LIGHT_COUNT gives the loop a constant bound, much faster on drivers that
+# do not handle loops on uniforms well (e.g. llvmpipe), unused lights are
+# black so it may be larger than the number of lights in the frame.
+# Defining CLUSTERED adds the point lights of the fragment's cluster (see
+# clustered.ClusteredLights), CLUSTER_X/Y/Z must match its grid. Defining
+# SHADOWS darkens the first Frame light with the shadow map (see
+# shadows.ShadowMap)
+LIGHTS = """
+#include <frame.glsl>
+#ifndef LIGHT_COUNT
+#define LIGHT_COUNT light_count
+#endif
+#ifdef CLUSTERED
+#ifndef CLUSTER_X
+#define CLUSTER_X 16
+#define CLUSTER_Y 9
+#define CLUSTER_Z 24
+#endif
+uniform samplerBuffer cluster_lights;       // position radius, color per light
+uniform usamplerBuffer cluster_grid;        // offset, count per cluster
+uniform usamplerBuffer cluster_indices;     // light ids of every cluster
+#endif
+#ifdef SHADOWS
+#ifndef SHADOW_BIAS
+#define SHADOW_BIAS 0.001
+#endif
+uniform sampler2DShadow shadow_map;
+
+// fraction of light reaching position, 2x2 filtered by the depth compare
+float shadow(vec3 position) {
+    vec4 coord = shadow_matrix * vec4(position, 1);
+    coord.xyz = coord.xyz / coord.w * 0.5 + 0.5;
+    if (coord.w <= 0 || any(greaterThan(abs(coord.xyz - 0.5), vec3(0.5))))
+        return 1.0;                             // outside of the map
+    return texture(shadow_map, vec3(coord.xy, coord.z - SHADOW_BIAS));
+}
+#endif
+
+vec3 lambert_light(vec4 light, vec4 color, vec3 normal, vec3 position) {
+    vec3 to_light = light.xyz - light.w * position;
+    float attenuation = 1;
+    if (light.w > 0) {
+        attenuation = clamp(1 - length(to_light) / color.a, 0, 1);
+        attenuation *= attenuation;
+    }
+    return attenuation * color.rgb * max(dot(normal, normalize(to_light)), 0);
+}
+
+vec3 lambert(vec3 normal, vec3 position) {
+    vec3 diffuse = vec3(0);
+    normal = normalize(normal);
+    for (int i = 0; i < LIGHT_COUNT; i++) {
+        vec3 light = lambert_light(light_positions[i], light_colors[i], normal, position);
+#ifdef SHADOWS
+        if (i == 0)
+            light *= shadow(position);
+#endif
+        diffuse += light;
+    }
+#ifdef CLUSTERED
+    // screen tile and exponential depth slice of this fragment
+    float depth = -(view * vec4(position, 1)).z;
+    vec3 cell = vec3(gl_FragCoord.xy / viewport.xy * vec2(CLUSTER_X, CLUSTER_Y),
+                     log(depth / viewport.z) / log(viewport.w / viewport.z) * CLUSTER_Z);
+    ivec3 grid = ivec3(CLUSTER_X, CLUSTER_Y, CLUSTER_Z);
+    ivec3 cluster = clamp(ivec3(cell), ivec3(0), grid - 1);
+    uvec2 range = texelFetch(cluster_grid, (cluster.z * grid.y + cluster.y) * grid.x + cluster.x).xy;
+    for (uint i = range.x; i < range.x + range.y; i++) {
+        int light = int(texelFetch(cluster_indices, int(i)).r);
+        vec4 light_position = texelFetch(cluster_lights, 2 * light);
+        vec4 color = vec4(texelFetch(cluster_lights, 2 * light + 1).rgb, light_position.w);
+        diffuse += lambert_light(vec4(light_position.xyz, 1), color, normal, position);
+    }
+#endif
+    return diffuse;
+}
+"""
+
 COLOR_VERT = """#version 330 core
-uniform mat4 projection;
-uniform mat4 view;
+#include <frame.glsl>
 uniform mat4 model;
 
 layout(location = 0) in vec3 position_in;
@@ -14,7 +112,7 @@ layout(location = 1) in vec3 colors_in;
 out vec3 position_out;
 out vec3 colors_out;
 void main() {
-    gl_Position = projection * view * model * vec4(position_in, 1);
+    gl_Position = view_projection * model * vec4(position_in, 1);
     position_out = position_in;
     colors_out = colors_in;
 }"""
@@ -38,37 +136,275 @@ void main() {
 }"""
 
 LAMBERT_VERT = """#version 330 core
-uniform mat4 projection;
-uniform mat4 view;
+#include <frame.glsl>
 uniform mat4 model;
+uniform mat3 normal_matrix;
 uniform vec3 color;
-uniform vec3 light;
 
 layout(location = 0) in vec3 position_in;
 layout(location = 1) in vec3 normals_in;
 
-out vec3 position_out;
 out vec3 colors_out;
 out vec3 normals;
-out vec3 light_out;
-out mat3 model_out;
+out vec3 world_position;
 void main() {
-    model_out = mat3(model);
-    gl_Position = projection * view * model * vec4(position_in, 1);
+    vec4 world = model * vec4(position_in, 1);
+    gl_Position = view_projection * world;
+    world_position = world.xyz;
     colors_out = color;
-    normals = normals_in;
-    light_out = light;
+    normals = normal_matrix * normals_in;
 }"""
 
+# with DEFERRED defined, albedo and normal go to the G-buffer instead
+# (see deferred.DeferredRenderer)
 LAMBERT_FRAG = """#version 330 core
-uniform vec3 color;
+#include <lights.glsl>
+in vec3 colors_out;
+in vec3 normals;
+in vec3 world_position;
+#ifdef DEFERRED
+layout(location = 0) out vec4 outColor;
+layout(location = 1) out vec4 outNormal;
+#else
 out vec4 outColor;
+#endif
+void main() {
+#ifdef DEFERRED
+    outColor = vec4(colors_out, 1);
+    outNormal = vec4(normalize(normals), 1);
+#else
+    outColor = vec4(colors_out * lambert(normals, world_position), 1);
+#endif
+}"""
+
+# Shared mesh shader, features picked with #define (see ShaderRegistry):
+# LIT (lambert, normals at location 1), VERTEX_COLOR (colors at location 1),
+# TEXTURED (tex coords at location 2), SKINNED (bone ids / weights at
+# locations 3 and 4), INSTANCED (per instance model matrix at locations 5-8)
+MESH_VERT = """#version 330 core
+#include <frame.glsl>
+#ifndef INSTANCED
+uniform mat4 model;
+uniform mat3 normal_matrix;
+#endif
+uniform vec3 color;
+
+layout(location = 0) in vec3 position_in;
+#if defined(LIT)
+layout(location = 1) in vec3 normals_in;
+out vec3 normals;
+out vec3 world_position;
+#elif defined(VERTEX_COLOR)
+layout(location = 1) in vec3 colors_in;
+#endif
+#ifdef TEXTURED
+layout(location = 2) in vec2 tex_coord_in;
+out vec2 frag_tex_coord;
+#endif
+#ifdef SKINNED
+#ifndef MAX_BONES
+#define MAX_BONES 64
+#endif
+uniform mat4 bones[MAX_BONES];
+layout(location = 3) in vec4 bone_ids;
+layout(location = 4) in vec4 bone_weights;
+#endif
+#ifdef INSTANCED
+layout(location = 5) in mat4 model;
+#endif
+
+out vec3 colors_out;
+void main() {
+    mat4 skin = mat4(1);
+#ifdef SKINNED
+    skin = bone_weights.x * bones[int(bone_ids.x)] + bone_weights.y * bones[int(bone_ids.y)]
+         + bone_weights.z * bones[int(bone_ids.z)] + bone_weights.w * bones[int(bone_ids.w)];
+#endif
+    vec4 world = model * skin * vec4(position_in, 1);
+    gl_Position = view_projection * world;
+#ifdef VERTEX_COLOR
+    colors_out = colors_in;
+#else
+    colors_out = color;
+#endif
+#if defined(LIT) && (defined(SKINNED) || defined(INSTANCED))
+    normals = transpose(inverse(mat3(model * skin))) * normals_in;
+    world_position = world.xyz;
+#elif defined(LIT)
+    normals = normal_matrix * normals_in;     // once per object, on the CPU
+    world_position = world.xyz;
+#endif
+#ifdef TEXTURED
+    frag_tex_coord = tex_coord_in;
+#endif
+}"""
+
+MESH_FRAG = """#version 330 core
+#include <lights.glsl>
+uniform sampler2D diffuseMap;
 in vec3 colors_out;
+#ifdef LIT
 in vec3 normals;
-in vec3 light_out;
-in mat3 model_out;
+in vec3 world_position;
+#endif
+#ifdef TEXTURED
+in vec2 frag_tex_coord;
+#endif
+#ifdef DEFERRED
+layout(location = 0) out vec4 outColor;
+layout(location = 1) out vec4 outNormal;
+#else
+out vec4 outColor;
+#endif
+void main() {
+    vec4 albedo = vec4(colors_out, 1);
+#ifdef TEXTURED
+    albedo = texture(diffuseMap, frag_tex_coord);
+#endif
+#if defined(DEFERRED) && defined(LIT)
+    outNormal = vec4(normalize(normals), 1);
+#elif defined(DEFERRED)
+    outNormal = vec4(0);                        // unlit
+#elif defined(LIT)
+    albedo.rgb *= lambert(normals, world_position);
+#endif
+    outColor = albedo;
+}"""
+
+# Deferred lighting pass: one screen covering triangle shading every pixel
+# of the G-buffer once with lights.glsl, position rebuilt from the depth,
+# which is written to the target whatever its depth format
+DEFERRED_VERT = """#version 330 core
 void main() {
-    mat3 model_out_transformed = transpose(inverse(model_out));
-    vec3 new_normals = model_out_transformed*normals;
-    outColor = vec4(colors_out, 1)*max(dot(vec4(new_normals, 1), vec4(light_out, 1)), 0);
+    gl_Position = vec4(vec2(gl_VertexID & 1, gl_VertexID >> 1) * 4 - 1, 0, 1);
 }"""
+
+DEFERRED_FRAG = """#version 330 core
+#include <lights.glsl>
+uniform sampler2D albedo_map;
+uniform sampler2D normal_map;
+uniform sampler2D depth_map;
+uniform mat4 inverse_view_projection;
+out vec4 outColor;
+void main() {
+    ivec2 pixel = ivec2(gl_FragCoord.xy);
+    float depth = texelFetch(depth_map, pixel, 0).r;
+    if (depth == 1)
+        discard;                                // background
+    gl_FragDepth = depth;                       // for later forward drawing
+    vec4 albedo = texelFetch(albedo_map, pixel, 0);
+    vec3 normal = texelFetch(normal_map, pixel, 0).xyz;
+    if (dot(normal, normal) == 0) {             // unlit geometry
+        outColor = albedo;
+        return;
+    }
+    vec4 position = inverse_view_projection * vec4(vec3(gl_FragCoord.xy / viewport.xy, depth) * 2 - 1, 1);
+    outColor = vec4(albedo.rgb * lambert(normal, position.xyz / position.w), albedo.a);
+}"""
+
+# Depth only pass of the shadow maps
+SHADOW_VERT = """#version 330 core
+uniform mat4 light_view_projection;
+uniform mat4 model;
+layout(location = 0) in vec3 position_in;
+void main() {
+    gl_Position = light_view_projection * model * vec4(position_in, 1);
+}"""
+
+SHADOW_FRAG = """#version 330 core
+void main() {
+}"""
+
+# GeometryPool objects: model, normal matrix, color and local bounding
+# sphere of every object in a storage buffer. The vertex shader finds its
+# object with the per instance object_id attribute which the draw command's
+# baseInstance sets (gl_DrawID needs GL 4.6)
+POOL_OBJECTS = """
+struct PoolObject {
+    mat4 model;
+    mat4 normal_matrix;
+    vec4 color;
+    vec4 sphere;
+};
+layout(std430, row_major, binding = 1) readonly buffer PoolObjects {
+    PoolObject objects[];
+};"""
+
+POOL_VERT = """#version 430 core
+#include <frame.glsl>
+#include <pool.glsl>
+uniform mat4 model;
+uniform mat3 normal_matrix;
+
+layout(location = 0) in vec3 position_in;
+layout(location = 1) in vec3 normals_in;
+layout(location = 3) in uint object_id;
+
+out vec3 colors_out;
+out vec3 normals;
+out vec3 world_position;
+void main() {
+    PoolObject object = objects[object_id];
+    vec4 world = model * object.model * vec4(position_in, 1);
+    gl_Position = view_projection * world;
+    world_position = world.xyz;
+    colors_out = object.color.rgb;
+    normals = normal_matrix * mat3(object.normal_matrix) * normals_in;
+}"""
+
+# GeometryPool objects in a shadow map, as SHADOW_VERT
+POOL_SHADOW_VERT = """#version 430 core
+#include <pool.glsl>
+uniform mat4 light_view_projection;
+uniform mat4 model;
+layout(location = 0) in vec3 position_in;
+layout(location = 3) in uint object_id;
+void main() {
+    gl_Position = light_view_projection * model * objects[object_id].model * vec4(position_in, 1);
+}"""
+
+# GPU frustum culling of the GeometryPool: one invocation per object, the
+# draw commands of objects whose sphere touches the frustum are appended
+# to the 'visible' commands, the others left as cleared empty draws
+POOL_CULL = """#version 430 core
+#include <pool.glsl>
+layout(local_size_x = 64) in;
+struct Command {
+    uint count;
+    uint instance_count;
+    uint first_index;
+    uint base_vertex;
+    uint base_instance;
+};
+layout(std430, binding = 2) readonly buffer Commands {
+    Command commands[];
+};
+layout(std430, binding = 3) writeonly buffer Visible {
+    Command visible[];
+};
+layout(std430, binding = 4) buffer Counter {
+    uint visible_count;
+};
+uniform uint object_count;
+uniform vec4 planes[6];     // frustum planes in pool space, normalized
+
+void main() {
+    uint id = gl_GlobalInvocationID.x;
+    if (id >= object_count || commands[id].count == 0u)
+        return;
+    mat4 model = objects[id].model;
+    vec3 center = (model * vec4(objects[id].sphere.xyz, 1)).xyz;
+    float scale = max(max(length(model[0].xyz), length(model[1].xyz)), length(model[2].xyz));
+    float radius = objects[id].sphere.w * scale;
+    for (int plane = 0; plane < 6; plane++)
+        if (dot(planes[plane].xyz, center) + planes[plane].w < -radius)
+            return;
+    visible[atomicAdd(visible_count, 1u)] = commands[id];
+}"""
+
+# sources reachable with #include <name> from any shader, the files in
+# shaders/ include these instead of holding their own copy
+INCLUDES = {'frame.glsl': FRAME_BLOCK, 'lights.glsl': LIGHTS,
+            'lambert_vert.glsl': LAMBERT_VERT, 'lambert_frag.glsl': LAMBERT_FRAG,
+            'mesh_vert.glsl': MESH_VERT, 'mesh_frag.glsl': MESH_FRAG,
+            'pool.glsl': POOL_OBJECTS}
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Shadow maps for the first Frame light: depth only passes re-rendered when
+the light or the world transform of a caster changes, the casters below
+static Nodes cached in their own map
+"""
+from functools import reduce
+import numpy as np
+from opengl_tools.gl import GL      # OpenGL functions, see opengl_tools.gl
+from opengl_tools.framebuffer import Framebuffer
+from opengl_tools.frame_uniforms import FRAME_SAMPLERS
+from opengl_tools.shader_registry import get_shader
+from opengl_tools.shaders_glsl import SHADOW_VERT, SHADOW_FRAG
+from opengl_tools.transform import identity, lookat, ortho, perspective, normalized, vec
+
+SHADOW_RESOLUTION = 2048            # default shadow map width and height
+SHADOW_UNIT = FRAME_SAMPLERS['shadow_map']
+
+def _up(direction):
+    """ up vector not parallel to direction """
+    return vec(1, 0, 0) if abs(direction[1]) > 0.99 else vec(0, 1, 0)
+
+def directional_matrices(direction, center=(0, 0, 0), radius=10):
+    """ (view, projection) of a directional light coming from direction,
+        covering the sphere (center, radius) """
+    direction, center = normalized(vec(direction)[:3]), vec(center)
+    view = lookat(center + 2 * radius * direction, center, _up(direction))
+    return view, ortho(-radius, radius, -radius, radius, radius, 3 * radius)
+
+def spot_matrices(position, direction, angle=60, near=0.1, far=50):
+    """ (view, projection) of a spot light of cone angle in degrees """
+    position, direction = vec(position)[:3], normalized(vec(direction)[:3])
+    view = lookat(position, position + direction, _up(direction))
+    return view, perspective(angle, 1, near, far)
+
+def casters(drawables):
+    """ (static, dynamic) lists of (mesh, node path) of every triangle
+        mesh below drawables, split on the static flag of their Nodes.
+        Geometry pools, drawn by their draw_depth(), are static """
+    stack, static, dynamic = [(drawable, (), False) for drawable in drawables], [], []
+    while stack:
+        drawable, path, frozen = stack.pop()
+        if hasattr(drawable, 'children'):
+            path, frozen = path + (drawable,), frozen or getattr(drawable, 'static', False)
+            stack.extend((child, path, frozen) for child in drawable.children)
+        elif getattr(drawable, 'primitive', None) == GL.GL_TRIANGLES and \
+                hasattr(drawable, 'vertex_array'):
+            (static if frozen else dynamic).append((drawable, path))
+        elif hasattr(drawable, 'draw_depth'):
+            static.append((drawable, path))
+    return static, dynamic
+
+def _signature(group):
+    """ changes whenever a mesh is added or removed, or a node on the way
+        to one of them changes transform (see Node.version), or the objects
+        of a geometry pool change """
+    return tuple((id(mesh), getattr(mesh, 'version', 0)) +
+                 tuple((id(node), node.version) for node in path)
+                 for mesh, path in group)
+
+class ShadowMap:
+    """ Depth map of the casters seen from a light. The static casters are
+        rendered once in their own map, copied under the dynamic ones """
+
+    def __init__(self, resolution=SHADOW_RESOLUTION):
+        self.resolution = resolution
+        self.static_map = Framebuffer(resolution, resolution, colors=(), filtering=GL.GL_LINEAR)
+        self.map = Framebuffer(resolution, resolution, colors=(), filtering=GL.GL_LINEAR)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self.map.depth)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_COMPARE_MODE,
+                           GL.GL_COMPARE_REF_TO_TEXTURE)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+        self.shader = get_shader(SHADOW_VERT, SHADOW_FRAG)
+        self.view, self.projection = identity(), identity()
+        self.static_key, self.dynamic_key = None, None
+        self.renders = {'static': 0, 'dynamic': 0}   # passes actually drawn
+
+    @property
+    def matrix(self):
+        """ light view projection, for the Frame block shadow_matrix """
+        return self.projection @ self.view
+
+    def set_light(self, view, projection):
+        """ new light matrices, redrawn on next update only if different """
+        self.view, self.projection = view, projection
+
+    def update(self, drawables):
+        """ re-render what changed since the last update, then bind the map
+            to SHADOW_UNIT. Leaves the default framebuffer bound, caller
+            restores its viewport """
+        static, dynamic = casters(drawables)
+        light = self.matrix.tobytes()
+        static_key = (light, _signature(static))
+        dynamic_key = (static_key, _signature(dynamic))
+        if static_key != self.static_key:
+            self._render(self.static_map, static)
+            self.static_key = static_key
+            self.renders['static'] += 1
+        if dynamic_key != self.dynamic_key:
+            # dynamic casters drawn over a copy of the static map
+            size = self.resolution
+            GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, self.static_map.glid)
+            GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, self.map.glid)
+            GL.glBlitFramebuffer(0, 0, size, size, 0, 0, size, size,
+                                 GL.GL_DEPTH_BUFFER_BIT, GL.GL_NEAREST)
+            self._render(self.map, dynamic, clear=False)
+            self.dynamic_key = dynamic_key
+            self.renders['dynamic'] += 1
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, 0)
+        GL.glActiveTexture(GL.GL_TEXTURE0 + SHADOW_UNIT)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self.map.depth)
+        GL.glActiveTexture(GL.GL_TEXTURE0)
+
+    def _render(self, framebuffer, group, clear=True):
+        """ depth only pass of a caster group into framebuffer """
+        framebuffer.bind()
+        if clear:
+            GL.glClear(GL.GL_DEPTH_BUFFER_BIT)
+        GL.glUseProgram(self.shader.glid)
+        location = GL.glGetUniformLocation(self.shader.glid, 'light_view_projection')
+        GL.glUniformMatrix4fv(location, 1, True, self.matrix)
+        model_location = GL.glGetUniformLocation(self.shader.glid, 'model')
+        GL.glEnable(GL.GL_POLYGON_OFFSET_FILL)     # against shadow acne
+        GL.glPolygonOffset(2, 4)
+        for mesh, path in group:
+            model = reduce(np.matmul, (node.transform for node in path), identity())
+            if hasattr(mesh, 'draw_depth'):
+                mesh.draw_depth(self.matrix, model)
+                GL.glUseProgram(self.shader.glid)
+                continue
+            GL.glUniformMatrix4fv(model_location, 1, True, model)
+            mesh.vertex_array.draw(mesh.primitive, *mesh.index_range)
+        GL.glDisable(GL.GL_POLYGON_OFFSET_FILL)
+        GL.glUseProgram(0)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Quadric error metric mesh simplification (Garland & Heckbert 1997)
+Half-edge collapses only: every level is an index buffer on the original
+vertices, so a whole LOD chain shares one vertex buffer
+"""
+import heapq
+import numpy as np
+
+BOUNDARY_WEIGHT = 100.0             # keeps open borders (cylinder caps) in place
+LOD_RATIOS = (1.0, 0.5, 0.25, 0.125)
+
+def _planes(positions, faces):
+    """ unit plane (a, b, c, d) and area of every triangle """
+    triangles = positions[faces]
+    normals = np.cross(triangles[:, 1] - triangles[:, 0],
+                       triangles[:, 2] - triangles[:, 0])
+    doubled = np.linalg.norm(normals, axis=1)
+    normals /= np.where(doubled > 0, doubled, 1)[:, None]
+    distances = -(normals * triangles[:, 0]).sum(axis=1)
+    return np.hstack((normals, distances[:, None])), doubled / 2
+
+def _quadrics(positions, faces, vertices=None):
+    """ area weighted sum of face plane quadrics on each vertex, plus
+        perpendicular constraint planes along boundary edges, and along
+        seams: edges whose faces use different vertices (vertices being the
+        original vertex of each corner of faces) """
+    planes, areas = _planes(positions, faces)
+    face_quadrics = planes[:, :, None] * planes[:, None, :] * areas[:, None, None]
+    quadrics = np.zeros((len(positions), 4, 4))
+    for corner in range(3):
+        np.add.at(quadrics, faces[:, corner], face_quadrics)
+
+    edges = np.vstack((faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]))
+    _, inverse, counts = np.unique(np.sort(edges, axis=1), axis=0,
+                                   return_inverse=True, return_counts=True)
+    border = counts[inverse.ravel()] == 1
+    if vertices is not None:
+        # seam: an edge seen with more than one pair of original vertices
+        sides = np.vstack((vertices[:, [0, 1]], vertices[:, [1, 2]], vertices[:, [2, 0]]))
+        pairs = np.unique(np.column_stack((inverse.ravel(), np.sort(sides, axis=1))), axis=0)
+        border |= np.bincount(pairs[:, 0], minlength=len(counts))[inverse.ravel()] > 1
+    start, end = edges[border, 0], edges[border, 1]
+    direction = positions[end] - positions[start]
+    normals = np.cross(direction, planes[np.flatnonzero(border) % len(faces), :3])
+    length = np.linalg.norm(normals, axis=1)
+    normals /= np.where(length > 0, length, 1)[:, None]
+    border_planes = np.hstack((normals, -(normals * positions[start]).sum(axis=1)[:, None]))
+    weights = BOUNDARY_WEIGHT * (direction * direction).sum(axis=1)
+    border_quadrics = (border_planes[:, :, None] * border_planes[:, None, :]
+                       * weights[:, None, None])
+    np.add.at(quadrics, start, border_quadrics)
+    np.add.at(quadrics, end, border_quadrics)
+    return quadrics
+
+def simplify(vertices, faces, ratios=LOD_RATIOS):
+    """ list of index buffers with about ratio * len(faces) triangles each,
+        ratios in decreasing order, 1.0 giving back the original faces """
+    faces = np.asarray(faces, np.int64).reshape(-1, 3)
+    # collapse on welded positions, so texture or normal seams stay closed
+    positions, first, welded = np.unique(np.asarray(vertices, np.float64), axis=0,
+                                         return_index=True, return_inverse=True)
+    welded = welded.ravel()
+    corners = welded[faces]
+    valid = ((corners[:, 0] != corners[:, 1]) & (corners[:, 1] != corners[:, 2])
+             & (corners[:, 2] != corners[:, 0]))
+    quadrics = _quadrics(positions, corners[valid], faces[valid])
+    homogeneous = np.hstack((positions, np.ones((len(positions), 1))))
+
+    topology = corners.tolist()           # welded position of each corner
+    originals = faces.tolist()            # vertex of each corner
+    alive = valid.tolist()
+    around = [set() for _ in positions]  # faces around each position
+    for face in np.flatnonzero(valid).tolist():
+        for position in topology[face]:
+            around[position].add(face)
+    stamps = [0] * len(positions)
+
+    def neighbours(position):
+        return {p for face in around[position] for p in topology[face]} - {position}
+
+    def push(heap, u, v):
+        """ cheapest half-edge collapse direction of edge (u, v) """
+        quadric = quadrics[u] + quadrics[v]
+        cost_uv = homogeneous[v] @ quadric @ homogeneous[v]
+        cost_vu = homogeneous[u] @ quadric @ homogeneous[u]
+        u, v, cost = (u, v, cost_uv) if cost_uv <= cost_vu else (v, u, cost_vu)
+        heapq.heappush(heap, (cost, u, v, stamps[u], stamps[v]))
+
+    heap = []
+    for u in range(len(positions)):
+        for v in neighbours(u):
+            if u < v:
+                push(heap, u, v)
+
+    levels, count = [], int(np.count_nonzero(valid))
+    targets = [int(len(faces) * ratio) for ratio in ratios]
+    for target in targets:
+        while count > target and heap:
+            _, u, v, stamp_u, stamp_v = heapq.heappop(heap)
+            if stamp_u != stamps[u] or stamp_v != stamps[v] or not around[u]:
+                continue  # outdated entry
+            shared = around[u] & around[v]
+            moved = around[u] - shared
+            # link condition keeps the surface manifold
+            if len(neighbours(u) & neighbours(v)) != len(shared):
+                continue
+            if not _keeps_orientation(homogeneous, topology, moved, u, v):
+                continue
+
+            # vertex of each moved corner at v: the one on its side of seams
+            targets_at_v = _seam_targets(topology, originals, around, shared, moved, u, v)
+            for face in shared:
+                alive[face] = False
+                for position in topology[face]:
+                    around[position].discard(face)
+            for face in moved:
+                slot = topology[face].index(u)
+                topology[face][slot] = v
+                originals[face][slot] = targets_at_v.get(face, int(first[v]))
+                around[v].add(face)
+            around[u] = set()
+            count -= len(shared)
+            quadrics[v] += quadrics[u]
+            stamps[v] += 1
+            for neighbour in neighbours(v):
+                push(heap, v, neighbour)
+
+        if target >= len(faces):
+            levels.append(faces.astype(np.uint32))
+        else:
+            kept = [originals[face] for face in range(len(faces)) if alive[face]]
+            levels.append(np.array(kept, np.uint32).reshape(-1, 3))
+    return levels
+
+def _seam_targets(topology, originals, around, shared, moved, u, v):
+    """ vertex at v each face moved from u to v takes, so texture and normal
+        seams stay sharp: the one its own vertex at u is paired with across
+        the collapsed edge, else the one of a face around v sharing one of
+        its vertices. Faces missing are left to the first vertex at v """
+    pairs = {originals[face][topology[face].index(u)]: originals[face][topology[face].index(v)]
+             for face in shared}
+    targets = {}
+    for face in moved:
+        own = originals[face][topology[face].index(u)]
+        if own in pairs:
+            targets[face] = pairs[own]
+            continue
+        for other in around[v] - shared:
+            if set(originals[other]) & set(originals[face]):
+                targets[face] = originals[other][topology[other].index(v)]
+                break
+    return targets
+
+def _keeps_orientation(positions, topology, moved, u, v):
+    """ no moved triangle flips nor becomes degenerate when u goes to v """
+    if not moved:
+        return True
+    corners = np.array([topology[face] for face in moved])
+    before = positions[corners, :3]
+    after = positions[np.where(corners == u, v, corners), :3]
+    old = np.cross(before[:, 1] - before[:, 0], before[:, 2] - before[:, 0])
+    new = np.cross(after[:, 1] - after[:, 0], after[:, 2] - after[:, 0])
+    return bool(((old * new).sum(axis=1) > 1e-12 * (old * old).sum(axis=1)).all())
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Fixed timestep scene updates, separate from rendering: Node.update() runs
+every 'step' seconds of the clock, in the render loop or on a worker
+thread, and the render interpolates between the last two states
+"""
+import threading
+import time
+import glfw                         # lean window system wrapper for OpenGL
+import numpy as np
+from opengl_tools.node import Node
+from opengl_tools.transform import matrix_slerp
+
+STEP = 1 / 60                       # seconds of simulation per update
+MAX_STEPS = 8                       # updates to catch up at most, then skip ahead
+
+def updatable(drawables):
+    """ Nodes below drawables with their own update() """
+    stack, nodes = list(drawables), []
+    while stack:
+        drawable = stack.pop()
+        if isinstance(drawable, Node):
+            if type(drawable).update is not Node.update:
+                nodes.append(drawable)
+            stack.extend(drawable.frozen if drawable.frozen is not None else drawable.children)
+    return nodes
+
+class Simulation:
+    """ Runs update(step, time, inputs) of the updatable nodes at a fixed
+        step. States are arrays of their local transforms: the last two,
+        plus a back buffer written by the updates, rotated under a lock.
+        inputs is set from the render thread (keys held) """
+
+    def __init__(self, drawables=(), step=STEP, threaded=False, clock=glfw.get_time):
+        self.step, self.clock = step, clock
+        self.drawables, self.inputs = list(drawables), frozenset()
+        self.lock = threading.Lock()
+        self.time = None                # time of the current state
+        self.applied = None             # (state time, fraction) last applied
+        self.thread, self.running = None, False
+        self.rescan()
+        if threaded:
+            self.start()
+
+    def add(self, *drawables):
+        """ simulate the nodes below drawables too """
+        self.drawables.extend(drawables)
+        self.rescan()
+
+    def rescan(self):
+        """ find the updatable nodes again, after the scene changed """
+        with self.lock:
+            self.nodes = updatable(self.drawables)
+            transforms = np.array([node.transform for node in self.nodes], np.float32).reshape(-1, 4, 4)
+            self.previous, self.current, self.back = transforms, transforms.copy(), transforms.copy()
+
+    def _update(self, time_):
+        """ one step into the back buffer, then rotate the buffers """
+        nodes, back = self.nodes, self.back
+        for number, node in enumerate(nodes):
+            transform = node.update(self.step, time_, self.inputs)
+            back[number] = self.current[number] if transform is None else transform
+        with self.lock:
+            if nodes is self.nodes:     # not rescanned meanwhile
+                self.previous, self.current, self.back = self.current, back, self.previous
+                self.time = time_
+
+    def advance(self):
+        """ render loop driven mode: the updates due since last call """
+        now = self.clock()
+        if self.time is None or not 0 <= now - self.time <= MAX_STEPS * self.step:
+            # first call, clock set back or too far behind: restart at now
+            self._update(now - self.step)
+            self._update(now)
+            return
+        while now - self.time >= self.step:
+            self._update(self.time + self.step)
+
+    def apply(self):
+        """ set the node transforms between the last two states, from the
+            clock time since the current one. Render thread only """
+        with self.lock:
+            if self.time is None:
+                return
+            fraction = min(max((self.clock() - self.time) / self.step, 0.), 1.)
+            previous, current, nodes = self.previous.copy(), self.current.copy(), self.nodes
+            key = (self.time, fraction)
+        if key == self.applied:
+            return
+        for node, start, end in zip(nodes, previous, current):
+            node.transform = matrix_slerp(start, end, fraction)
+        self.applied = key
+
+    def moving(self):
+        """ True while the last two states differ, i.e. frames are needed """
+        with self.lock:
+            return not np.array_equal(self.previous, self.current)
+
+    # -------------- worker thread mode ----------------------------------------
+    def start(self):
+        """ run the updates on a worker thread until stop() """
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='simulation', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            try:
+                self.advance()
+            except Exception as error:  # pylint: disable=broad-except
+                print('ERROR: simulation stopped,', error)
+                self.running = False
+            time.sleep(max(self.time + self.step - self.clock(), 0.001))
+
+    def stop(self):
+        """ end the worker thread, if any """
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
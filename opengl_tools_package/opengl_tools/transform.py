@@ -118,6 +118,12 @@ def lookat(eye, target, up):
     return rotation @ translate(-eye)
 
 
+def normal_matrix(model):
+    """ 3x3 matrix transforming normals for a 4x4 model matrix: inverse
+        transpose of its upper left part """
+    return np.linalg.inv(np.asarray(model, 'f')[:3, :3]).T.astype('f')
+
+
 # quaternion functions -------------------------------------------------------
 def quaternion(x=vec(0., 0., 0.), y=0.0, z=0.0, w=1.0):
     """ Init quaternion, w=real and, x,y,z or vector x imaginary components """
@@ -177,6 +183,42 @@ def quaternion_slerp(q0, q1, fraction):
     return q0*math.cos(theta) + q2*math.sin(theta)
 
 
+def quaternion_from_matrix(matrix):
+    """ Unit quaternion of the rotation in a 3x3 or 4x4 matrix (no scale) """
+    m = np.asarray(matrix, np.float64)
+    trace = m[0, 0] + m[1, 1] + m[2, 2]
+    if trace > 0:
+        s = 2 * math.sqrt(trace + 1)
+        w, x, y, z = s / 4, (m[2, 1] - m[1, 2]) / s, (m[0, 2] - m[2, 0]) / s, (m[1, 0] - m[0, 1]) / s
+    elif m[0, 0] > m[1, 1] and m[0, 0] > m[2, 2]:
+        s = 2 * math.sqrt(1 + m[0, 0] - m[1, 1] - m[2, 2])
+        w, x, y, z = (m[2, 1] - m[1, 2]) / s, s / 4, (m[0, 1] + m[1, 0]) / s, (m[0, 2] + m[2, 0]) / s
+    elif m[1, 1] > m[2, 2]:
+        s = 2 * math.sqrt(1 + m[1, 1] - m[0, 0] - m[2, 2])
+        w, x, y, z = (m[0, 2] - m[2, 0]) / s, (m[0, 1] + m[1, 0]) / s, s / 4, (m[1, 2] + m[2, 1]) / s
+    else:
+        s = 2 * math.sqrt(1 + m[2, 2] - m[0, 0] - m[1, 1])
+        w, x, y, z = (m[1, 0] - m[0, 1]) / s, (m[0, 2] + m[2, 0]) / s, (m[1, 2] + m[2, 1]) / s, s / 4
+    return quaternion(x, y, z, w)
+
+
+def matrix_slerp(matrix_a, matrix_b, fraction):
+    """ 4x4 transform between two others by 'fraction': translations and
+        scales interpolated linearly, rotations spherically (shear is lost) """
+    if np.array_equal(matrix_a, matrix_b):
+        return matrix_b
+    scales, rotations = [], []
+    for matrix in (np.asarray(matrix_a, np.float64), np.asarray(matrix_b, np.float64)):
+        scale_ = np.maximum(np.linalg.norm(matrix[:3, :3], axis=0), 1e-12)
+        scale_[0] *= -1 if np.linalg.det(matrix[:3, :3]) < 0 else 1   # mirrored
+        scales.append(scale_)
+        rotations.append(quaternion_from_matrix(matrix[:3, :3] / scale_))
+    result = quaternion_matrix(quaternion_slerp(*rotations, fraction))
+    result[:3, :3] *= lerp(*scales, fraction)
+    result[:3, 3] = lerp(np.asarray(matrix_a)[:3, 3], np.asarray(matrix_b)[:3, 3], fraction)
+    return result
+
+
 # a trackball class based on provided quaternion functions -------------------
 class Trackball:
     """Virtual trackball for 3D scene viewing. Independent of window system."""
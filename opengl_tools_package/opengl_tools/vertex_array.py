@@ -4,26 +4,80 @@
 Low Level OpenGL Wrapper for VertexArray
 """
 
-import OpenGL.GL as GL              # standard Python OpenGL wrapper
+import ctypes
+from collections import namedtuple
+from opengl_tools.gl import GL      # OpenGL functions, see opengl_tools.gl
 import numpy as np
 from opengl_tools.transform import translate, rotate, scale, vec, frustum, perspective
 
+# GL component type of each numpy dtype, for attributes and indices
+GL_TYPES = {np.dtype(np.int8): GL.GL_BYTE, np.dtype(np.uint8): GL.GL_UNSIGNED_BYTE,
+            np.dtype(np.int16): GL.GL_SHORT, np.dtype(np.uint16): GL.GL_UNSIGNED_SHORT,
+            np.dtype(np.int32): GL.GL_INT, np.dtype(np.uint32): GL.GL_UNSIGNED_INT,
+            np.dtype(np.float32): GL.GL_FLOAT, np.dtype(np.float64): GL.GL_DOUBLE}
+
+# GL index type of each numpy dtype glDrawElements accepts, others are
+# uploaded as uint32
+INDEX_TYPES = {np.dtype(np.uint8): GL.GL_UNSIGNED_BYTE, np.dtype(np.uint16): GL.GL_UNSIGNED_SHORT,
+               np.dtype(np.uint32): GL.GL_UNSIGNED_INT}
+
+# Attribute read from a shared (possibly interleaved) buffer: 'data' is the
+# whole buffer uploaded once, the other fields are glVertexAttribPointer's
+Attribute = namedtuple('Attribute', 'data size type normalized stride offset count')
+
+DTYPES = {gl_type: dtype for dtype, gl_type in GL_TYPES.items()}
+
+def packed(data):
+    """ contiguous copy of an array or interleaved Attribute view """
+    if isinstance(data, Attribute):
+        dtype = DTYPES[data.type]
+        stride = data.stride or data.size * dtype.itemsize
+        data = np.ndarray((data.count, data.size), dtype, data.data, data.offset,
+                          (stride, dtype.itemsize))
+    return np.ascontiguousarray(data)
+
 class VertexArray:
     def __init__(self, attributes, index=None, usage=GL.GL_STATIC_DRAW):
 
         self.index = index
+        self.count = 0                                  # vertex count for glDrawArrays
         self.glid = GL.glGenVertexArrays(1)            # create a vertex array OpenGL identifier
         GL.glBindVertexArray(self.glid)                # make it active for receiving state below
         self.buffers = []
+        shared = {}                                    # id(data) => buffer, for interleaved views
 
         for number, data in enumerate(attributes):
+            if data is None:                                # keep layout location free
+                continue
+            if isinstance(data, Attribute):
+                if id(data.data) not in shared:
+                    self.buffers += [GL.glGenBuffers(1)]
+                    shared[id(data.data)] = self.buffers[-1]
+                    GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffers[-1])
+                    GL.glBufferData(GL.GL_ARRAY_BUFFER, data.data, usage)
+                GL.glEnableVertexAttribArray(number)
+                GL.glBindBuffer(GL.GL_ARRAY_BUFFER, shared[id(data.data)])
+                GL.glVertexAttribPointer(number, data.size, data.type, data.normalized,
+                                         data.stride, ctypes.c_void_p(data.offset))
+                self.count = self.count or data.count
+                continue
+
+            data = np.asarray(data)
+            size = data.shape[-1] if data.ndim > 1 else 3   # components per vertex
             self.buffers += [GL.glGenBuffers(1)]            # create one OpenGL buffer for our position attribute
             GL.glEnableVertexAttribArray(number)           # assign state below to shader attribute layout = 0
-            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffers[number])                    # our created position buffer
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffers[-1])                    # our created position buffer
             GL.glBufferData(GL.GL_ARRAY_BUFFER, data, usage)   # upload our vertex data to it
-            GL.glVertexAttribPointer(number, 3, GL.GL_FLOAT, False, 0, None)        # describe array unit as 2 floats
+            GL.glVertexAttribPointer(number, size, GL_TYPES.get(data.dtype, GL.GL_FLOAT), False, 0, None)
+            self.count = self.count or data.size // size
 
         if index is not None:
+            index = np.asarray(index)
+            if index.dtype not in INDEX_TYPES:
+                index = np.asarray(index, np.uint32)    # signed, e.g. pyassimp faces
+            self.index = index
+            self.index_type = INDEX_TYPES[index.dtype]
+            self.index_bytes = index.dtype.itemsize
             self.buffers += [GL.glGenBuffers(1)]                                           # create GPU index buffer
             GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.buffers[-1])                  # make it active to receive
             GL.glBufferData(GL.GL_ELEMENT_ARRAY_BUFFER, self.index, usage)     # our index array here
@@ -33,13 +87,16 @@ class VertexArray:
         GL.glBindVertexArray(0)
         GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
 
-    def draw(self, primitive=GL.GL_TRIANGLES):
+    def draw(self, primitive=GL.GL_TRIANGLES, count=None, first=0):
+        """ draw all the vertices, or 'count' of them from the 'first' one """
         GL.glBindVertexArray(self.glid)                                         # activate our vertex array
 
         if self.index is not None:
-            GL.glDrawElements(primitive, self.index.size, GL.GL_UNSIGNED_INT, None)  # 9 indexed verts = 3 triangles
+            count = self.index.size if count is None else count
+            offset = ctypes.c_void_p(first * self.index_bytes) if first else None
+            GL.glDrawElements(primitive, count, self.index_type, offset)  # 9 indexed verts = 3 triangles
         else :
-            GL.glDrawArrays(primitive, 0, 3)
+            GL.glDrawArrays(primitive, first, self.count if count is None else count)
 
         GL.glBindVertexArray(0)
 
@@ -2,26 +2,42 @@
 """
 General viewer
 """
+import time
 import glfw                         # lean window system wrapper for OpenGL
-import OpenGL.GL as GL              # standard Python OpenGL wrapper
+import numpy as np
+from opengl_tools.gl import GL      # OpenGL functions, see opengl_tools.gl
 from itertools import cycle
-from opengl_tools.shader import Shader
+from opengl_tools.shader_registry import get_shader, registry
 from opengl_tools.shaders_glsl import COLOR_VERT, COLOR_FRAG_MULTIPLE, COLOR_FRAG_UNIFORM
 # Internal modules
 from opengl_tools.transform import Trackball, translate, rotate, scale, vec, frustum, perspective, identity
 from opengl_tools.pyramids import PyramidColored
+from opengl_tools.bvh import SceneBVH, pick_ray
+from opengl_tools.frame_uniforms import FrameUniforms, MAX_LIGHTS
+from opengl_tools.clustered import ClusteredLights
+from opengl_tools.deferred import DeferredRenderer
+from opengl_tools.shadows import ShadowMap, directional_matrices, spot_matrices
+from opengl_tools.geometry_pool import GeometryPool, supported as pool_supported
+from opengl_tools.node import Node
+from opengl_tools.simulation import Simulation, STEP
+from opengl_tools.inputs import events
+from opengl_tools.resolution import DynamicResolution
+from opengl_tools.capture import FrameCapture
+from opengl_tools.framebuffer import pool as framebuffer_pool
 
 class Viewer:
     """ GLFW viewer window, with classic initialization & graphics loop """
 
-    def __init__(self, vertex_shader, frag_shader, width=640, height=480):
+    def __init__(self, vertex_shader, frag_shader, width=640, height=480, defines=(),
+                 deferred=False, shadows=0, on_demand=False,
+                 step=STEP, threaded_updates=False, frame_budget=None):
 
         # version hints: create GL window with >= OpenGL 3.3 and core profile
         glfw.window_hint(glfw.CONTEXT_VERSION_MAJOR, 3)
         glfw.window_hint(glfw.CONTEXT_VERSION_MINOR, 3)
         glfw.window_hint(glfw.OPENGL_FORWARD_COMPAT, GL.GL_TRUE)
         glfw.window_hint(glfw.OPENGL_PROFILE, glfw.OPENGL_CORE_PROFILE)
-        glfw.window_hint(glfw.RESIZABLE, False)
+        glfw.window_hint(glfw.RESIZABLE, True)
         self.win = glfw.create_window(width, height, 'Viewer', None, None)
 
         # make win's OpenGL context current; no OpenGL calls can happen before
@@ -29,6 +45,10 @@ class Viewer:
 
         # register event handlers
         glfw.set_key_callback(self.win, self.on_key)
+        glfw.set_mouse_button_callback(self.win, self.on_mouse_button)
+        glfw.set_window_refresh_callback(self.win, lambda _win: self.request_redraw())
+        glfw.set_window_size_callback(self.win, self.on_window_size)
+        glfw.set_framebuffer_size_callback(self.win, self.on_framebuffer_size)
 
         # useful message to check OpenGL renderer characteristics
         print('OpenGL', GL.glGetString(GL.GL_VERSION).decode() + ', GLSL',
@@ -42,13 +62,24 @@ class Viewer:
         GL.glEnable(GL.GL_DEPTH_TEST)
         GL.glDepthFunc(GL.GL_LESS)
 
+        # deferred path: drawables fill a G-buffer, lit once per pixel
+        defines = tuple(defines) + (('DEFERRED',) if deferred else ())
+        # shadows: resolution of the shadow map of the first light, 0 for none
+        defines += ('SHADOWS',) if shadows else ()
+        self.deferred = DeferredRenderer(defines) if deferred else None
+        self.defines = defines
+
         # An hashmap of "name" => Shader()
         self.vertex_shader = vertex_shader
         self.frag_shader = frag_shader
-        self.shaders = Shader(self.vertex_shader, self.frag_shader)
+        self.shaders = get_shader(self.vertex_shader, self.frag_shader, defines) \
+            if vertex_shader is not None else None
 
         # initially empty list of object to draw
         self.drawables = []
+        self.geometry_pool = None       # static meshes, see add_static
+        # Node.update() at a fixed step, in draw_frame or on its own thread
+        self.simulation = Simulation(step=step, threaded=threaded_updates)
 
         # initialize trackball
         self.trackball = GLFWTrackball(self.win)
@@ -62,30 +93,170 @@ class Viewer:
 
         self.rotater = 2
 
+        # sizes kept up to date by the resize callbacks, not queried per frame
         self.winsize = glfw.get_window_size(self.win)
+        self.framebuffer_size = glfw.get_framebuffer_size(self.win)
+
+        # frame_budget: GPU milliseconds to hold by scaling the render size
+        self.resolution = DynamicResolution(frame_budget) if frame_budget else None
+
+        # recording of the frames drawn, see start_capture
+        self.capture = None
+
+        # picking structure, built on first pick
+        self.scene_bvh = None
+
+        # camera and lights shared by every shader, uploaded once per frame
+        self.frame_uniforms = FrameUniforms()
+        self.lights = [((1, 1, 1), (1, 1, 1))]
+        self.clustered_lights = None    # many point lights, see add_point_lights
+        self.shadow_map = ShadowMap(shadows) if shadows else None
+        self.shadow_bounds = ((0, 0, 0), 10)    # sphere (center, radius) to shadow
+
+        # keyboard and mouse, snapshot at the start of each frame
+        self.input = events
+
+        # on demand: wait for events, draw only when something changed
+        self.on_demand, self.idle_timeout = on_demand, 0.5
+        self.redraw = True
+        self.last_frame = None              # (Node.changes, view, projection)
+        self.metrics = {'frames': 0, 'wakeups': 0, 'idle_time': 0., 'idle_cpu': 0.}
 
     def run(self):
         """ Main render loop for this OpenGL window """
         while not glfw.window_should_close(self.win):
+            if self.minimized():
+                glfw.wait_events()      # nothing to draw into until restored
+                continue
+            if self.on_demand:
+                wall, cpu = time.perf_counter(), time.process_time()
+                if not self.needs_redraw():
+                    self.wait(wall, cpu)
+                    continue
 
-            # clear draw buffer
-            GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT);
-
-            # Create matrix
-            winsize = glfw.get_window_size(self.win)
-            view = self.trackball.view_matrix()
-            projection = self.trackball.projection_matrix(winsize)
-            model = identity()
-
-            # draw our scene objects
-            for drawable in self.drawables:
-                self.do_for_each_drawable(drawable, view, projection, model)
+            self.draw_frame()
+            if self.capture is not None:
+                self.capture.capture()  # read back frames later, not now
 
             # flush render commands, and swap draw buffers
             glfw.swap_buffers(self.win)
 
             # Poll for and process events
             glfw.poll_events()
+        self.simulation.stop()
+        self.stop_capture()
+        if self.on_demand:
+            print(self.idle_report())
+        if GL.count:
+            GL.report()                 # OPENGL_TOOLS_GL=count
+        registry.clear()                # programs go before the context does
+        framebuffer_pool.clear()        # and so do the free framebuffers
+
+    def minimized(self):
+        """ True while the window has no pixels to draw, cameras no aspect """
+        return 0 in self.winsize or 0 in self.framebuffer_size
+
+    def draw_frame(self):
+        """ clear, then draw every drawable with this frame's camera and lights """
+        if self.minimized():
+            return
+        # key bindings of this frame, scene updates due by now, then
+        # transforms in between the last two
+        self.simulation.inputs = self.input.frame().keys
+        if self.simulation.thread is None:
+            self.simulation.advance()
+        self.simulation.apply()
+
+        # Create matrix
+        view = self.trackball.view_matrix()
+        projection = self.trackball.projection_matrix(self.winsize)
+        model = identity()
+        viewport = self.framebuffer_size
+        shadow_matrix = None
+        if self.shadow_map is not None:
+            self.shadow_map.set_light(*self.shadow_light())
+            self.shadow_map.update(self.drawables)    # only if something moved
+            shadow_matrix = self.shadow_map.matrix
+
+        # clear draw buffer, offscreen at a scaled size under a frame budget
+        target = 0
+        if self.resolution is not None:
+            viewport = self.resolution.begin(viewport)
+            target = self.resolution.target.glid
+        else:
+            GL.glViewport(0, 0, *viewport)
+            GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
+        self.frame_uniforms.update(view, projection, self.lights, glfw.get_time(),
+                                   viewport, shadow_matrix)
+        if self.clustered_lights is not None:
+            self.clustered_lights.update(view, projection)
+
+        # draw our scene objects
+        if self.deferred is not None:
+            self.deferred.begin(viewport)
+        for drawable in self.drawables:
+            self.do_for_each_drawable(drawable, view, projection, model)
+        if self.deferred is not None:
+            self.deferred.end(view, projection, target)
+        if self.resolution is not None:
+            self.resolution.end(self.framebuffer_size)
+        GL.drain('the end of the frame')    # raw calls are not checked
+
+        self.metrics['frames'] += 1
+        self.redraw = False
+        self.last_frame = (Node.changes, view, projection)
+
+    # -------------- frame capture ---------------------------------------------
+    def start_capture(self, output='capture/%05d.png', fps=60):
+        """ record the frames drawn from now on, at the current window size
+            (resizing the window stops the recording), as PNG files or into
+            a video by ffmpeg, see FrameCapture """
+        self.stop_capture()
+        self.capture = FrameCapture(output, self.framebuffer_size, fps)
+        print('Capturing frames to', output)
+
+    def stop_capture(self):
+        """ end the recording, if any, once its frames are written """
+        if self.capture is not None:
+            self.capture.close()
+            print('Captured %(written)d frames, %(read_waits)d read and '
+                  '%(writer_waits)d writer waits' % self.capture.stats)
+            self.capture = None
+
+    # -------------- on demand rendering ---------------------------------------
+    def request_redraw(self):
+        """ draw a new frame at the next loop iteration """
+        self.redraw = True
+
+    def needs_redraw(self):
+        """ True if input arrived, a key is held, a Node changed or is
+            animating or simulated moving, or the camera moved since the
+            last frame """
+        if self.minimized():
+            return False
+        if self.redraw or self.input.keys or self.last_frame is None or self.simulation.moving():
+            return True
+        changes, view, projection = self.last_frame
+        if changes != Node.changes or any(node.animating() for node in Node.animations):
+            return True
+        return not (np.array_equal(view, self.trackball.view_matrix()) and
+                    np.array_equal(projection, self.trackball.projection_matrix(self.winsize)))
+
+    def wait(self, wall, cpu):
+        """ sleep until an event or idle_timeout, adding the wall and CPU
+            time since perf_counter() wall and process_time() cpu to the
+            idle metrics """
+        glfw.wait_events_timeout(self.idle_timeout)
+        self.metrics['wakeups'] += 1
+        self.metrics['idle_time'] += time.perf_counter() - wall
+        self.metrics['idle_cpu'] += time.process_time() - cpu
+
+    def idle_report(self):
+        """ one line summary of the on demand metrics """
+        metrics = self.metrics
+        usage = metrics['idle_cpu'] / metrics['idle_time'] if metrics['idle_time'] else 0.
+        return 'Drew %d frames, idle %.1f s in %d wakeups at %.2f%% CPU' % (
+            metrics['frames'], metrics['idle_time'], metrics['wakeups'], 100 * usage)
 
     def do_for_each_drawable(self, drawable, view, projection, model, **param):
         """ What to do for each drawable """
@@ -95,9 +266,98 @@ class Viewer:
     def add(self, *drawables):
         """ add objects to draw in this window """
         self.drawables.extend(drawables)
+        self.simulation.add(*drawables)
+
+    def add_static(self, *drawables):
+        """ add objects that never move: their triangle meshes are copied,
+            pre-transformed, in a GeometryPool frustum culled on the GPU and
+            drawn in a single call. They cast shadows and can be picked """
+        if not pool_supported():
+            print('WARNING: no geometry pool before OpenGL 4.3, static objects drawn one by one')
+            self.add(*drawables)
+            return
+        if self.geometry_pool is None:
+            self.geometry_pool = GeometryPool(self.defines, culling=True)
+            self.add(self.geometry_pool)
+        self.geometry_pool.add_drawables(*drawables)
+
+    def add_light(self, direction, color=(1, 1, 1)):
+        """ add a directional light, coming from direction """
+        self._add_light(tuple(direction[:3]) + (0,), tuple(color[:3]) + (0,))
+
+    def add_point_light(self, position, color=(1, 1, 1), radius=10):
+        """ add a point light, fading out to nothing at distance radius """
+        self._add_light(tuple(position[:3]) + (1,), tuple(color[:3]) + (radius,))
+
+    def add_point_lights(self, positions, colors, radii):
+        """ add any number of point lights, culled per cluster: shaders
+            must be built with the 'CLUSTERED' define to see them """
+        if self.clustered_lights is None:
+            self.clustered_lights = ClusteredLights()
+        self.clustered_lights.add(positions, colors, radii)
+
+    def _add_light(self, position, color):
+        if len(self.lights) >= MAX_LIGHTS:
+            print('WARNING: more than %d lights, light %s ignored' % (MAX_LIGHTS, position))
+            return
+        self.lights.append((position, color))
+
+    def shadow_light(self):
+        """ (view, projection) of the first light around shadow_bounds: a
+            directional light, or a spot light aimed at the center """
+        center, radius = self.shadow_bounds
+        position = self.lights[0][0]
+        if len(position) < 4 or position[3] == 0:
+            return directional_matrices(position, center, radius)
+        position = vec(position[:3])
+        distance = np.linalg.norm(vec(center) - position)
+        angle = 2 * np.degrees(np.arcsin(min(radius / max(distance, 1e-6), 1)))
+        return spot_matrices(position, vec(center) - position, min(angle, 120),
+                             max(distance - radius, 0.1), distance + radius)
+
+    def pick(self, position):
+        """ Hit (node, mesh, triangle, barycentric, distance, point) under a
+            window position with y going up, None if nothing is there """
+        if self.minimized():
+            return None
+        if self.scene_bvh is None:
+            self.scene_bvh = SceneBVH(self.drawables)
+        else:
+            self.scene_bvh.update()     # refit on moved nodes
+        origin, direction = pick_ray(position, self.winsize, self.trackball.view_matrix(),
+                                     self.trackball.projection_matrix(self.winsize))
+        return self.scene_bvh.intersect(origin, direction)
+
+    def on_pick(self, hit):
+        """ What to do with the result of a middle click pick """
+        if hit is not None:
+            name = hit.node.name if hit.node is not None else ''
+            print('Picked %s triangle %d at %s' % (name, hit.triangle, hit.point))
+
+    def on_window_size(self, _win, width, height):
+        """ new window size in screen coordinates, for cameras and mouse """
+        self.winsize = self.trackball.winsize = (width, height)
+        self.request_redraw()
+
+    def on_framebuffer_size(self, _win, width, height):
+        """ new window size in pixels, for the viewport """
+        self.framebuffer_size = (width, height)
+        if self.capture is not None and self.capture.size != self.framebuffer_size:
+            print('WARNING: window resized, frame capture stopped')
+            self.stop_capture()         # its frames keep the size they began with
+        self.request_redraw()
+
+    def on_mouse_button(self, _win, button, action, _mods):
+        """ Middle click picks the object under the mouse """
+        self.request_redraw()
+        self.input.on_mouse_button(button, action)
+        if button == glfw.MOUSE_BUTTON_MIDDLE and action == glfw.PRESS:
+            self.on_pick(self.pick(self.trackball.mouse))
 
     def on_key(self, _win, key, _scancode, action, _mods):
-        """ 'Q' or 'Escape' quits """
+        """ 'Q' or 'Escape' quits, F12 starts and stops capturing frames """
+        self.request_redraw()
+        self.input.on_key(key, action)  # for bindings and held keys
         if action == glfw.PRESS or action == glfw.REPEAT:
             if key == glfw.KEY_ESCAPE or key == glfw.KEY_Q:
                 glfw.set_window_should_close(self.win, True)
@@ -113,6 +373,11 @@ class Viewer:
                 self.color = (r, g, b)
             elif key == glfw.KEY_W:
                 GL.glPolygonMode(GL.GL_FRONT_AND_BACK, next(self.fill_modes))
+            elif key == glfw.KEY_F12 and action == glfw.PRESS:
+                if self.capture is None:
+                    self.start_capture()
+                else:
+                    self.stop_capture()
 
 class GLFWTrackball(Trackball):
     """ Use in Viewer for interactive viewpoint control """
@@ -121,18 +386,20 @@ class GLFWTrackball(Trackball):
         """ Init needs a GLFW window handler 'win' to register callbacks """
         super().__init__()
         self.mouse = (0, 0)
+        self.winsize = glfw.get_window_size(win)    # the Viewer keeps it current
         glfw.set_cursor_pos_callback(win, self.on_mouse_move)
         glfw.set_scroll_callback(win, self.on_scroll)
 
-    def on_mouse_move(self, win, xpos, ypos):
+    def on_mouse_move(self, _win, xpos, ypos):
         """ Rotate on left-click & drag, pan on right-click & drag """
         old = self.mouse
-        self.mouse = (xpos, glfw.get_window_size(win)[1] - ypos)
-        if glfw.get_mouse_button(win, glfw.MOUSE_BUTTON_LEFT):
-            self.drag(old, self.mouse, glfw.get_window_size(win))
-        if glfw.get_mouse_button(win, glfw.MOUSE_BUTTON_RIGHT):
+        self.mouse = (xpos, self.winsize[1] - ypos)
+        events.on_mouse_move(self.mouse)
+        if glfw.MOUSE_BUTTON_LEFT in events.buttons:
+            self.drag(old, self.mouse, self.winsize)
+        if glfw.MOUSE_BUTTON_RIGHT in events.buttons:
             self.pan(old, self.mouse)
 
-    def on_scroll(self, win, _deltax, deltay):
+    def on_scroll(self, _win, _deltax, deltay):
         """ Scroll controls the camera distance to trackball center """
-        self.zoom(deltay, glfw.get_window_size(win)[1])
+        self.zoom(deltay, self.winsize[1])
@@ -97,56 +97,81 @@ def _inv(matrix4x4):
             ( m0[2]*m1[1]*m3[0] - m0[1]*m1[2]*m3[0] - m0[2]*m1[0]*m3[1] + m0[0]*m1[2]*m3[1] + m0[1]*m1[0]*m3[2] - m0[0]*m1[1]*m3[2]) /det,
             ( m0[1]*m1[2]*m2[0] - m0[2]*m1[1]*m2[0] + m0[2]*m1[0]*m2[1] - m0[0]*m1[2]*m2[1] - m0[1]*m1[0]*m2[2] + m0[0]*m1[1]*m2[2]) /det]]
 
-def get_bounding_box(scene):
+WORLD_BOUNDS_CACHE = 8              # transformations remembered per mesh
+
+def _mul(a, b):
+    """ 4x4 matrix product, for when numpy is missing """
+    return [[sum(a[i][k] * b[k][j] for k in range(4)) for j in range(4)]
+            for i in range(4)]
+
+def _local_bounds(mesh):
+    """ (min, max) of the mesh vertices in its own space, cached on the mesh """
+    bounds = getattr(mesh, '_local_bounds', None)
+    if bounds is None:
+        vertices = numpy.asarray(mesh.vertices, dtype=numpy.float64).reshape(-1, 3)
+        bounds = (vertices.min(axis=0), vertices.max(axis=0))
+        mesh._local_bounds = bounds
+    return bounds
+
+def _mesh_bounds(mesh, transformation, exact):
+    """ (min, max) of a transformed mesh. Exact transforms all vertices in
+        one matmul (cached per transformation), otherwise the 8 corners of
+        the cached local box are transformed, which gives a looser box """
+    if not exact:
+        low, high = _local_bounds(mesh)
+        corners = numpy.array([[x, y, z] for x in (low[0], high[0])
+                               for y in (low[1], high[1]) for z in (low[2], high[2])])
+        corners = corners @ transformation[:3, :3].T + transformation[:3, 3]
+        return corners.min(axis=0), corners.max(axis=0)
+
+    cache = getattr(mesh, '_world_bounds', None)
+    if cache is None:
+        cache = mesh._world_bounds = {}
+    key = transformation.tobytes()
+    if key not in cache:
+        vertices = numpy.asarray(mesh.vertices, dtype=numpy.float64).reshape(-1, 3)
+        vertices = vertices @ transformation[:3, :3].T + transformation[:3, 3]
+        if len(cache) >= WORLD_BOUNDS_CACHE:
+            del cache[next(iter(cache))]    # oldest transformation
+        cache[key] = (vertices.min(axis=0), vertices.max(axis=0))
+    return cache[key]
+
+def get_bounding_box(scene, exact=True):
     bb_min = [1e10, 1e10, 1e10] # x,y,z
     bb_max = [-1e10, -1e10, -1e10] # x,y,z
     inv = numpy.linalg.inv if numpy else _inv
-    return get_bounding_box_for_node(scene.rootnode, bb_min, bb_max, inv(scene.rootnode.transformation))
-
-def get_bounding_box_for_node(node, bb_min, bb_max, transformation):
-
-    if numpy:
-        transformation = numpy.dot(transformation, node.transformation)
-    else:
-        t0,t1,t2,t3 = transformation
-        T0,T1,T2,T3 = node.transformation
-        transformation = [ [
-                t0[0]*T0[0] + t0[1]*T1[0] + t0[2]*T2[0] + t0[3]*T3[0],
-                t0[0]*T0[1] + t0[1]*T1[1] + t0[2]*T2[1] + t0[3]*T3[1],
-                t0[0]*T0[2] + t0[1]*T1[2] + t0[2]*T2[2] + t0[3]*T3[2],
-                t0[0]*T0[3] + t0[1]*T1[3] + t0[2]*T2[3] + t0[3]*T3[3]
-            ],[
-                t1[0]*T0[0] + t1[1]*T1[0] + t1[2]*T2[0] + t1[3]*T3[0],
-                t1[0]*T0[1] + t1[1]*T1[1] + t1[2]*T2[1] + t1[3]*T3[1],
-                t1[0]*T0[2] + t1[1]*T1[2] + t1[2]*T2[2] + t1[3]*T3[2],
-                t1[0]*T0[3] + t1[1]*T1[3] + t1[2]*T2[3] + t1[3]*T3[3]
-            ],[
-                t2[0]*T0[0] + t2[1]*T1[0] + t2[2]*T2[0] + t2[3]*T3[0],
-                t2[0]*T0[1] + t2[1]*T1[1] + t2[2]*T2[1] + t2[3]*T3[1],
-                t2[0]*T0[2] + t2[1]*T1[2] + t2[2]*T2[2] + t2[3]*T3[2],
-                t2[0]*T0[3] + t2[1]*T1[3] + t2[2]*T2[3] + t2[3]*T3[3]
-            ],[
-                t3[0]*T0[0] + t3[1]*T1[0] + t3[2]*T2[0] + t3[3]*T3[0],
-                t3[0]*T0[1] + t3[1]*T1[1] + t3[2]*T2[1] + t3[3]*T3[1],
-                t3[0]*T0[2] + t3[1]*T1[2] + t3[2]*T2[2] + t3[3]*T3[2],
-                t3[0]*T0[3] + t3[1]*T1[3] + t3[2]*T2[3] + t3[3]*T3[3]
-            ] ]
-
-    for mesh in node.meshes:
-        for v in mesh.vertices:
-            v = transform(v, transformation)
-            bb_min[0] = min(bb_min[0], v[0])
-            bb_min[1] = min(bb_min[1], v[1])
-            bb_min[2] = min(bb_min[2], v[2])
-            bb_max[0] = max(bb_max[0], v[0])
-            bb_max[1] = max(bb_max[1], v[1])
-            bb_max[2] = max(bb_max[2], v[2])
-
-
-    for child in node.children:
-        bb_min, bb_max = get_bounding_box_for_node(child, bb_min, bb_max, transformation)
-
-    return bb_min, bb_max
+    return get_bounding_box_for_node(scene.rootnode, bb_min, bb_max,
+                                     inv(scene.rootnode.transformation), exact)
+
+def get_bounding_box_for_node(node, bb_min, bb_max, transformation, exact=True):
+    """ grow (bb_min, bb_max) with every mesh below node, walking the node
+        tree with an explicit stack instead of recursion """
+    if not numpy:
+        stack = [(node, transformation)]
+        while stack:
+            node, transformation = stack.pop()
+            transformation = _mul(transformation, node.transformation)
+            for mesh in node.meshes:
+                for v in mesh.vertices:
+                    v = transform(v, transformation)
+                    bb_min = [min(bb_min[i], v[i]) for i in range(3)]
+                    bb_max = [max(bb_max[i], v[i]) for i in range(3)]
+            stack.extend((child, transformation) for child in node.children)
+        return bb_min, bb_max
+
+    low, high = numpy.array(bb_min, dtype=numpy.float64), numpy.array(bb_max, dtype=numpy.float64)
+    stack = [(node, numpy.asarray(transformation, dtype=numpy.float64))]
+    while stack:
+        node, transformation = stack.pop()
+        transformation = transformation @ numpy.asarray(node.transformation, dtype=numpy.float64)
+        for mesh in node.meshes:
+            if len(mesh.vertices):
+                mesh_low, mesh_high = _mesh_bounds(mesh, transformation, exact)
+                numpy.minimum(low, mesh_low, out=low)
+                numpy.maximum(high, mesh_high, out=high)
+        stack.extend((child, transformation) for child in node.children)
+
+    return low.tolist(), high.tolist()
 
 def try_load_functions(library_path, dll):
     '''